@@ -0,0 +1,3 @@
+'''
+Stand-alone performance benchmarks, run them from the project root with `python -m benchmarks.<name>`
+'''
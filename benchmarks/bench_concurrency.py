@@ -0,0 +1,114 @@
+'''
+SQLite concurrency: parallel reader processes (like gunicorn workers serving pages) next to one ingest writer,
+with the default engine settings and with the tuned engine of database.create_database_engine
+(WAL, synchronous=NORMAL, mmap, busy timeout).
+
+    python -m benchmarks.bench_concurrency --readers 4 --seconds 5
+'''
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import load_example_file
+from database import crud, sample_arrays
+from database.database import Base, create_database_engine
+from database.import_tool import _import_to_db
+
+
+def _session_factory(url, tuned):
+    if tuned:
+        engine = create_database_engine(url)
+    else:
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def _reader(url, tuned, seconds, results):
+    session_factory = _session_factory(url, tuned)
+    reads, errors, latencies = 0, 0, []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        db = session_factory()
+        start = time.perf_counter()
+        try:
+            crud.get_climber_workouts_with_measurements(db, 1)
+            sample_arrays.get_climber_measured_data_arrays(db, 1)
+            reads += 1
+            latencies.append(time.perf_counter() - start)
+        except OperationalError:
+            errors += 1
+        finally:
+            db.close()
+    results.put(("read", reads, errors, max(latencies, default=0)))
+
+
+def _writer(url, tuned, seconds, results):
+    session_factory = _session_factory(url, tuned)
+    weights = [20.0] * 100
+    writes, errors, iteration = 0, 0, 1
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        db = session_factory()
+        try:
+            crud.bulk_create_measured_data(db, 1, weights, first_iteration=100000 + iteration)
+            db.commit()
+            writes += 1
+            iteration += len(weights)
+        except OperationalError:
+            db.rollback()
+            errors += 1
+        finally:
+            db.close()
+    results.put(("write", writes, errors, 0))
+
+
+def _run(tuned, args):
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        session_factory = _session_factory(url, tuned)
+        Base.metadata.create_all(bind=session_factory.kw["bind"])
+        db = session_factory()
+        data = load_example_file()
+        for _ in range(args.workouts):
+            _import_to_db(db, data)
+        db.close()
+        session_factory.kw["bind"].dispose()
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_reader, args=(url, tuned, args.seconds, results))
+                     for _ in range(args.readers)]
+        processes.append(multiprocessing.Process(target=_writer, args=(url, tuned, args.seconds, results)))
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    reads = sum(outcome[1] for outcome in outcomes if outcome[0] == "read")
+    read_errors = sum(outcome[2] for outcome in outcomes if outcome[0] == "read")
+    worst_read = max(outcome[3] for outcome in outcomes if outcome[0] == "read")
+    _, writes, write_errors, _ = next(outcome for outcome in outcomes if outcome[0] == "write")
+    label = "tuned  " if tuned else "default"
+    print(f"{label}: {reads / args.seconds:7.1f} page reads/s ({read_errors} locked, worst {worst_read * 1000:.0f} ms), "
+          f"{writes / args.seconds:7.1f} writes/s ({write_errors} locked)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workouts", type=int, default=10)
+    args = parser.parse_args()
+
+    _run(False, args)
+    _run(True, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+'''
+Import throughput: legacy one-commit-per-sample path against the bulk single-transaction path.
+
+    python -m benchmarks.bench_import
+'''
+import argparse
+
+from benchmarks.common import temporary_database, load_example_file, timed
+from database import crud
+from database.import_tool import _import_to_db, _import_file_entities, IMPORT_CHUNK_SIZE
+from models import models
+
+
+def _legacy_import(db, data):
+    measurement = _import_file_entities(db, data)
+    db.commit()
+    for i, weight in enumerate(data["Measurement"]["measDataKg"]):
+        crud.create_measured_data(db=db, measured_data=models.MeasuredDataEntity(
+            measurement_id=measurement.id, iteration=i + 1, weight=weight))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--repeat", type=int, default=5, help="number of files imported by the bulk path")
+    args = parser.parse_args()
+
+    data = load_example_file()
+    samples = len(data["Measurement"]["measDataKg"])
+
+    with temporary_database() as session_factory:
+        db = session_factory()
+        _, elapsed = timed(_legacy_import, db, data)
+        db.close()
+    print(f"legacy : {samples} samples in {elapsed:.3f}s ({samples / elapsed:,.0f} samples/s)")
+
+    with temporary_database() as session_factory:
+        db = session_factory()
+        _, elapsed = timed(lambda: [_import_to_db(db, data, chunk_size=args.chunk_size) for _ in range(args.repeat)])
+        db.close()
+    total = samples * args.repeat
+    print(f"bulk   : {total} samples in {elapsed:.3f}s ({total / elapsed:,.0f} samples/s, chunk_size={args.chunk_size})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+'''
+Live ingestion load test: many simultaneous climbers pushing samples into their micro-batched buffers.
+Reports the stored samples per second and the worst event loop stall seen by a 10 ms ticker.
+
+    python -m benchmarks.bench_live_ingestion --climbers 50 --rate 100 --seconds 5
+'''
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import temporary_database
+from database import live_ingestion
+from models import models
+
+
+async def _producer(buffer, rate, seconds, chunk_period=0.1):
+    # A hangboard client sending its samples every `chunk_period` seconds
+    chunk = [20.0] * max(int(rate * chunk_period), 1)
+    for _ in range(int(seconds / chunk_period)):
+        await buffer.add(chunk)
+        await asyncio.sleep(chunk_period)
+    await live_ingestion.close_buffer(buffer)
+
+
+async def _ticker(stop, lags):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - start - 0.01)
+
+
+async def _run(session_factory, measurement_ids, args):
+    buffers = [await live_ingestion.open_buffer(measurement_id, session_factory=session_factory,
+                                                flush_size=args.flush_size, flush_interval=args.flush_interval)
+               for measurement_id in measurement_ids]
+    stop = asyncio.Event()
+    lags = []
+    ticker = asyncio.create_task(_ticker(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(_producer(buffer, args.rate, args.seconds) for buffer in buffers))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    return sum(buffer.stored for buffer in buffers), elapsed, max(lags)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--climbers", type=int, default=50)
+    parser.add_argument("--rate", type=int, default=100, help="samples per second and climber")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--flush-size", type=int, default=live_ingestion.LIVE_FLUSH_SIZE)
+    parser.add_argument("--flush-interval", type=float, default=live_ingestion.LIVE_FLUSH_INTERVAL)
+    args = parser.parse_args()
+
+    with temporary_database() as session_factory:
+        db = session_factory()
+        measurements = [models.MeasurementEntity(workout_id=index, current_repetition=1)
+                        for index in range(args.climbers)]
+        db.add_all(measurements)
+        db.commit()
+        measurement_ids = [measurement.id for measurement in measurements]
+        db.close()
+
+        stored, elapsed, max_lag = asyncio.run(_run(session_factory, measurement_ids, args))
+
+        db = session_factory()
+        in_database = db.query(models.MeasuredDataEntity).count()
+        db.close()
+
+    assert stored == in_database, (stored, in_database)
+    print(f"{args.climbers} climbers at {args.rate} Hz: {stored} samples stored in {elapsed:.2f}s "
+          f"({stored / elapsed:,.0f} samples/s, offered {args.climbers * args.rate:,} samples/s), "
+          f"max event loop stall {max_lag * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
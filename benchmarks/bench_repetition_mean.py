@@ -0,0 +1,40 @@
+'''
+computeRepetitionMean: vectorized implementation against the per-sample reference loop on long sessions.
+
+    python -m benchmarks.bench_repetition_mean
+'''
+import argparse
+
+import numpy as np
+
+from benchmarks.common import timed
+from compute.criticalForce import computeRepetitionMean, computeRepetitionMeanReference
+
+
+def critical_force_lookup_table(repetitions, active=7, pause=3):
+    # Per-second activity flags of the classic 7s on / 3s off critical force protocol, starting with a pause
+    return np.tile(np.concatenate((np.zeros(pause, dtype=int), np.ones(active, dtype=int))), repetitions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sample-rate", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for repetitions in (24, 240, 2400):
+        lookup_table = critical_force_lookup_table(repetitions)
+        meas_data = rng.normal(30, 5, len(lookup_table) * args.sample_rate)
+
+        expected, reference_time = timed(computeRepetitionMeanReference, meas_data, lookup_table, args.sample_rate)
+        result, vectorized_time = timed(computeRepetitionMean, meas_data, lookup_table, args.sample_rate)
+        max_error = np.max(np.abs(result - expected))
+        assert max_error < 1e-9, max_error
+
+        print(f"{len(meas_data):9} samples: loop {reference_time * 1000:9.1f} ms, "
+              f"vectorized {vectorized_time * 1000:7.1f} ms ({reference_time / vectorized_time:5.0f}x), "
+              f"max difference {max_error:.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+'''
+Sample storage: database size and read latency of one row per sample against one packed blob per measurement.
+
+    python -m benchmarks.bench_sample_storage
+'''
+import argparse
+import os
+
+import numpy as np
+
+from benchmarks.common import temporary_database, load_example_file, timed
+from database import crud, sample_arrays, sample_storage
+from database.import_tool import _import_file_entities
+
+
+def _database_size(session_factory):
+    engine = session_factory.kw["bind"]
+    engine.dispose()
+    return os.path.getsize(engine.url.database)
+
+
+def _fill(session_factory, data, measurements, mode, dtype):
+    db = session_factory()
+    measurement_ids = []
+    for _ in range(measurements):
+        measurement = _import_file_entities(db, data)
+        weights = data["Measurement"]["measDataKg"]
+        if mode == sample_storage.STORAGE_BLOB:
+            sample_arrays.create_measured_data_blob(db, measurement.id, weights, dtype=dtype)
+        else:
+            crud.bulk_create_measured_data(db, measurement.id, weights)
+        measurement_ids.append(measurement.id)
+    db.commit()
+    db.close()
+    return measurement_ids
+
+
+def _read_all(session_factory, measurement_ids):
+    db = session_factory()
+    arrays = [sample_arrays.get_measured_data_array(db, measurement_id) for measurement_id in measurement_ids]
+    db.close()
+    return arrays
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--measurements", type=int, default=50)
+    args = parser.parse_args()
+
+    data = load_example_file()
+    samples = len(data["Measurement"]["measDataKg"]) * args.measurements
+    reference = None
+    for mode, dtype in ((sample_storage.STORAGE_ROWS, None), (sample_storage.STORAGE_BLOB, "float64"),
+                        (sample_storage.STORAGE_BLOB, "float32")):
+        with temporary_database() as session_factory:
+            measurement_ids = _fill(session_factory, data, args.measurements, mode, dtype)
+            size = _database_size(session_factory)
+            arrays, elapsed = timed(_read_all, session_factory, measurement_ids)
+        if reference is None:
+            reference = arrays[0]
+        assert np.allclose(arrays[0], reference, atol=1e-5)
+        label = mode if dtype is None else f"{mode}/{dtype}"
+        print(f"{label:13}: {size / samples:6.1f} bytes/sample, "
+              f"read {args.measurements} measurements in {elapsed * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+'''
+Regression check of the application startup: `import main`, measured with `python -X importtime` in a fresh
+interpreter, must stay within a time budget and must not import the heavy modules that are only needed by some
+requests (NumPy and the modules using it, the job tasks, pyarrow). Exits with a non-zero status on
+regression.
+
+    python -m benchmarks.check_import_time [--budget-ms 1200 | --no-budget] [--runs 5]
+
+The best of `--runs` imports is compared with the budget, after a first import that compiles the bytecode.
+`--no-budget` only prints the import time, for machines whose timings are too noisy to enforce it (CI runners).
+'''
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+# Most of it is FastAPI, Pydantic and SQLAlchemy, adjust it to the machine running the check
+IMPORT_TIME_BUDGET_MS = 1200
+LAZY_MODULES = ("numpy", "compute.criticalForce", "compute.batch", "compute.preprocessing", "compute.protocol",
+                "compute.downsampling", "database.sample_arrays", "database.async_sample_arrays",
+                "database.sample_storage", "webapi.sample_export", "jobs.tasks", "database.import_tool", "pyarrow")
+
+_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|\s+(\S+)")
+
+
+def import_main(database_url):
+    """{module: cumulative microseconds} of a fresh `import main`"""
+    environment = {**os.environ, "DATABASE_URL": database_url}
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], env=environment,
+                             capture_output=True, text=True, check=True)
+    modules = {}
+    for line in process.stderr.splitlines():
+        match = _LINE.match(line)
+        if match is not None:
+            cumulative, module = match.groups()
+            modules[module] = int(cumulative)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the application")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_TIME_BUDGET_MS)
+    parser.add_argument("--no-budget", action="store_true",
+                        help="only check the lazily imported modules and the database file, not the import time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="number of slowest modules to print")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Importing the application must not touch the database, the file is never created
+        database_url = f"sqlite:///{os.path.join(directory, 'data.db')}"
+        import_main(database_url)
+        modules = min((import_main(database_url) for _ in range(args.runs)), key=lambda run: run["main"])
+        total = modules["main"]
+        created = os.listdir(directory)
+
+    for module, cumulative in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{cumulative / 1000:8.1f} ms  {module}")
+    budget = "not enforced" if args.no_budget else f"budget {args.budget_ms:.0f} ms"
+    print(f"import main: {total / 1000:.1f} ms ({budget})")
+
+    failed = False
+    if not args.no_budget and total / 1000 > args.budget_ms:
+        print("FAILED: the import time exceeds the budget")
+        failed = True
+    imported = [module for module in LAZY_MODULES if module in modules]
+    if imported:
+        print(f"FAILED: imported at startup instead of on first use: {', '.join(imported)}")
+        failed = True
+    if created:
+        print(f"FAILED: importing the application created {', '.join(created)}")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
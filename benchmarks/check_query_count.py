@@ -0,0 +1,89 @@
+'''
+Regression check: the climber workouts page must load, and the results of the workouts must be recomputed, with a
+constant number of SQL queries whatever the number of workouts of the climber. Exits with a non-zero status on
+regression.
+
+    python -m benchmarks.check_query_count
+'''
+import asyncio
+import sys
+import time
+
+from sqlalchemy import event
+
+from benchmarks.common import temporary_database, async_session_factory, load_example_file
+from database.import_tool import _import_to_db
+from database.workout_protocols import compute_workout_results
+from temp_ui.temp_ui import load_climber_workouts
+
+
+async def count_queries(async_factory, function, *args):
+    engine = async_factory.kw["bind"].sync_engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        async with async_factory() as db:
+            start = time.perf_counter()
+            result = await function(db, *args)
+            elapsed = time.perf_counter() - start
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        await async_factory.kw["bind"].dispose()
+    return len(statements), elapsed, result
+
+
+def count_recompute_queries(session_factory):
+    engine = session_factory.kw["bind"]
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        with session_factory() as db:
+            start = time.perf_counter()
+            computed = compute_workout_results(db, 1)
+            elapsed = time.perf_counter() - start
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements), elapsed, computed
+
+
+def main():
+    data = load_example_file()
+    query_counts = {}
+    recompute_query_counts = {}
+    for workout_count in (1, 5, 25):
+        with temporary_database() as session_factory:
+            db = session_factory()
+            for _ in range(workout_count):
+                _import_to_db(db, data)
+            db.close()
+            query_count, elapsed, (_, workouts) = asyncio.run(
+                count_queries(async_session_factory(session_factory), load_climber_workouts, 1))
+            recompute_query_count, recompute_elapsed, computed = count_recompute_queries(session_factory)
+        assert len(workouts) == workout_count and computed == workout_count
+        query_counts[workout_count] = query_count
+        recompute_query_counts[workout_count] = recompute_query_count
+        print(f"{workout_count:3} workouts: {query_count} queries, {elapsed * 1000:.1f} ms, "
+              f"recompute {recompute_query_count} queries, {recompute_elapsed * 1000:.1f} ms")
+
+    failed = False
+    if len(set(query_counts.values())) != 1:
+        print("FAILED: the number of queries of the page grows with the number of workouts")
+        failed = True
+    if len(set(recompute_query_counts.values())) != 1:
+        print("FAILED: the number of queries of the recompute grows with the number of workouts")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
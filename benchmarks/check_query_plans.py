@@ -0,0 +1,78 @@
+'''
+Regression check: the hot lookups must use an index, never a full table scan (SQLite EXPLAIN QUERY PLAN).
+Checked on a new database and on a database created with the schema before the indexes, upgraded by
+database.migrations. Exits with a non-zero status on regression.
+
+    python -m benchmarks.check_query_plans
+'''
+import sys
+
+from sqlalchemy import text
+
+from benchmarks.common import temporary_database
+from database.migrations import upgrade, schema_version
+from models import models
+
+# Indexes which did not exist in the first schema
+ADDED_INDEXES = ["ix_workout_climber_id_created_at", "ix_measurement_workout_id", "ix_climber_first_name_last_name"]
+
+
+def hot_queries(db):
+    return {
+        "workouts of a climber by date": db.query(models.WorkoutEntity)
+        .filter(models.WorkoutEntity.climber_id == 1)
+        .order_by(models.WorkoutEntity.created_at),
+        "measurements of workouts": db.query(models.MeasurementEntity)
+        .filter(models.MeasurementEntity.workout_id.in_([1, 2, 3])),
+        "climber by name": db.query(models.ClimberEntity).filter_by(first_name="Dude", last_name="None"),
+        "samples of a climber": db.query(models.MeasuredDataEntity.measurement_id, models.MeasuredDataEntity.weight)
+        .join(models.MeasurementEntity, models.MeasurementEntity.id == models.MeasuredDataEntity.measurement_id)
+        .join(models.WorkoutEntity, models.WorkoutEntity.id == models.MeasurementEntity.workout_id)
+        .filter(models.WorkoutEntity.climber_id == 1),
+    }
+
+
+def table_scans(db, query):
+    statement = query.statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True})
+    plan = [row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {statement}"))]
+    # "SCAN <table>" without an index is a full table scan, "SEARCH ... USING INDEX" is what we want
+    return [step for step in plan if step.startswith("SCAN") and "INDEX" not in step], plan
+
+
+def check(db, label):
+    failed = False
+    for name, query in hot_queries(db).items():
+        scans, plan = table_scans(db, query)
+        print(f"{label} - {name}: {'; '.join(plan)}")
+        if scans:
+            print(f"FAILED: table scan in '{name}'")
+            failed = True
+    return failed
+
+
+def main():
+    failed = False
+    with temporary_database() as session_factory:
+        db = session_factory()
+        failed |= check(db, "new database")
+        db.close()
+
+    with temporary_database() as session_factory:
+        engine = session_factory.kw["bind"]
+        with engine.begin() as connection:
+            for index in ADDED_INDEXES:
+                connection.execute(text(f"DROP INDEX {index}"))
+            connection.execute(text("CREATE INDEX ix_workout_climber_id ON workout (climber_id)"))
+            connection.execute(schema_version.delete())
+        upgrade(engine)
+        db = session_factory()
+        failed |= check(db, "upgraded database")
+        db.close()
+
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from database.database import create_database_engine, create_async_database_engine
+from database.migrations import migrate
+
+EXAMPLE_DATA_DIRECTORY = "./example_data"
+
+
+@contextmanager
+def temporary_database():
+    """Yield a session factory bound to a fresh SQLite file that is deleted afterwards"""
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_database_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        migrate(engine)
+        try:
+            yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        finally:
+            engine.dispose()
+
+
+def async_session_factory(session_factory):
+    """Async session factory on the database of a temporary_database session factory"""
+    engine = create_async_database_engine(str(session_factory.kw["bind"].url))
+    return async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+
+def load_example_file(filename="2025-02-20_Dude_cf.json"):
+    with open(os.path.join(EXAMPLE_DATA_DIRECTORY, filename), "r") as f:
+        return json.load(f)
+
+
+def timed(function, *args, **kwargs):
+    """Run `function` once and return (result, elapsed seconds)"""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -0,0 +1,226 @@
+'''
+Benchmark suite on synthetic data (see benchmarks/synthetic_data.py), results written as JSON so that two commits
+can be compared:
+
+- import: ingestion rate of import_tool.import_directory,
+- compute: computeRepetitionMean and computeCriticalForceAndWPrime on long signals,
+- climber_workouts: latency of the /climber/{id}/workouts page, with and without the response cache,
+- list_endpoints: latency and throughput of the webapi list endpoints under concurrent requests.
+
+    python -m benchmarks.suite --output benchmarks/results
+    python -m benchmarks.suite --compare benchmarks/results/<previous>.json
+
+The application reads DATABASE_URL at import time, so it is only imported once the suite database is set up.
+'''
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.synthetic_data import generate_files
+
+# Metrics where a higher value is better, the other ones are durations
+HIGHER_IS_BETTER = ("samples_per_second", "requests_per_second")
+REGRESSION_THRESHOLD = 1.2
+
+
+def _latency_stats(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95)),
+            "max_ms": float(latencies.max())}
+
+
+def bench_import(directory, workers, samples_per_file):
+    from database.database import SessionLocal
+    from database.import_tool import import_directory
+
+    with SessionLocal() as db:
+        start = time.perf_counter()
+        report = import_directory(db, directory, workers=workers)
+        elapsed = time.perf_counter() - start
+    samples = len(report["imported"]) * samples_per_file
+    return {"files": len(report["imported"]), "samples": samples, "seconds": elapsed,
+            "samples_per_second": samples / elapsed}
+
+
+def bench_compute(repetitions, sample_rate, rounds):
+    from benchmarks.bench_repetition_mean import critical_force_lookup_table
+    from compute.criticalForce import computeRepetitionMean, computeCriticalForceAndWPrime
+
+    rng = np.random.default_rng(0)
+    lookup_table = critical_force_lookup_table(repetitions)
+    meas_data = rng.normal(30, 5, len(lookup_table) * sample_rate)
+
+    def best_of(function, *args):
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            result = function(*args)
+            timings.append(time.perf_counter() - start)
+        return result, min(timings)
+
+    repetition_mean, repetition_mean_time = best_of(computeRepetitionMean, meas_data, lookup_table, sample_rate)
+    _, critical_force_time = best_of(computeCriticalForceAndWPrime, repetition_mean, 7)
+    return {"samples": len(meas_data), "repetition_mean_ms": repetition_mean_time * 1000,
+            "critical_force_ms": critical_force_time * 1000,
+            "samples_per_second": len(meas_data) / repetition_mean_time}
+
+
+async def bench_climber_workouts(client, climber_ids, requests):
+    from cache.response_cache import response_cache
+
+    results = {}
+    for mode in ("uncached", "cached"):
+        if mode == "cached":
+            for climber_id in climber_ids:
+                (await client.get(f"/climber/{climber_id}/workouts")).raise_for_status()
+        latencies = []
+        for i in range(requests):
+            if mode == "uncached":
+                response_cache.backend.clear()
+            start = time.perf_counter()
+            response = await client.get(f"/climber/{climber_ids[i % len(climber_ids)]}/workouts")
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+        results[mode] = _latency_stats(latencies)
+    return results
+
+
+async def bench_list_endpoints(client, concurrency, requests):
+    paths = ["/api/v1/climbers?limit=100", "/api/v1/workouts?limit=100", "/api/v1/measurements?limit=100",
+             "/api/v1/climber"]
+    results = {}
+    for path in paths:
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def fetch():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(fetch() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        results[path] = {**_latency_stats(latencies), "requests_per_second": requests / elapsed}
+    return results
+
+
+async def _bench_http(args):
+    import httpx
+
+    import main
+    from database.database import AsyncSessionLocal, async_engine
+    from database import async_crud
+
+    async with AsyncSessionLocal() as db:
+        climber_ids = [climber.id for climber in await async_crud.get_climbers(db)]
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return {
+                "climber_workouts": await bench_climber_workouts(client, climber_ids, args.requests),
+                "list_endpoints": await bench_list_endpoints(client, args.concurrency, args.requests * 5),
+            }
+    finally:
+        # Pooled aiosqlite connections keep a thread each, which would keep the process alive
+        await async_engine.dispose()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+def compare(previous, current):
+    """Print the metrics of `current` against `previous`, returns the names of the metrics that regressed"""
+    previous_metrics = dict(_flatten(previous["results"]))
+    regressions = []
+    for name, value in _flatten(current["results"]):
+        old = previous_metrics.get(name)
+        if not isinstance(value, (int, float)) or not old:
+            continue
+        ratio = value / old
+        slower = ratio < 1 / REGRESSION_THRESHOLD if name.endswith(HIGHER_IS_BETTER) else ratio > REGRESSION_THRESHOLD
+        # Maximum latencies are single samples, too noisy to flag regressions
+        if name.endswith(HIGHER_IS_BETTER) or (name.endswith("_ms") and not name.endswith("max_ms")) \
+                or name.endswith("seconds"):
+            print(f"{name:60} {old:12.2f} -> {value:12.2f} ({ratio:5.2f}x){'  REGRESSION' if slower else ''}")
+            if slower:
+                regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite on synthetic data")
+    parser.add_argument("--climbers", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=4, help="sessions per climber")
+    parser.add_argument("--samples", type=int, default=2400, help="samples per session")
+    parser.add_argument("--workers", type=int, default=None, help="import parser processes")
+    parser.add_argument("--repetitions", type=int, default=2400, help="repetitions of the long compute signal")
+    parser.add_argument("--sample-rate", type=int, default=100, help="sample rate of the long compute signal")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=50, help="requests per page benchmark")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", default="benchmarks/results", help="directory of the JSON results")
+    parser.add_argument("--compare", help="previous JSON results to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'suite.db')}"
+        data_directory = os.path.join(directory, "data")
+        generate_files(data_directory, args.climbers, args.sessions, args.samples)
+
+        from database.database import engine
+        from database.migrations import migrate
+
+        migrate(engine)
+
+        results = {"import": bench_import(data_directory, args.workers, args.samples)}
+        results["compute"] = bench_compute(args.repetitions, args.sample_rate, args.rounds)
+        results.update(asyncio.run(_bench_http(args)))
+        engine.dispose()
+
+    report = {
+        "commit": _git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "results": results,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{datetime.now():%Y%m%d-%H%M%S}-{report['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"results written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} metrics regressed by more than {REGRESSION_THRESHOLD}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+'''
+Synthetic climbing sessions in the format of example_data/*.json, for benchmarks at a larger scale.
+
+Critical force tests follow the 7s on / 3s off protocol with a force decaying from the max force towards the
+critical force, max isometric strength tests are a few 6s pulls separated by long rests. Sessions are sampled
+at 10 Hz like the example files.
+
+    python -m benchmarks.synthetic_data /tmp/synthetic --climbers 50 --sessions 4 --samples 2400
+'''
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+SAMPLE_RATE = 10
+CRITICAL_FORCE_WORKOUT = "Critical Force Test"
+MAX_ISO_STRENGTH_WORKOUT = "Max Isometric Finger Strength"
+ROUTE_GRADES = ("6a", "6b", "6c", "7a", "7b", "7c", "8a")
+BOULDER_GRADES = ("5+", "6A", "6B", "6C", "7A", "7A+", "7B")
+
+
+def generate_climber(rng, index: int):
+    height = float(rng.integers(155, 195))
+    return {
+        "name": f"Synthetic{index} Climber",
+        "age": int(rng.integers(14, 60)),
+        "gender": str(rng.choice(["m", "f"])),
+        "height": height,
+        "span": height + float(rng.integers(-5, 15)),
+        "routeGrade": str(rng.choice(ROUTE_GRADES)),
+        "boulderGrade": str(rng.choice(BOULDER_GRADES)),
+        "email": "",
+        "comment": "",
+    }
+
+
+def critical_force_signal(rng, samples: int, max_force: float, critical_force: float, active=7, pause=3):
+    # Each repetition: `active` seconds of pulling at a force decaying towards the critical force, `pause` seconds off
+    period = (active + pause) * SAMPLE_RATE
+    repetition = np.arange(samples) // period
+    in_repetition = np.arange(samples) % period
+    force = critical_force + (max_force - critical_force) * np.exp(-repetition / 6)
+    pulling = in_repetition < active * SAMPLE_RATE
+    signal = np.where(pulling, force, 0.12 * force)
+    return signal + rng.normal(0, 0.8, samples)
+
+
+def max_iso_strength_signal(rng, samples: int, max_force: float, pull=6, rest=120):
+    period = (pull + rest) * SAMPLE_RATE
+    pulling = np.arange(samples) % period < pull * SAMPLE_RATE
+    return np.where(pulling, max_force * rng.uniform(0.85, 1.0), 0.0) + rng.normal(0, 0.2, samples)
+
+
+def generate_session(rng, climber, workout: str, timestamp: datetime, samples: int):
+    body_weight = round(float(rng.uniform(50, 85)), 1)
+    max_force = body_weight * float(rng.uniform(0.8, 1.4))
+    critical_force = max_force * float(rng.uniform(0.3, 0.45))
+    if workout == CRITICAL_FORCE_WORKOUT:
+        signal = critical_force_signal(rng, samples, max_force, critical_force)
+    else:
+        signal = max_iso_strength_signal(rng, samples, max_force)
+        critical_force = 0.0
+    return {
+        "Personal": climber,
+        "Measurement": {
+            "weight": body_weight,
+            "workout": workout,
+            "timestamp": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            "criticalForce": round(critical_force, 2),
+            "wPrime": 0.0,
+            "maxForce": round(max_force, 2),
+            "measDataKg": signal.tolist(),
+        },
+    }
+
+
+def generate_files(directory: str, climbers: int = 10, sessions: int = 4, samples: int = 2400, seed: int = 0):
+    """Write `sessions` json files per climber in `directory`, alternating critical force and max isometric
+    strength tests. Returns the written paths."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    start = datetime(2025, 1, 1, 18, 0, 0)
+    paths = []
+    for index in range(climbers):
+        climber = generate_climber(rng, index)
+        for session in range(sessions):
+            workout = CRITICAL_FORCE_WORKOUT if session % 2 == 0 else MAX_ISO_STRENGTH_WORKOUT
+            timestamp = start + timedelta(days=session * 3, minutes=index)
+            data = generate_session(rng, climber, workout, timestamp, samples)
+            kind = "cf" if workout == CRITICAL_FORCE_WORKOUT else "iso"
+            path = os.path.join(directory, f"{timestamp:%Y-%m-%d}_Synthetic{index}_{session}_{kind}.json")
+            with open(path, "w") as f:
+                json.dump(data, f)
+            paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic climbing session json files")
+    parser.add_argument("directory")
+    parser.add_argument("--climbers", type=int, default=10)
+    parser.add_argument("--sessions", type=int, default=4, help="sessions per climber")
+    parser.add_argument("--samples", type=int, default=2400, help="samples per session")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = generate_files(args.directory, args.climbers, args.sessions, args.samples, args.seed)
+    print(f"{len(paths)} files written to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
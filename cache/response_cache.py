@@ -0,0 +1,230 @@
+'''
+Cache of rendered pages and API reads.
+
+Entries are stored in a pluggable backend: the in-process LocalLRUCache (LRU eviction and TTL) by default, or Redis
+when RESPONSE_CACHE_REDIS_URL is set. Keys start with "climber:<id>:" or "climbers:" and also contain the latest
+updated_at of the cached data, and the entries of a climber are invalidated when a session commits a change of
+its data (see the session listeners at the bottom of this file).
+'''
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models.models import (
+    ClimberEntity,
+    WorkoutEntity,
+    MeasurementEntity,
+    MeasuredDataEntity,
+    MeasuredDataBlobEntity,
+    CriticalForceWorkoutEntity,
+    MaxIsoStrengthWorkoutEntity,
+)
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL")
+
+CLIMBER_LIST_PREFIX = "climbers:"
+
+
+def climber_prefix(climber_id: int):
+    return f"climber:{climber_id}:"
+
+
+class CacheBackend(ABC):
+    """Interface of the cache storages, values are bytes"""
+
+    @abstractmethod
+    def get(self, key: str):
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float):
+        ...
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+
+class LocalLRUCache(CacheBackend):
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache(CacheBackend):
+    # Shared between the gunicorn workers, needs the optional redis package
+    def __init__(self, url: str, namespace: str = "climb-grip:"):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self.namespace = namespace
+
+    def get(self, key):
+        return self._redis.get(self.namespace + key)
+
+    def set(self, key, value, ttl):
+        self._redis.set(self.namespace + key, value, px=int(ttl * 1000))
+
+    def delete_prefix(self, prefix):
+        keys = list(self._redis.scan_iter(match=self.namespace + prefix + "*"))
+        if keys:
+            self._redis.delete(*keys)
+
+    def clear(self):
+        self.delete_prefix("")
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, ttl: float = RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # The counters are updated from the threadpool of the sync routes and from the event loop
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str):
+        value = self.backend.get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes):
+        self.backend.set(key, value, self.ttl)
+
+    def invalidate_climbers(self, climber_ids):
+        for climber_id in climber_ids:
+            self.backend.delete_prefix(climber_prefix(climber_id))
+        self.backend.delete_prefix(CLIMBER_LIST_PREFIX)
+        with self._stats_lock:
+            self.invalidations += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {"backend": type(self.backend).__name__, "hits": self.hits, "misses": self.misses,
+                    "invalidations": self.invalidations}
+
+
+def _default_backend():
+    if RESPONSE_CACHE_REDIS_URL:
+        return RedisCache(RESPONSE_CACHE_REDIS_URL)
+    return LocalLRUCache()
+
+
+response_cache = ResponseCache(_default_backend())
+
+
+# Invalidation: the climbers whose data is written by a session are collected at flush (ORM writes) or by
+# mark_measurements_changed (bulk inserts), and their entries are dropped once the session commits
+_PENDING_CLIMBERS = "response_cache_climbers"
+
+
+def mark_climbers_changed(session, climber_ids):
+    session.info.setdefault(_PENDING_CLIMBERS, set()).update(climber_ids)
+
+
+def mark_measurements_changed(session, measurement_ids):
+    mark_climbers_changed(session, _climbers_of_measurements(session, measurement_ids))
+
+
+def mark_workouts_changed(session, workout_ids):
+    mark_climbers_changed(session, _climbers_of_workouts(session, workout_ids))
+
+
+def _climbers_of_workouts(session, workout_ids):
+    workout_ids = set(workout_ids)
+    if not workout_ids:
+        return set()
+    return set(session.connection().execute(
+        select(WorkoutEntity.__table__.c.climber_id).where(WorkoutEntity.__table__.c.id.in_(workout_ids))).scalars())
+
+
+def _climbers_of_measurements(session, measurement_ids):
+    measurement_ids = set(measurement_ids)
+    if not measurement_ids:
+        return set()
+    workout = WorkoutEntity.__table__
+    measurement = MeasurementEntity.__table__
+    return set(session.connection().execute(
+        select(workout.c.climber_id)
+        .join(measurement, measurement.c.workout_id == workout.c.id)
+        .where(measurement.c.id.in_(measurement_ids))).scalars())
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_climbers(session, flush_context):
+    climber_ids, workout_ids, measurement_ids = set(), set(), set()
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, ClimberEntity):
+            climber_ids.add(instance.id)
+        elif isinstance(instance, WorkoutEntity):
+            climber_ids.add(instance.climber_id)
+        elif isinstance(instance, (CriticalForceWorkoutEntity, MaxIsoStrengthWorkoutEntity)):
+            workout_ids.add(instance.workout_id)
+        elif isinstance(instance, MeasurementEntity):
+            workout_ids.add(instance.workout_id)
+        elif isinstance(instance, (MeasuredDataEntity, MeasuredDataBlobEntity)):
+            measurement_ids.add(instance.measurement_id)
+    climber_ids |= _climbers_of_workouts(session, workout_ids) | _climbers_of_measurements(session, measurement_ids)
+    climber_ids.discard(None)
+    if climber_ids:
+        mark_climbers_changed(session, climber_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_climbers(session):
+    climber_ids = session.info.pop(_PENDING_CLIMBERS, None)
+    if climber_ids:
+        response_cache.invalidate_climbers(climber_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_climbers(session):
+    session.info.pop(_PENDING_CLIMBERS, None)
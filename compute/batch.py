@@ -0,0 +1,83 @@
+'''
+Batch versions of the critical force computations: the results of N measurements are computed in one vectorized
+pass instead of N calls to computeCriticalForceAndWPrime and computeMaxForce.
+
+The repetition means are given either as a sequence of 1-D arrays (ragged) or as a padded 2-D matrix together
+with the length of each row. Results match the single measurement functions up to floating-point rounding.
+'''
+
+import numpy as np
+
+from compute.timing import timedCompute
+
+
+def flattenRepetitionMeans(repetitionMeans, lengths=None):
+    # Returns (values of all measurements concatenated, measurement index of each value, length of each measurement)
+    if lengths is None:
+        arrays = [np.asarray(repetitionMean, dtype=np.float64).ravel() for repetitionMean in repetitionMeans]
+        lengths = np.fromiter((len(array) for array in arrays), dtype=np.int64, count=len(arrays))
+        values = np.concatenate(arrays) if arrays else np.empty(0)
+    else:
+        matrix = np.asarray(repetitionMeans, dtype=np.float64).reshape(len(lengths), -1)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        values = matrix[np.arange(matrix.shape[1])[None, :] < lengths[:, None]]
+    segments = np.repeat(np.arange(len(lengths)), lengths)
+    return values, segments, lengths
+
+
+@timedCompute
+def computeCriticalForceAndWPrimeBatch(repetitionMeans, repetitionDuration, lengths=None):
+    return _criticalForceAndWPrime(*flattenRepetitionMeans(repetitionMeans, lengths), repetitionDuration)
+
+
+@timedCompute
+def computeMaxForceBatch(repetitionMeans, lengths=None):
+    # Measurements without any value get NaN
+    values, _, lengths = flattenRepetitionMeans(repetitionMeans, lengths)
+    return _maxForce(values, lengths)
+
+
+@timedCompute
+def computeWorkoutResultsBatch(repetitionMeans, repetitionDuration, lengths=None):
+    # Returns the (critical force, W', max force) arrays of all the measurements
+    values, segments, lengths = flattenRepetitionMeans(repetitionMeans, lengths)
+    cf, w = _criticalForceAndWPrime(values, segments, lengths, repetitionDuration)
+    return cf, w, _maxForce(values, lengths)
+
+
+def _criticalForceAndWPrime(values, segments, lengths, repetitionDuration):
+    numMeasurements = len(lengths)
+    total = np.bincount(segments, weights=values, minlength=numMeasurements)
+
+    # Remove zeros and duplicates: keep the last value of each run of equal values of a measurement
+    nonzero = values != 0
+    mean = values[nonzero]
+    segments = segments[nonzero]
+    keep = np.ones(len(mean), dtype=bool)
+    keep[:-1] = (mean[:-1] != mean[1:]) | (segments[:-1] != segments[1:])
+    mean = mean[keep]
+    segments = segments[keep]
+
+    # Take the last 6 measurements to compute the critical force
+    counts = np.bincount(segments, minlength=numMeasurements)
+    rankFromEnd = np.cumsum(counts)[segments] - np.arange(len(mean))
+    last = rankFromEnd <= 6
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cf = np.bincount(segments[last], weights=mean[last], minlength=numMeasurements) / np.minimum(counts, 6)
+
+    # Compute W'
+    w = (np.bincount(segments, weights=mean, minlength=numMeasurements) - counts * cf) * repetitionDuration
+
+    empty = total == 0
+    cf[empty] = 0
+    w[empty] = 0
+    return cf, w
+
+
+def _maxForce(values, lengths):
+    maxForce = np.full(len(lengths), np.nan)
+    filled = lengths > 0
+    if filled.any():
+        starts = (np.cumsum(lengths) - lengths)[filled]
+        maxForce[filled] = np.maximum.reduceat(values, starts)
+    return np.around(maxForce, decimals=2)
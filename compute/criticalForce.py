@@ -20,7 +20,62 @@
 
 import numpy as np
 
+from compute.timing import timedCompute
+
+@timedCompute
 def computeRepetitionMean(measData, lookupTable, sampleRate):
+    # Vectorized equivalent of computeRepetitionMeanReference: the samples of a repetition are counted from its
+    # rising edge (lookup value +1) to the next falling edge (-1) and their mean is written from the last rising edge.
+    # Results only differ from the loop by the floating-point rounding of the summation order.
+    lookupRsmpl = np.repeat(lookupTable, sampleRate)
+
+    assert(len(measData) == len(lookupRsmpl))
+    numSamples = len(lookupRsmpl)
+    result = np.zeros(numSamples)
+    if numSamples < 2:
+        return result
+    measData = np.asarray(measData)
+
+    diff = np.diff(lookupRsmpl)
+    rises = np.flatnonzero(diff == 1) + 1
+    falls = np.flatnonzero(diff == -1) + 1
+
+    # A sample is active when the last edge at or before it is a rising one
+    edge = np.zeros(numSamples, dtype=np.int8)
+    edge[rises] = 1
+    edge[falls] = -1
+    lastEdge = np.maximum.accumulate(np.where(edge != 0, np.arange(numSamples), 0))
+    active = edge[lastEdge] == 1
+
+    # Active samples are summed per falling edge: repetition k gathers the samples between falls k-1 and k
+    repetition = np.cumsum(edge == -1)
+    sums = np.bincount(repetition[active], weights=measData[active], minlength=len(falls) + 1)[:len(falls)]
+    counts = np.bincount(repetition[active], minlength=len(falls) + 1)[:len(falls)]
+    if np.any(counts == 0):
+        # Falling edge without any active sample since the previous one, the loop divides 0 by 0
+        raise ZeroDivisionError("division by zero")
+
+    # Start of the written range: last rising edge before the fall (or 0 if there is none)
+    lastRise = np.searchsorted(rises, falls) - 1
+    starts = np.where(lastRise >= 0, rises[np.maximum(lastRise, 0)], 0)
+
+    indices = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    writers = np.repeat(np.arange(len(falls)), counts)
+    inRange = indices < numSamples
+    indices, writers = indices[inRange], writers[inRange]
+    if np.all(starts[1:] >= starts[:-1] + counts[:-1]):
+        result[indices] = (sums / counts)[writers]
+    else:
+        # Ranges overlap for some non binary lookup tables, the latest repetition wins like in the loop
+        lastWriter = np.full(numSamples, -1)
+        np.maximum.at(lastWriter, indices, writers)
+        written = lastWriter >= 0
+        result[written] = (sums / counts)[lastWriter[written]]
+
+    return result
+
+def computeRepetitionMeanReference(measData, lookupTable, sampleRate):
+    # Original per-sample implementation, kept as the reference of computeRepetitionMean
     lookupRsmpl = np.repeat(lookupTable, sampleRate)
 
     assert(len(measData) == len(lookupRsmpl))
@@ -53,6 +108,7 @@ def computeRepetitionMean(measData, lookupTable, sampleRate):
 
     return result
 
+@timedCompute
 def computeCriticalForceAndWPrime(repetitionMean, repetitionDuration):
     if sum(repetitionMean) == 0:
         return 0, 0
@@ -71,6 +127,7 @@ def computeCriticalForceAndWPrime(repetitionMean, repetitionDuration):
 
     return cf, W
 
+@timedCompute
 def computeMaxForce(repetitionMean):
     return np.around(np.max(repetitionMean), decimals=2)
 
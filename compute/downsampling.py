@@ -0,0 +1,73 @@
+'''
+Downsampling of measured signals for the graphs, so that the number of plotted points stays bounded
+whatever the length of the session.
+'''
+
+import numpy as np
+
+from compute.downsamplingMethods import LTTB, MIN_MAX, METHODS
+
+
+def downsample(x, y, maxPoints, method=LTTB):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if not maxPoints or len(x) <= maxPoints:
+        return x, y
+    if method == LTTB:
+        return downsampleLttb(x, y, maxPoints)
+    if method == MIN_MAX:
+        return downsampleMinMax(x, y, maxPoints)
+    raise ValueError(f"Unknown downsampling method '{method}', expected one of {list(METHODS)}")
+
+
+def _bucketIndices(start, stop, numBuckets):
+    # Row i holds the indices of bucket i, padded with -1 (buckets differ in length by at most one sample)
+    edges = np.linspace(start, stop, numBuckets + 1).astype(np.int64)
+    lengths = np.diff(edges)
+    indices = edges[:-1, None] + np.arange(lengths.max())[None, :]
+    return np.where(indices < edges[1:, None], indices, -1), edges
+
+
+def downsampleMinMax(x, y, maxPoints):
+    # Keep the minimum and the maximum of each bucket, in time order
+    numBuckets = max(maxPoints // 2, 1)
+    indices, _ = _bucketIndices(0, len(x), numBuckets)
+    valid = indices >= 0
+    values = y[np.where(valid, indices, 0)]
+    rows = np.arange(numBuckets)
+    argMin = indices[rows, np.argmin(np.where(valid, values, np.inf), axis=1)]
+    argMax = indices[rows, np.argmax(np.where(valid, values, -np.inf), axis=1)]
+
+    keep = np.unique(np.concatenate((argMin, argMax)))
+    return x[keep], y[keep]
+
+
+def downsampleLttb(x, y, maxPoints):
+    # Largest-Triangle-Three-Buckets: the first and last samples are kept, the others are split in maxPoints - 2
+    # buckets and the sample forming the largest triangle with the previously kept sample and the mean of the
+    # next bucket is kept. The loop runs once per bucket, each bucket being processed with array operations.
+    if maxPoints < 3:
+        return x[[0, -1]], y[[0, -1]]
+    numBuckets = maxPoints - 2
+    indices, edges = _bucketIndices(1, len(x) - 1, numBuckets)
+    valid = indices >= 0
+    safeIndices = np.where(valid, indices, 0)
+    counts = valid.sum(axis=1)
+    meanX = np.where(valid, x[safeIndices], 0).sum(axis=1) / counts
+    meanY = np.where(valid, y[safeIndices], 0).sum(axis=1) / counts
+    # The bucket after the last one is the last sample
+    nextX = np.append(meanX[1:], x[-1])
+    nextY = np.append(meanY[1:], y[-1])
+
+    keep = np.empty(maxPoints, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = len(x) - 1
+    anchor = 0
+    for bucket in range(numBuckets):
+        candidates = np.arange(edges[bucket], edges[bucket + 1])
+        area = np.abs((x[anchor] - nextX[bucket]) * (y[candidates] - y[anchor])
+                      - (x[anchor] - x[candidates]) * (nextY[bucket] - y[anchor]))
+        anchor = candidates[np.argmax(area)]
+        keep[bucket + 1] = anchor
+
+    return x[keep], y[keep]
@@ -0,0 +1,8 @@
+'''
+Methods of compute.downsampling, kept without NumPy so that the pages can validate their query parameters
+without importing it.
+'''
+
+LTTB = "lttb"
+MIN_MAX = "minmax"
+METHODS = (LTTB, MIN_MAX)
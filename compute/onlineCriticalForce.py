@@ -0,0 +1,94 @@
+'''
+Incremental critical force computation for live tests.
+
+OnlineCriticalForce is fed the samples of a test chunk by chunk and emits the mean of every finished repetition
+together with the running critical force and W'. Its state is O(1) per repetition and, once the whole signal has
+been fed, its results are those of computeRepetitionMean followed by computeCriticalForceAndWPrime.
+'''
+
+from collections import deque
+
+import numpy as np
+
+
+class OnlineCriticalForce:
+    def __init__(self, lookupTable, sampleRate, repetitionDuration):
+        lookupTable = np.asarray(lookupTable)
+        if not np.all((lookupTable == 0) | (lookupTable == 1)):
+            raise ValueError("OnlineCriticalForce needs a lookup table of 0 (pause) and 1 (active) flags")
+        self.lookupRsmpl = np.repeat(lookupTable, sampleRate).astype(np.int8)
+        self.repetitionDuration = repetitionDuration
+
+        self.position = 0
+        self.repetitionMeans = []
+        self._active = False
+        self._sum = 0.0
+        self._ctr = 0
+        # Running state of computeCriticalForceAndWPrime: repetition means without zeros and duplicates
+        self._signalSum = 0.0
+        self._lastSix = deque(maxlen=6)
+        self._uniqueSum = 0.0
+        self._uniqueCount = 0
+
+    @property
+    def criticalForce(self):
+        if self._signalSum == 0:
+            return 0
+        return np.mean(self._lastSix)
+
+    @property
+    def wPrime(self):
+        if self._signalSum == 0:
+            return 0
+        return (self._uniqueSum - self._uniqueCount * self.criticalForce) * self.repetitionDuration
+
+    def feed(self, samples):
+        """Add the next samples of the signal, returns the repetitions finished by them as
+        {"repetition", "mean", "criticalForce", "wPrime"} dicts"""
+        samples = np.asarray(samples, dtype=np.float64)
+        start = self.position
+        stop = start + len(samples)
+        if stop > len(self.lookupRsmpl):
+            raise ValueError("More samples than the lookup table describes")
+        self.position = stop
+
+        # Edges of the activity flags in this chunk (global index i compares flag i with flag i - 1)
+        first = max(start, 1)
+        edges = first + np.flatnonzero(np.diff(self.lookupRsmpl[first - 1:stop]))
+
+        finished = []
+        segmentStart = start
+        for edge in edges:
+            self._accumulate(samples[segmentStart - start:edge - start])
+            segmentStart = edge
+            if self.lookupRsmpl[edge] == 1:
+                # New Active Time begins
+                self._active = True
+            else:
+                # New pause begins
+                finished.append(self._finishRepetition())
+        self._accumulate(samples[segmentStart - start:])
+        return finished
+
+    def _accumulate(self, samples):
+        if self._active and len(samples):
+            self._sum += samples.sum()
+            self._ctr += len(samples)
+
+    def _finishRepetition(self):
+        # Same division as the offline loop, including its error on an active start of the signal
+        mean = self._sum / self._ctr
+        count = self._ctr
+        self._sum = 0.0
+        self._ctr = 0
+        self._active = False
+
+        self.repetitionMeans.append(mean)
+        self._signalSum += mean * count
+        # Zeros and consecutive duplicates are removed before computing the critical force
+        if mean != 0 and not (self._lastSix and self._lastSix[-1] == mean):
+            self._lastSix.append(mean)
+            self._uniqueSum += mean
+            self._uniqueCount += 1
+        return {"repetition": len(self.repetitionMeans), "mean": mean, "criticalForce": self.criticalForce,
+                "wPrime": self.wPrime}
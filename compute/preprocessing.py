@@ -0,0 +1,237 @@
+'''
+Preprocessing of raw force signals before the critical force computations: gap filling, tare, spike removal,
+baseline drift correction and resampling to a canonical sample rate.
+
+Every stage is fed the signal chunk by chunk and returns the samples it can already output, so the same pipeline
+runs on a whole recording at import time and on a live stream. Stages keep only the few samples they need to look
+ahead or behind, and a chunked run outputs exactly the samples of a single feed(signal) followed by flush().
+
+    pipeline = createPipeline(sampleRate=10, targetRate=100)
+    clean = pipeline.run(signal)                  # whole signal
+    clean = pipeline.feed(chunk)                  # streaming, then pipeline.flush() at the end
+'''
+
+from abc import ABC, abstractmethod
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+_EMPTY = np.empty(0)
+
+
+class Stage(ABC):
+    @abstractmethod
+    def feed(self, samples):
+        """Process the next samples, returns the output samples that are ready"""
+
+    def flush(self):
+        """Output the samples held back at the end of the signal and reset the stage"""
+        return _EMPTY
+
+    def run(self, samples):
+        """Process a whole signal"""
+        return np.concatenate((self.feed(samples), self.flush()))
+
+
+class Pipeline(Stage):
+    def __init__(self, *stages):
+        self.stages = stages
+
+    def feed(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        for stage in self.stages:
+            samples = stage.feed(samples)
+        return samples
+
+    def flush(self):
+        # Samples flushed by a stage still go through the next stages before these are flushed
+        samples = _EMPTY
+        for stage in self.stages:
+            samples = np.concatenate((stage.feed(samples), stage.flush()))
+        return samples
+
+
+class GapFilling(Stage):
+    # Dropouts (NaN samples) are linearly interpolated between their neighbours, leading ones take the first valid
+    # value and trailing ones the last. A gap is held back until the next valid sample arrives.
+    def __init__(self):
+        self._last = None
+        self._gap = 0
+
+    def feed(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        valid = np.flatnonzero(~np.isnan(samples))
+        if len(valid) == 0:
+            self._gap += len(samples)
+            return _EMPTY
+        positions = np.arange(-self._gap, valid[-1] + 1)
+        if self._last is None:
+            result = np.interp(positions, valid, samples[valid])
+        else:
+            anchor = -self._gap - 1
+            result = np.interp(positions, np.concatenate(([anchor], valid)),
+                               np.concatenate(([self._last], samples[valid])))
+        self._last = samples[valid[-1]]
+        self._gap = len(samples) - 1 - valid[-1]
+        return result
+
+    def flush(self):
+        result = np.full(self._gap, self._last if self._last is not None else 0.0)
+        self._last, self._gap = None, 0
+        return result
+
+
+class Tare(Stage):
+    # Subtract the zero offset of the device: the median of the first tareSamples samples, recorded unloaded
+    def __init__(self, tareSamples):
+        self.tareSamples = max(int(tareSamples), 1)
+        self._offset = None
+        self._head = []
+
+    def feed(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        if self._offset is None:
+            self._head.append(samples)
+            head = np.concatenate(self._head)
+            if len(head) < self.tareSamples:
+                return _EMPTY
+            self._offset = np.median(head[:self.tareSamples])
+            self._head = []
+            samples = head
+        return samples - self._offset
+
+    def flush(self):
+        result = _EMPTY
+        if self._offset is None and self._head:
+            head = np.concatenate(self._head)
+            result = head - np.median(head) if len(head) else _EMPTY
+        self._offset, self._head = None, []
+        return result
+
+
+class MedianSpikeFilter(Stage):
+    # Samples further than `threshold` from the median of the `width` samples centred on them are replaced by this
+    # median. The signal edges are extended with their first and last samples.
+    def __init__(self, width=5, threshold=5.0):
+        if width < 3 or width % 2 == 0:
+            raise ValueError("width must be an odd number greater than 1")
+        self.halfWidth = width // 2
+        self.threshold = threshold
+        self._history = None
+
+    def _filter(self, extended):
+        medians = np.median(sliding_window_view(extended, 2 * self.halfWidth + 1), axis=1)
+        centers = extended[self.halfWidth:len(extended) - self.halfWidth]
+        return np.where(np.abs(centers - medians) > self.threshold, medians, centers)
+
+    def feed(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        if len(samples) == 0:
+            return _EMPTY
+        if self._history is None:
+            self._history = np.full(self.halfWidth, samples[0])
+        extended = np.concatenate((self._history, samples))
+        # The last halfWidth samples wait for their right neighbours, the ones before are kept as left neighbours
+        self._history = extended[-2 * self.halfWidth:]
+        if len(extended) <= 2 * self.halfWidth:
+            return _EMPTY
+        return self._filter(extended)
+
+    def flush(self):
+        if self._history is None:
+            return _EMPTY
+        extended = np.concatenate((self._history, np.full(self.halfWidth, self._history[-1])))
+        self._history = None
+        return self._filter(extended)
+
+
+class DriftCorrection(Stage):
+    # Baseline drift: the signal is cut in blocks of blockSamples, and each block is lowered by the smallest block
+    # median of the last windowBlocks blocks (its own included), i.e. the rest level between pulls. Pulls longer
+    # than the window would be flattened, so the window must span at least one rest.
+    def __init__(self, blockSamples, windowBlocks):
+        self.blockSamples = max(int(blockSamples), 1)
+        self.windowBlocks = max(int(windowBlocks), 1)
+        self._partial = _EMPTY
+        self._medians = deque(maxlen=self.windowBlocks - 1)
+
+    def _correct(self, blocks):
+        medians = np.median(blocks, axis=1)
+        padding = np.full(self.windowBlocks - 1 - len(self._medians), np.inf)
+        history = np.concatenate((padding, np.fromiter(self._medians, dtype=np.float64), medians))
+        baselines = sliding_window_view(history, self.windowBlocks).min(axis=1)
+        self._medians.extend(medians)
+        return (blocks - baselines[:, None]).ravel()
+
+    def feed(self, samples):
+        samples = np.concatenate((self._partial, np.asarray(samples, dtype=np.float64)))
+        numBlocks = len(samples) // self.blockSamples
+        self._partial = samples[numBlocks * self.blockSamples:]
+        if numBlocks == 0:
+            return _EMPTY
+        return self._correct(samples[:numBlocks * self.blockSamples].reshape(numBlocks, self.blockSamples))
+
+    def flush(self):
+        result = self._correct(self._partial[None, :]) if len(self._partial) else _EMPTY
+        self._partial = _EMPTY
+        self._medians.clear()
+        return result
+
+
+class Resample(Stage):
+    # Linear interpolation on the grid of targetRate, output sample k is at time k / targetRate
+    def __init__(self, sourceRate, targetRate):
+        self.sourceRate = int(sourceRate)
+        self.targetRate = int(targetRate)
+        self._count = 0
+        self._last = None
+        self._next = 0
+
+    def feed(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        if self.sourceRate == self.targetRate or len(samples) == 0:
+            return samples
+        positions = np.arange(self._count, self._count + len(samples))
+        self._count += len(samples)
+        if self._last is not None:
+            positions = np.concatenate(([positions[0] - 1], positions))
+            samples = np.concatenate(([self._last], samples))
+        self._last = samples[-1]
+        # Output samples up to the last input sample, in integer arithmetic to stay exact across chunks
+        stop = (self._count - 1) * self.targetRate // self.sourceRate + 1
+        outputs = np.arange(self._next, stop)
+        self._next = max(stop, self._next)
+        return np.interp(outputs * self.sourceRate / self.targetRate, positions, samples)
+
+    def flush(self):
+        self._count, self._last, self._next = 0, None, 0
+        return _EMPTY
+
+
+def createPipeline(sampleRate, targetRate=None, tareSeconds=None, spikeWidth=5, spikeThreshold=5.0,
+                   driftWindowSeconds=None):
+    """Gap filling, median spike filter and the optional stages: tare on the first tareSeconds (only for recordings
+    starting unloaded, the hands often stay on the holds between pulls), drift correction (1 second blocks, minimum
+    over driftWindowSeconds) and resampling to targetRate"""
+    stages = [GapFilling()]
+    if tareSeconds:
+        stages.append(Tare(tareSeconds * sampleRate))
+    if spikeWidth:
+        stages.append(MedianSpikeFilter(spikeWidth, spikeThreshold))
+    if driftWindowSeconds:
+        stages.append(DriftCorrection(sampleRate, driftWindowSeconds))
+    if targetRate and targetRate != sampleRate:
+        stages.append(Resample(sampleRate, targetRate))
+    return Pipeline(*stages)
+
+
+def preprocessForRepetitionMean(measData, sampleRate, lookupTable, targetRate, **pipelineOptions):
+    """Preprocess a recording at `sampleRate` and fit it to len(lookupTable) * targetRate samples, the length
+    expected by computeRepetitionMean(…, lookupTable, targetRate): shorter signals are padded with zeros, longer
+    ones are cut"""
+    signal = createPipeline(sampleRate, targetRate, **pipelineOptions).run(measData)
+    length = len(lookupTable) * targetRate
+    if len(signal) >= length:
+        return signal[:length]
+    return np.concatenate((signal, np.zeros(length - len(signal))))
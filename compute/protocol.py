@@ -0,0 +1,104 @@
+'''
+Lookup tables of the workout protocols for computeRepetitionMean.
+
+A protocol is `setsNumber` sets of `repetitions` repetitions of `repetitionActive` seconds of pulling followed by
+`repetitionPause` seconds of rest, with `setPause` seconds of rest between the sets (instead of the pause of the
+last repetition of a set). compileLookupTable gives its per-second 0/1 table, compileProtocol the per-sample
+activity mask and repetition index, memoized per protocol and sample rate. computeRepetitionMean only starts a
+repetition on a rising edge, so tables always begin with at least one rest sample.
+
+When the protocol is unknown, detectRepetitions finds the pulls in the force signal itself and returns a
+per-sample table, used with computeRepetitionMean(measData, table, 1).
+'''
+
+from functools import lru_cache
+
+import numpy as np
+
+
+def compileLookupTable(setsNumber, setPause, repetitions, repetitionActive, repetitionPause, leadIn=1):
+    # Per-second activity flags: 1 while pulling, 0 while resting
+    repetition = np.concatenate((np.ones(repetitionActive, dtype=np.int8), np.zeros(repetitionPause, dtype=np.int8)))
+    workSet = np.tile(repetition, repetitions)[:repetitions * (repetitionActive + repetitionPause) - repetitionPause]
+    setAndPause = np.concatenate((workSet, np.zeros(setPause, dtype=np.int8)))
+    table = np.tile(setAndPause, setsNumber)[:setsNumber * len(setAndPause) - setPause]
+    # The last repetition ends with its usual pause so that its falling edge is inside the table
+    return np.concatenate((np.zeros(leadIn, dtype=np.int8), table, np.zeros(repetitionPause, dtype=np.int8)))
+
+
+@lru_cache(maxsize=256)
+def compileProtocol(setsNumber, setPause, repetitions, repetitionActive, repetitionPause, sampleRate, leadIn=1):
+    """(per-sample activity mask, per-sample repetition index with -1 while resting), read-only as they are shared
+    by every caller of the same protocol and sample rate"""
+    table = compileLookupTable(setsNumber, setPause, repetitions, repetitionActive, repetitionPause, leadIn)
+    active = np.repeat(table, sampleRate).astype(bool)
+    rises = np.diff(np.concatenate(([False], active)).astype(np.int8)) == 1
+    repetitionIndex = np.where(active, np.cumsum(rises) - 1, -1)
+    active.setflags(write=False)
+    repetitionIndex.setflags(write=False)
+    return active, repetitionIndex
+
+
+def _runs(flags):
+    # (values, starts, lengths) of the runs of equal values
+    changes = np.flatnonzero(np.diff(flags)) + 1
+    starts = np.concatenate(([0], changes))
+    lengths = np.diff(np.concatenate((starts, [len(flags)])))
+    return flags[starts], starts, lengths
+
+
+def detectRepetitions(measData, sampleRate, minActiveSeconds=1.0, minPauseSeconds=1.0, smoothingSeconds=0.3):
+    """Per-sample 0/1 table of the pulls found in a force signal.
+
+    The signal is smoothed by a moving average, then thresholded with hysteresis between its rest level (5th
+    percentile) and its pull level (95th percentile), so that the last pulls of a fatiguing test are still found.
+    Pauses shorter than minPauseSeconds are merged into the surrounding pull, pulls shorter than minActiveSeconds
+    are dropped.
+    """
+    measData = np.nan_to_num(np.asarray(measData, dtype=np.float64))
+    numSamples = len(measData)
+    table = np.zeros(numSamples, dtype=np.int8)
+    if numSamples < 2:
+        return table
+
+    width = max(int(smoothingSeconds * sampleRate), 1)
+    smoothed = np.convolve(measData, np.ones(width) / width, mode="same")
+    rest, pull = np.percentile(smoothed, [5, 95])
+    if pull - rest <= 0:
+        return table
+    high = rest + 0.3 * (pull - rest)
+    low = rest + 0.2 * (pull - rest)
+
+    # Hysteresis: above high starts a pull, below low ends it, in between keeps the previous state
+    state = np.where(smoothed > high, 1, np.where(smoothed < low, 0, -1))
+    decided = np.maximum.accumulate(np.where(state >= 0, np.arange(numSamples), -1))
+    table = np.where(decided >= 0, state[np.maximum(decided, 0)], 0).astype(np.int8)
+
+    values, starts, lengths = _runs(table)
+    inner = (np.arange(len(values)) > 0) & (np.arange(len(values)) < len(values) - 1)
+    values = np.where((values == 0) & inner & (lengths < minPauseSeconds * sampleRate), 1, values)
+    table = np.repeat(values, lengths).astype(np.int8)
+
+    values, starts, lengths = _runs(table)
+    values = np.where((values == 1) & (lengths < minActiveSeconds * sampleRate), 0, values)
+    table = np.repeat(values, lengths).astype(np.int8)
+    table[0] = 0
+    return table
+
+
+def alignProtocol(active, measData, sampleRate, **detectOptions):
+    """Per-sample table of a compiled protocol shifted to the first pull detected in the signal and padded or cut to
+    the signal length, since recordings start at an arbitrary time before the first pull"""
+    numSamples = len(measData)
+    pulls = np.flatnonzero(detectRepetitions(measData, sampleRate, **detectOptions))
+    offset = pulls[0] if len(pulls) else 0
+    firstPull = np.argmax(active) if np.any(active) else 0
+    shifted = np.concatenate((np.zeros(max(offset - firstPull, 0), dtype=np.int8),
+                              np.asarray(active, dtype=np.int8)[max(firstPull - offset, 0):]))
+    if len(shifted) >= numSamples:
+        shifted = shifted[:numSamples].copy()
+    else:
+        shifted = np.concatenate((shifted, np.zeros(numSamples - len(shifted), dtype=np.int8)))
+    if numSamples:
+        shifted[0] = 0
+    return shifted
@@ -0,0 +1,31 @@
+'''
+Call counts and cumulated run time of the compute functions, read by the /metrics endpoint (see monitoring/).
+Kept free of any dependency so that the compute package stays usable on its own.
+'''
+
+import functools
+import threading
+import time
+
+# "module.function" -> [calls, seconds]
+computeTimes = {}
+_lock = threading.Lock()
+
+
+def timedCompute(function):
+    name = f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+    computeTimes[name] = [0, 0.0]
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with _lock:
+                stats = computeTimes[name]
+                stats[0] += 1
+                stats[1] += elapsed
+
+    return wrapper
@@ -0,0 +1,253 @@
+'''
+Cross-climber analytics of the critical force / body weight ratio, aggregated in SQL over
+workout ⨝ critical_force_workout ⨝ climber.
+
+Cohort statistics are served from two rollup tables:
+- climber_critical_force_rollup: the ratios of each climber (best, mean, workout count) with its cohort values,
+- cohort_critical_force_rollup: count, mean, percentiles and max of the climbers' best ratios per cohort.
+
+Every change of a climber, of a workout or of a critical force result queues the climber in analytics_stale_climber
+within the same transaction (session listener below, and mark_* calls of the bulk writes in crud.py). A climber is
+queued once, its later changes only bump its change_count. refresh_rollups then recomputes only the rows of the
+queued climbers and the cohorts they leave or join. It runs at the end of the import and recompute jobs, and
+before the analytics reads if climbers are still queued.
+
+    python -m database.analytics [--rebuild]
+'''
+from datetime import datetime
+
+from sqlalchemy import select, func, case, insert, literal, event, true, tuple_
+from sqlalchemy.orm import Session
+
+from database.database import dialect_insert
+
+from models.models import (
+    ClimberEntity,
+    WorkoutEntity,
+    CriticalForceWorkoutEntity,
+    AnalyticsStaleClimberEntity,
+    ClimberCriticalForceRollupEntity,
+    CohortCriticalForceRollupEntity,
+)
+
+AGE_BAND_WIDTH = 10
+
+# Cohort dimensions, columns of climber_critical_force_rollup
+DIMENSIONS = ("route_grade", "boulder_grade", "gender", "age_band")
+
+# Nearest-rank percentiles stored in cohort_critical_force_rollup
+PERCENTILES = {"p25_ratio": 25, "median_ratio": 50, "p75_ratio": 75, "p90_ratio": 90}
+
+_stale = AnalyticsStaleClimberEntity.__table__
+_climber_rollup = ClimberCriticalForceRollupEntity.__table__
+_cohort_rollup = CohortCriticalForceRollupEntity.__table__
+_climber = ClimberEntity.__table__
+_workout = WorkoutEntity.__table__
+_critical_force = CriticalForceWorkoutEntity.__table__
+
+
+def age_band(age):
+    if age is None:
+        return None
+    lower = age // AGE_BAND_WIDTH * AGE_BAND_WIDTH
+    return f"{lower}-{lower + AGE_BAND_WIDTH - 1}"
+
+
+def _ratio_rows():
+    # One row per critical force workout with a usable body weight
+    ratio = (_critical_force.c.critical_force / _workout.c.body_weight).label("ratio")
+    return (
+        select(_workout.c.climber_id, _workout.c.id.label("workout_id"), _workout.c.created_at,
+               _workout.c.body_weight, _critical_force.c.critical_force, ratio)
+        .join(_critical_force, _critical_force.c.workout_id == _workout.c.id)
+        .where(_workout.c.body_weight > 0, _critical_force.c.critical_force.is_not(None))
+    )
+
+
+# Staleness tracking
+def _queue(db: Session, statement):
+    # Climbers already queued keep their row, their change_count is bumped so that a running refresh keeps them
+    statement = statement.on_conflict_do_update(index_elements=[_stale.c.climber_id],
+                                                set_={"change_count": _stale.c.change_count + 1})
+    return db.connection().execute(statement)
+
+
+def mark_climbers_stale(db: Session, climber_ids):
+    climber_ids = {climber_id for climber_id in climber_ids if climber_id is not None}
+    if climber_ids:
+        _queue(db, dialect_insert(db, _stale).values([{"climber_id": climber_id} for climber_id in climber_ids]))
+
+
+def mark_workouts_stale(db: Session, workout_ids):
+    """Queue the climbers of `workout_ids` (ids or a select of ids) with an INSERT ... SELECT"""
+    if isinstance(workout_ids, (list, tuple, set)):
+        workout_ids = list(workout_ids)
+        if not workout_ids:
+            return
+    _queue(db, dialect_insert(db, _stale).from_select(
+        ["climber_id"], select(_workout.c.climber_id).where(_workout.c.id.in_(workout_ids),
+                                                            _workout.c.climber_id.is_not(None)).distinct()))
+
+
+def mark_all_stale(db: Session):
+    # The WHERE clause keeps SQLite from parsing the ON CONFLICT of the upsert as a join constraint
+    _queue(db, dialect_insert(db, _stale).from_select(["climber_id"], select(_climber.c.id).where(true())))
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_changed_climbers_stale(session, flush_context):
+    climber_ids, workout_ids = set(), set()
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, ClimberEntity):
+            climber_ids.add(instance.id)
+        elif isinstance(instance, WorkoutEntity):
+            climber_ids.add(instance.climber_id)
+        elif isinstance(instance, CriticalForceWorkoutEntity):
+            workout_ids.add(instance.workout_id)
+    mark_climbers_stale(session, climber_ids)
+    mark_workouts_stale(session, workout_ids - {None})
+
+
+# Rollups
+def has_stale_climbers(db: Session):
+    return db.execute(select(_stale.c.id).limit(1)).first() is not None
+
+
+def refresh_rollups(db: Session):
+    """Recompute the rollups of the queued climbers and of the cohorts they belong or belonged to, and commit.
+    Returns the number of refreshed climbers."""
+    queued = [tuple(row) for row in db.execute(select(_stale.c.climber_id, _stale.c.change_count))]
+    if not queued:
+        return 0
+    climber_ids = [climber_id for climber_id, _ in queued]
+
+    try:
+        touched = {dimension: set() for dimension in DIMENSIONS}
+        _collect_cohorts(db, climber_ids, touched)
+        db.execute(_climber_rollup.delete().where(_climber_rollup.c.climber_id.in_(climber_ids)))
+        rollup_rows = _climber_rollup_rows(db, climber_ids)
+        if rollup_rows:
+            db.execute(insert(_climber_rollup), rollup_rows)
+        _collect_cohorts(db, climber_ids, touched)
+        for dimension, values in touched.items():
+            _refresh_cohorts(db, dimension, values - {None})
+        # Climbers changed again during the refresh have a new change_count and stay queued
+        db.execute(_stale.delete().where(tuple_(_stale.c.climber_id, _stale.c.change_count).in_(queued)))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(climber_ids)
+
+
+def rebuild_rollups(db: Session):
+    mark_all_stale(db)
+    return refresh_rollups(db)
+
+
+def _collect_cohorts(db: Session, climber_ids, touched):
+    rows = db.execute(select(*(_climber_rollup.c[dimension] for dimension in DIMENSIONS))
+                      .where(_climber_rollup.c.climber_id.in_(climber_ids)))
+    for row in rows:
+        for dimension, value in zip(DIMENSIONS, row):
+            touched[dimension].add(value)
+
+
+def _climber_rollup_rows(db: Session, climber_ids):
+    ratios = _ratio_rows().where(_workout.c.climber_id.in_(climber_ids)).subquery()
+    rows = db.execute(
+        select(_climber.c.id, _climber.c.route_grade, _climber.c.boulder_grade, _climber.c.gender, _climber.c.age,
+               func.count(ratios.c.workout_id), func.max(ratios.c.ratio), func.avg(ratios.c.ratio),
+               func.max(ratios.c.created_at))
+        .join(ratios, ratios.c.climber_id == _climber.c.id)
+        .group_by(_climber.c.id)
+    )
+    return [
+        {"climber_id": climber_id, "route_grade": route_grade, "boulder_grade": boulder_grade, "gender": gender,
+         "age_band": age_band(age), "workout_count": count, "best_ratio": best, "mean_ratio": mean,
+         "last_workout_at": last_workout_at}
+        for climber_id, route_grade, boulder_grade, gender, age, count, best, mean, last_workout_at in rows
+    ]
+
+
+def _refresh_cohorts(db: Session, dimension: str, values):
+    if not values:
+        return
+    db.execute(_cohort_rollup.delete().where(_cohort_rollup.c.dimension == dimension,
+                                             _cohort_rollup.c.value.in_(values)))
+    value = _climber_rollup.c[dimension]
+    ranked = select(
+        value.label("value"),
+        _climber_rollup.c.workout_count,
+        _climber_rollup.c.best_ratio,
+        func.row_number().over(partition_by=value, order_by=_climber_rollup.c.best_ratio).label("rank"),
+        func.count().over(partition_by=value).label("size"),
+    ).where(value.in_(values)).subquery()
+
+    # Nearest rank: the smallest ratio whose rank reaches p% of the cohort
+    percentiles = [
+        func.min(case((ranked.c.rank * 100 >= percentile * ranked.c.size, ranked.c.best_ratio))).label(name)
+        for name, percentile in PERCENTILES.items()
+    ]
+    cohorts = select(
+        literal(dimension).label("dimension"),
+        ranked.c.value,
+        func.count().label("climber_count"),
+        func.sum(ranked.c.workout_count).label("workout_count"),
+        func.avg(ranked.c.best_ratio).label("mean_ratio"),
+        *percentiles,
+        func.max(ranked.c.best_ratio).label("max_ratio"),
+        literal(datetime.now()).label("refreshed_at"),
+    ).group_by(ranked.c.value)
+    db.execute(insert(_cohort_rollup).from_select([column.name for column in cohorts.selected_columns], cohorts))
+
+
+# Queries
+def get_cohort_stats(db: Session, dimension: str):
+    """Statistics of the best ratio of the climbers of each cohort of `dimension`, refreshed rollups first"""
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension {dimension}, expected one of {', '.join(DIMENSIONS)}")
+    if has_stale_climbers(db):
+        refresh_rollups(db)
+    return db.query(CohortCriticalForceRollupEntity).filter(
+        CohortCriticalForceRollupEntity.dimension == dimension).order_by(CohortCriticalForceRollupEntity.value).all()
+
+
+def get_leaderboard(db: Session, dimension: str = None, value: str = None, limit: int = 20):
+    """Climbers ranked by best ratio, optionally within the cohort `value` of `dimension`"""
+    if dimension is not None and dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension {dimension}, expected one of {', '.join(DIMENSIONS)}")
+    if has_stale_climbers(db):
+        refresh_rollups(db)
+    query = (
+        select(_climber_rollup.c.climber_id, _climber.c.first_name, _climber.c.last_name,
+               _climber_rollup.c.workout_count, _climber_rollup.c.best_ratio, _climber_rollup.c.mean_ratio,
+               _climber_rollup.c.last_workout_at)
+        .join(_climber, _climber.c.id == _climber_rollup.c.climber_id)
+        .order_by(_climber_rollup.c.best_ratio.desc())
+        .limit(limit)
+    )
+    if dimension is not None:
+        query = query.where(_climber_rollup.c[dimension] == value)
+    return db.execute(query).mappings().all()
+
+
+def get_climber_trend(db: Session, climber_id: int):
+    """Ratio of every critical force workout of a climber by date, read directly through the
+    (climber_id, created_at) index"""
+    return db.execute(
+        _ratio_rows().where(_workout.c.climber_id == climber_id).order_by(_workout.c.created_at)
+    ).mappings().all()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Refresh the analytics rollup tables")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollups of every climber")
+    args = parser.parse_args()
+    with SessionLocal() as session:
+        refreshed = rebuild_rollups(session) if args.rebuild else refresh_rollups(session)
+    print(f"{refreshed} climbers refreshed")
@@ -0,0 +1,186 @@
+'''
+Async mirror of crud.py for the FastAPI routes, using the AsyncSession of database.AsyncSessionLocal
+'''
+from sqlalchemy import insert, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+
+from cache import response_cache
+from database import crud
+from models.models import (
+    ClimberEntity,
+    MeasurementDeviceEntity,
+    WorkoutTypeEntity,
+    WorkoutEntity,
+    MeasurementEntity,
+    MeasuredDataEntity,
+    MeasuredDataBlobEntity,
+    MeasurementResultEntity,
+    CriticalForceWorkoutEntity,
+    MaxIsoStrengthWorkoutEntity,
+)
+
+
+async def _create(db: AsyncSession, entity):
+    db.add(entity)
+    await db.commit()
+    await db.refresh(entity)
+    return entity
+
+
+# Keyset pagination
+async def get_page(db: AsyncSession, entity, columns, filters, after: int, limit: int):
+    """Rows of `entity` with an id greater than `after`, ordered by id, selecting only `columns`"""
+    return (await db.execute(
+        select(*columns).where(*filters, entity.id > after).order_by(entity.id).limit(limit)
+    )).all()
+
+
+async def get_page_version(db: AsyncSession, entity, filters, after: int, limit: int):
+    """(row count, last id, max updated_at) of the same page, one aggregate query without loading the rows"""
+    page = select(entity.id, entity.updated_at).where(*filters, entity.id > after).order_by(entity.id).limit(limit)
+    page = page.subquery()
+    return (await db.execute(select(func.count(), func.max(page.c.id), func.max(page.c.updated_at)))).one()
+
+
+# Climber CRUD Operations
+async def get_climber(db: AsyncSession, climber_id: int):
+    return await db.scalar(select(ClimberEntity).where(ClimberEntity.id == climber_id))
+
+
+async def get_climbers(db: AsyncSession):
+    return (await db.scalars(select(ClimberEntity))).all()
+
+
+async def get_climbers_version(db: AsyncSession):
+    """(climber count, max updated_at) of the climber table, changes whenever a climber is added or updated"""
+    return tuple((await db.execute(select(func.count(), func.max(ClimberEntity.updated_at)))).one())
+
+
+async def get_climber_version(db: AsyncSession, climber_id: int):
+    """Latest updated_at of a climber, its workouts and their measurements, None if the climber does not exist"""
+    updated_at = select(ClimberEntity.updated_at).where(ClimberEntity.id == climber_id).union_all(
+        select(func.max(WorkoutEntity.updated_at)).where(WorkoutEntity.climber_id == climber_id),
+        select(func.max(MeasurementEntity.updated_at))
+        .join(WorkoutEntity, MeasurementEntity.workout_id == WorkoutEntity.id)
+        .where(WorkoutEntity.climber_id == climber_id),
+    ).subquery()
+    return await db.scalar(select(func.max(updated_at.c[0])))
+
+
+async def create_climber(db: AsyncSession, climber: ClimberEntity):
+    return await _create(db, climber)
+
+
+# MeasurementDevice CRUD Operations
+async def get_measurement_device(db: AsyncSession, measurement_device_id: int):
+    return await db.scalar(select(MeasurementDeviceEntity).where(MeasurementDeviceEntity.id == measurement_device_id))
+
+
+async def create_measurement_device(db: AsyncSession, measurement_device: MeasurementDeviceEntity):
+    return await _create(db, measurement_device)
+
+
+# WorkoutType CRUD Operations
+async def get_workout_type(db: AsyncSession, workout_type_name: str):
+    return await db.scalar(select(WorkoutTypeEntity).where(WorkoutTypeEntity.name == workout_type_name))
+
+
+async def create_workout_type(db: AsyncSession, workout_type: WorkoutTypeEntity):
+    return await _create(db, workout_type)
+
+
+# Workout CRUD Operations
+async def get_workout(db: AsyncSession, workout_id: int):
+    return await db.scalar(select(WorkoutEntity).where(WorkoutEntity.id == workout_id))
+
+
+async def get_climber_workouts_with_measurements(db: AsyncSession, climber_id: int):
+    """Workouts of a climber with their measurements, devices and sample blobs loaded in a constant number of queries"""
+    return (await db.scalars(
+        select(WorkoutEntity)
+        .options(
+            selectinload(WorkoutEntity.measurements).joinedload(MeasurementEntity.measurement_device),
+            selectinload(WorkoutEntity.measurements).selectinload(MeasurementEntity.measured_data_blob),
+        )
+        .where(WorkoutEntity.climber_id == climber_id)
+        .order_by(WorkoutEntity.created_at, WorkoutEntity.id)
+    )).all()
+
+
+async def create_workout(db: AsyncSession, workout: WorkoutEntity):
+    return await _create(db, workout)
+
+
+# Measurement CRUD Operations
+async def get_measurement(db: AsyncSession, measurement_id: int):
+    return await db.scalar(select(MeasurementEntity).where(MeasurementEntity.id == measurement_id))
+
+
+async def get_measurements_with_devices(db: AsyncSession, measurement_ids):
+    """Measurements of the ids with their device, in one query, as a dict measurement_id -> MeasurementEntity"""
+    measurements = (await db.scalars(
+        select(MeasurementEntity)
+        .options(joinedload(MeasurementEntity.measurement_device))
+        .where(MeasurementEntity.id.in_(measurement_ids))
+    )).all()
+    return {measurement.id: measurement for measurement in measurements}
+
+
+async def create_measurement(db: AsyncSession, measurement: MeasurementEntity):
+    return await _create(db, measurement)
+
+
+# MeasuredData CRUD Operations
+async def get_measured_data(db: AsyncSession, measurement_id: int):
+    return (await db.scalars(
+        select(MeasuredDataEntity).where(MeasuredDataEntity.measurement_id == measurement_id))).all()
+
+
+async def create_measured_data(db: AsyncSession, measured_data: MeasuredDataEntity):
+    return await _create(db, measured_data)
+
+
+async def bulk_create_measured_data(db: AsyncSession, measurement_id: int, weights, chunk_size: int = 1000,
+                                    first_iteration: int = 1):
+    """Async crud.bulk_create_measured_data: executemany batches of `chunk_size` rows, does not commit"""
+    rows = [{"measurement_id": measurement_id, "iteration": i, "weight": float(weight)}
+            for i, weight in enumerate(weights, start=first_iteration)]
+    for start in range(0, len(rows), chunk_size):
+        await db.execute(insert(MeasuredDataEntity), rows[start:start + chunk_size])
+    await db.run_sync(crud.invalidate_measurement_results, [measurement_id])
+    await db.run_sync(response_cache.mark_measurements_changed, [measurement_id])
+    return len(rows)
+
+
+# MeasuredDataBlob CRUD Operations
+async def get_measured_data_blob(db: AsyncSession, measurement_id: int):
+    return await db.scalar(select(MeasuredDataBlobEntity).where(MeasuredDataBlobEntity.measurement_id == measurement_id))
+
+
+# MeasurementResult CRUD Operations
+async def get_measurement_results(db: AsyncSession, measurement_ids, algorithm_version: int):
+    return (await db.scalars(
+        select(MeasurementResultEntity)
+        .where(MeasurementResultEntity.measurement_id.in_(measurement_ids),
+               MeasurementResultEntity.algorithm_version == algorithm_version)
+    )).all()
+
+
+# CriticalForceWorkout CRUD Operations
+async def get_critical_force_workout(db: AsyncSession, workout_id: int):
+    return await db.scalar(select(CriticalForceWorkoutEntity).where(CriticalForceWorkoutEntity.workout_id == workout_id))
+
+
+async def create_critical_force_workout(db: AsyncSession, critical_force_workout: CriticalForceWorkoutEntity):
+    return await _create(db, critical_force_workout)
+
+
+# MaxIsoStrengthWorkout CRUD Operations
+async def get_max_iso_strength_workout(db: AsyncSession, workout_id: int):
+    return await db.scalar(
+        select(MaxIsoStrengthWorkoutEntity).where(MaxIsoStrengthWorkoutEntity.workout_id == workout_id))
+
+
+async def create_max_iso_strength_workout(db: AsyncSession, max_iso_strength_workout: MaxIsoStrengthWorkoutEntity):
+    return await _create(db, max_iso_strength_workout)
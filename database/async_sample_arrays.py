@@ -0,0 +1,57 @@
+'''
+Async mirror of sample_arrays.py for the FastAPI routes, using the AsyncSession of database.AsyncSessionLocal
+'''
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_crud
+from database.sample_arrays import blob_arrays, group_measured_data_rows, iteration_weight_arrays
+from models.models import MeasuredDataEntity, MeasuredDataBlobEntity, MeasurementEntity, WorkoutEntity
+
+
+async def get_climber_measured_data_arrays(db: AsyncSession, climber_id: int):
+    """measured_data rows of all the measurements of a climber in a single query,
+    as a dict measurement_id -> (iterations, weights) NumPy arrays ordered by iteration"""
+    rows = (await db.execute(
+        select(MeasuredDataEntity.measurement_id, MeasuredDataEntity.iteration, MeasuredDataEntity.weight)
+        .join(MeasurementEntity, MeasurementEntity.id == MeasuredDataEntity.measurement_id)
+        .join(WorkoutEntity, WorkoutEntity.id == MeasurementEntity.workout_id)
+        .where(WorkoutEntity.climber_id == climber_id)
+        .order_by(MeasuredDataEntity.measurement_id, MeasuredDataEntity.iteration)
+    )).all()
+    return group_measured_data_rows(rows)
+
+
+async def get_measured_data_arrays(db: AsyncSession, measurement_ids):
+    """(iterations, weights) arrays of the measurements, from their blobs or else their measured_data rows, in two
+    queries whatever the number of measurements. Measurements without samples are missing from the dict."""
+    measurement_ids = list(measurement_ids)
+    if not measurement_ids:
+        return {}
+    measured_data_blobs = (await db.scalars(
+        select(MeasuredDataBlobEntity).where(MeasuredDataBlobEntity.measurement_id.in_(measurement_ids))
+    )).all()
+    arrays = {measured_data_blob.measurement_id: blob_arrays(measured_data_blob)
+              for measured_data_blob in measured_data_blobs}
+    row_measurement_ids = [measurement_id for measurement_id in measurement_ids if measurement_id not in arrays]
+    rows = (await db.execute(
+        select(MeasuredDataEntity.measurement_id, MeasuredDataEntity.iteration, MeasuredDataEntity.weight)
+        .where(MeasuredDataEntity.measurement_id.in_(row_measurement_ids))
+        .order_by(MeasuredDataEntity.measurement_id, MeasuredDataEntity.iteration)
+    )).all()
+    arrays.update(group_measured_data_rows(rows))
+    return arrays
+
+
+async def get_measurement_arrays(db: AsyncSession, measurement_id: int):
+    """(iterations, weights) arrays of a measurement ordered by iteration, with the iterations stored in
+    measured_data (blobs are numbered from 1)"""
+    measured_data_blob = await async_crud.get_measured_data_blob(db, measurement_id)
+    if measured_data_blob is not None:
+        return blob_arrays(measured_data_blob)
+    rows = (await db.execute(
+        select(MeasuredDataEntity.iteration, MeasuredDataEntity.weight)
+        .where(MeasuredDataEntity.measurement_id == measurement_id)
+        .order_by(MeasuredDataEntity.iteration)
+    )).all()
+    return iteration_weight_arrays(rows)
@@ -1,4 +1,8 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import insert, event, select
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from cache import response_cache
+from database import analytics
 from models.models import (
     ClimberEntity,
     MeasurementDeviceEntity,
@@ -6,6 +10,8 @@ from models.models import (
     WorkoutEntity,
     MeasurementEntity,
     MeasuredDataEntity,
+    MeasuredDataBlobEntity,
+    MeasurementResultEntity,
     CriticalForceWorkoutEntity,
     MaxIsoStrengthWorkoutEntity,
 )
@@ -16,6 +22,10 @@ def get_climber(db: Session, climber_id: int):
     return db.query(ClimberEntity).filter(ClimberEntity.id == climber_id).first()
 
 
+def get_climbers(db: Session):
+    return db.query(ClimberEntity).all()
+
+
 def create_climber(db: Session, climber: ClimberEntity):
     db.add(climber)
     db.commit()
@@ -52,6 +62,20 @@ def get_workout(db: Session, workout_id: int):
     return db.query(WorkoutEntity).filter(WorkoutEntity.id == workout_id).first()
 
 
+def get_climber_workouts_with_measurements(db: Session, climber_id: int):
+    """Workouts of a climber with their measurements, devices and sample blobs loaded in a constant number of queries"""
+    return (
+        db.query(WorkoutEntity)
+        .options(
+            selectinload(WorkoutEntity.measurements).joinedload(MeasurementEntity.measurement_device),
+            selectinload(WorkoutEntity.measurements).selectinload(MeasurementEntity.measured_data_blob),
+        )
+        .filter(WorkoutEntity.climber_id == climber_id)
+        .order_by(WorkoutEntity.created_at, WorkoutEntity.id)
+        .all()
+    )
+
+
 def create_workout(db: Session, workout: WorkoutEntity):
     db.add(workout)
     db.commit()
@@ -64,6 +88,17 @@ def get_measurement(db: Session, measurement_id: int):
     return db.query(MeasurementEntity).filter(MeasurementEntity.id == measurement_id).first()
 
 
+def get_measurements_with_devices(db: Session, measurement_ids):
+    """Measurements of the ids with their device, in one query, as a dict measurement_id -> MeasurementEntity"""
+    measurements = (
+        db.query(MeasurementEntity)
+        .options(joinedload(MeasurementEntity.measurement_device))
+        .filter(MeasurementEntity.id.in_(measurement_ids))
+        .all()
+    )
+    return {measurement.id: measurement for measurement in measurements}
+
+
 def create_measurement(db: Session, measurement: MeasurementEntity):
     db.add(measurement)
     db.commit()
@@ -83,6 +118,73 @@ def create_measured_data(db: Session, measured_data: MeasuredDataEntity):
     return measured_data
 
 
+def bulk_create_measured_data(db: Session, measurement_id: int, weights, chunk_size: int = 1000,
+                              first_iteration: int = 1):
+    """Insert all samples of a measurement with executemany batches of `chunk_size` rows.
+
+    Nothing is committed here: the caller owns the transaction, so a whole import can land atomically.
+    Returns the number of inserted rows.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+    inserted = 0
+    chunk = []
+    for i, weight in enumerate(weights, start=first_iteration):
+        chunk.append({"measurement_id": measurement_id, "iteration": i, "weight": float(weight)})
+        if len(chunk) == chunk_size:
+            db.execute(insert(MeasuredDataEntity), chunk)
+            inserted += len(chunk)
+            chunk = []
+    if chunk:
+        db.execute(insert(MeasuredDataEntity), chunk)
+        inserted += len(chunk)
+    invalidate_measurement_results(db, [measurement_id])
+    response_cache.mark_measurements_changed(db, [measurement_id])
+    return inserted
+
+
+# MeasuredDataBlob CRUD Operations
+def get_measured_data_blob(db: Session, measurement_id: int):
+    return db.query(MeasuredDataBlobEntity).filter(MeasuredDataBlobEntity.measurement_id == measurement_id).first()
+
+
+# MeasurementResult CRUD Operations
+def get_measurement_results(db: Session, measurement_ids, algorithm_version: int):
+    return (
+        db.query(MeasurementResultEntity)
+        .filter(MeasurementResultEntity.measurement_id.in_(measurement_ids),
+                MeasurementResultEntity.algorithm_version == algorithm_version)
+        .all()
+    )
+
+
+def invalidate_measurement_results(db: Session, measurement_ids):
+    """Drop the cached results of all algorithm versions of these measurements, and the stored results of their
+    workouts. Does not commit."""
+    measurement_ids = list(measurement_ids)
+    if not measurement_ids:
+        return
+    connection = db.connection()
+    connection.execute(MeasurementResultEntity.__table__.delete().where(
+        MeasurementResultEntity.__table__.c.measurement_id.in_(measurement_ids)))
+    workout_ids = select(MeasurementEntity.__table__.c.workout_id).where(
+        MeasurementEntity.__table__.c.id.in_(measurement_ids))
+    for entity in (CriticalForceWorkoutEntity, MaxIsoStrengthWorkoutEntity):
+        connection.execute(entity.__table__.delete().where(entity.__table__.c.workout_id.in_(workout_ids)))
+    analytics.mark_workouts_stale(db, workout_ids)
+
+
+@event.listens_for(Session, "before_flush")
+def _invalidate_results_of_changed_samples(session, flush_context, instances):
+    # Samples written through the ORM (bulk inserts of this module invalidate explicitly)
+    measurement_ids = {
+        instance.measurement_id
+        for instance in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(instance, (MeasuredDataEntity, MeasuredDataBlobEntity)) and instance.measurement_id is not None
+    }
+    invalidate_measurement_results(session, measurement_ids)
+
+
 # CriticalForceWorkout CRUD Operations
 def get_critical_force_workout(db: Session, workout_id: int):
     return db.query(CriticalForceWorkoutEntity).filter(CriticalForceWorkoutEntity.workout_id == workout_id).first()
@@ -95,6 +197,11 @@ def create_critical_force_workout(db: Session, critical_force_workout: CriticalF
     return critical_force_workout
 
 
+def bulk_replace_critical_force_workouts(db: Session, critical_force_workouts, chunk_size: int = 500):
+    """Replace the results of the workouts of `critical_force_workouts` (dicts of column values). Does not commit."""
+    _bulk_replace(db, CriticalForceWorkoutEntity, critical_force_workouts, chunk_size)
+
+
 # MaxIsoStrengthWorkout CRUD Operations
 def get_max_iso_strength_workout(db: Session, workout_id: int):
     return db.query(MaxIsoStrengthWorkoutEntity).filter(MaxIsoStrengthWorkoutEntity.workout_id == workout_id).first()
@@ -104,4 +211,22 @@ def create_max_iso_strength_workout(db: Session, max_iso_strength_workout: MaxIs
     db.add(max_iso_strength_workout)
     db.commit()
     db.refresh(max_iso_strength_workout)
-    return max_iso_strength_workout
\ No newline at end of file
+    return max_iso_strength_workout
+
+
+def bulk_replace_max_iso_strength_workouts(db: Session, max_iso_strength_workouts, chunk_size: int = 500):
+    """Replace the results of the workouts of `max_iso_strength_workouts` (dicts of column values). Does not commit."""
+    _bulk_replace(db, MaxIsoStrengthWorkoutEntity, max_iso_strength_workouts, chunk_size)
+
+
+def _bulk_replace(db: Session, entity, rows, chunk_size):
+    # Portable upsert keyed on workout_id: delete then executemany insert, chunked to stay below parameter limits
+    rows = list(rows)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        workout_ids = [row["workout_id"] for row in chunk]
+        db.query(entity).filter(entity.workout_id.in_(workout_ids)).delete(synchronize_session=False)
+        db.execute(insert(entity), chunk)
+        response_cache.mark_workouts_changed(db, workout_ids)
+        if entity is CriticalForceWorkoutEntity:
+            analytics.mark_workouts_stale(db, workout_ids)
\ No newline at end of file
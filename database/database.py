@@ -1,16 +1,97 @@
-from sqlalchemy import create_engine, func
+from sqlalchemy import create_engine, event, func, make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 
 DATABASE_DIRECTORY = ".database"  # Name of your database directory
 DATABASE_FILE = "data.db"        # Name of your database file
 
-#Construct the full path using the directory and the file name
-DATABASE_URL = f"sqlite:///{os.path.join(DATABASE_DIRECTORY, DATABASE_FILE)}"
+#Construct the full path using the directory and the file name, unless the URL is given by the environment
+DEFAULT_DATABASE_URL = f"sqlite:///{os.path.join(DATABASE_DIRECTORY, DATABASE_FILE)}"
+DATABASE_URL = os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL)
 
-# Create the database directory if it doesn't exist
-os.makedirs(DATABASE_DIRECTORY, exist_ok=True)
+# Connection pool of each worker process
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# SQLite connection pragmas: WAL lets readers run next to the writer of another gunicorn worker, and writers wait
+# for the lock for SQLITE_BUSY_TIMEOUT_MS instead of failing with "database is locked"
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Async drivers of the supported databases, used by the async engine of the FastAPI routes
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def to_async_url(url: str):
+    dialect, separator, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(dialect.split("+")[0], dialect) + separator + rest
+
+
+def _is_sqlite(url: str):
+    return url.startswith("sqlite")
+
+
+def _is_sqlite_memory(url: str):
+    return _is_sqlite(url) and (url.rstrip("/").endswith(":") or ":memory:" in url)
+
+
+def dialect_insert(db, table):
+    """INSERT into `table` for the database of the session `db`, with the on_conflict_do_nothing and
+    on_conflict_do_update clauses of the SQLite and PostgreSQL dialects"""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
+def _engine_options(url: str):
+    if _is_sqlite_memory(url):
+        # In-memory databases live in a single connection, there is no pool to size
+        return {}
+    return {"pool_size": DATABASE_POOL_SIZE, "max_overflow": DATABASE_MAX_OVERFLOW, "pool_pre_ping": not _is_sqlite(url)}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    if SQLITE_WAL:
+        cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def _listen_sqlite(database_engine, url: str):
+    event.listen(database_engine, "connect", _set_sqlite_pragmas)
+    directory = os.path.dirname(make_url(url).database or "")
+    if directory and not _is_sqlite_memory(url):
+        # SQLite creates the database file but not its directory, created before the first connection rather
+        # than when the application is imported
+        event.listen(database_engine, "do_connect",
+                     lambda dialect, connection_record, cargs, cparams: os.makedirs(directory, exist_ok=True))
+
+
+def create_database_engine(url: str = DATABASE_URL):
+    connect_args = {"check_same_thread": False} if _is_sqlite(url) else {}
+    database_engine = create_engine(url, connect_args=connect_args, **_engine_options(url))
+    if _is_sqlite(url):
+        _listen_sqlite(database_engine, url)
+    return database_engine
+
+
+def create_async_database_engine(url: str = DATABASE_URL):
+    database_engine = create_async_engine(to_async_url(url), **_engine_options(url))
+    if _is_sqlite(url):
+        _listen_sqlite(database_engine.sync_engine, url)
+    return database_engine
+
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+
+engine = create_database_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+async_engine = create_async_database_engine(DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+Base = declarative_base()
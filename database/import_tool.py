@@ -1,49 +1,162 @@
+import argparse
+import hashlib
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
 
-from fastapi import HTTPException
+import numpy as np
 from sqlalchemy import func
 
-from database import crud
+from compute.preprocessing import createPipeline
+from database import crud, sample_arrays, sample_storage
 from database.database import SessionLocal
+from database.workout_protocols import fill_known_protocol
 from models import models
 
-
-def extract_example_data_to_db():
-    exemple_data_list = _load_exemple_data()
-    db = SessionLocal()
-    for exemple_data in exemple_data_list:
-        _import_to_db(db, exemple_data)
-
-
-def _load_exemple_data():
-    data_dir = "./example_data"
-    if not os.path.exists(data_dir):
-        raise HTTPException(status_code=404, detail=f"Data directory '{data_dir}' not found")
-
-    exemple_data_list = []
-
-    for filename in os.listdir(data_dir):
-        if filename.endswith(".json"):
-            filepath = os.path.join(data_dir, filename)
-            try:
-                with open(filepath, "r") as f:
-                    exemple_data_list.append(json.load(f))
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=500, detail=f"File '{filename}' is not a valid json")
-
-    return exemple_data_list
-
-
-def _import_to_db(db, data):
-    # Extract climber name
-    filename = data.get("filename")
-    personal_info = data.get("Personal", {})
+# Number of measured_data rows sent per executemany batch
+IMPORT_CHUNK_SIZE = 1000
+EXAMPLE_DATA_DIRECTORY = "./example_data"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def import_directory(db, directory: str, workers: int = None, chunk_size: int = IMPORT_CHUNK_SIZE,
+                     preprocess: bool = False, on_file=None, mp_context=None):
+    """Import every `*.json` file of `directory`, skipping the files that were already imported.
+
+    Files are parsed one at a time by a process pool (at most two files in flight per worker, so memory stays
+    bounded whatever the directory size) and the parsed data is written by this single caller-owned session.
+    `workers=1` parses in the current process. With `preprocess`, samples go through the default pipeline of
+    compute.preprocessing (gap filling and spike removal) before being stored. `on_file(filename)` is called after
+    each file, imported or not. `mp_context` starts the pool processes (see multiprocessing.get_context).
+    Returns a report dict with the imported, skipped and failed file names.
+    """
+    workers = workers or os.cpu_count() or 1
+    report = {"imported": [], "skipped": [], "failed": []}
+
+    def write(parsed):
+        filename, content_hash, data = parsed
+        if data is None:
+            report["failed"].append(filename)
+        elif _is_already_imported(db, content_hash, data):
+            report["skipped"].append(filename)
+        else:
+            _import_to_db(db, data, chunk_size=chunk_size, content_hash=content_hash, filename=filename,
+                          preprocess=preprocess)
+            report["imported"].append(filename)
+        if on_file is not None:
+            on_file(filename)
+
+    paths = _iter_json_files(directory)
+    if workers == 1:
+        for path in paths:
+            write(_parse_file(path))
+        return report
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+        pending = set()
+        for path in paths:
+            pending.add(executor.submit(_parse_file, path))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future.result())
+        for future in pending:
+            write(future.result())
+    return report
+
+
+def count_json_files(directory: str):
+    return sum(1 for _ in _iter_json_files(directory))
+
+
+def _iter_json_files(directory):
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".json"):
+                yield entry.path
+
+
+def _parse_file(path):
+    # Runs in the pool workers: returns (filename, sha256 of the raw content, parsed json or None if invalid)
+    filename = os.path.basename(path)
+    with open(path, "rb") as f:
+        content = f.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+    try:
+        return filename, content_hash, json.loads(content)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return filename, content_hash, None
+
+
+def _is_already_imported(db, content_hash, data):
+    if db.get(models.ImportedFileEntity, content_hash) is not None:
+        return True
+
+    # Files imported before the imported_file table existed are recognized by (climber, timestamp, workout)
+    measurement_info = data.get("Measurement", {})
+    if not measurement_info.get("timestamp"):
+        return False
+    first_name, last_name = _climber_names(data.get("Personal", {}))
+    return db.query(models.WorkoutEntity.id).join(models.ClimberEntity).filter(
+        models.ClimberEntity.first_name == first_name,
+        models.ClimberEntity.last_name == last_name,
+        models.WorkoutEntity.workout_name == measurement_info.get("workout", "Custom"),
+        models.WorkoutEntity.created_at == _parse_timestamp(measurement_info),
+    ).first() is not None
+
+
+def _climber_names(personal_info):
     climber_first_name = personal_info.get("name", "None").split(" ")[0]
     climber_last_name = " ".join(personal_info.get("name", "None").split(" ")[1:])
     if len(climber_last_name) < 1:
         climber_last_name = "None"
+    return climber_first_name, climber_last_name
+
+
+def _parse_timestamp(measurement_info):
+    if measurement_info.get("timestamp"):
+        return datetime.strptime(measurement_info.get("timestamp"), TIMESTAMP_FORMAT)
+    return func.now()
+
+
+def _import_to_db(db, data, chunk_size: int = IMPORT_CHUNK_SIZE, content_hash: str = None, filename: str = None,
+                  preprocess: bool = False):
+    # Everything of a file (climber, workout, measurement and samples) is written in a single transaction
+    try:
+        measurement = _import_file_entities(db, data)
+        weights = data.get("Measurement", {}).get("measDataKg", [])
+        if preprocess:
+            # Missing samples are null in the json files, NaN for the gap filling
+            weights = np.array(weights, dtype=np.float64)
+            weights = createPipeline(measurement.measurement_device.sample_rate_hz).run(weights)
+        if sample_storage.SAMPLE_STORAGE_MODE == sample_storage.STORAGE_BLOB:
+            sample_arrays.create_measured_data_blob(db=db, measurement_id=measurement.id, weights=weights)
+        else:
+            crud.bulk_create_measured_data(db=db, measurement_id=measurement.id, weights=weights,
+                                           chunk_size=chunk_size)
+        if content_hash is not None:
+            db.add(models.ImportedFileEntity(content_hash=content_hash, filename=filename,
+                                             measurement_id=measurement.id, imported_at=datetime.now()))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return measurement
+
+
+def _add_and_flush(db, entity):
+    # Same as the crud create_* helpers, but flushes instead of committing so the id is available in the transaction
+    db.add(entity)
+    db.flush()
+    return entity
+
+
+def _import_file_entities(db, data):
+    # Extract climber name
+    filename = data.get("filename")
+    personal_info = data.get("Personal", {})
+    climber_first_name, climber_last_name = _climber_names(personal_info)
 
     # Find the climber
     climber = db.query(models.ClimberEntity).filter_by(first_name=climber_first_name, last_name=climber_last_name).first()
@@ -60,7 +173,7 @@ def _import_to_db(db, data):
             route_grade=personal_info.get("routeGrade", None),  # Extract from JSON or set to None
             boulder_grade=personal_info.get("boulderGrade", None)  # Extract from JSON or set to None
         )
-        climber = crud.create_climber(db=db, climber=climber)
+        climber = _add_and_flush(db, climber)
 
     # Create a workout type if it doesn't exist
     measurement_info = data.get("Measurement", {})
@@ -71,17 +184,16 @@ def _import_to_db(db, data):
             name=workout_type_name,
             description=workout_type_name,  # Extract from JSON or set to a default
         )
-        workout_type = crud.create_workout_type(db=db, workout_type=workout_type)
+        workout_type = _add_and_flush(db, fill_known_protocol(workout_type))
     # Create a workout associated with the climber
     workout = models.WorkoutEntity(
         workout_name=workout_type.name,
         climber_id=climber.id,
         body_weight=measurement_info.get("weight", None),  # Extract from JSON or set to None
-        created_at=datetime.strptime(measurement_info.get("timestamp"), "%Y-%m-%d %H:%M:%S") if measurement_info.get(
-            "timestamp") else func.now(),  # Extract from file name
+        created_at=_parse_timestamp(measurement_info),  # Extract from file name
         updated_at=func.now()
     )
-    workout = crud.create_workout(db=db, workout=workout)
+    workout = _add_and_flush(db, workout)
 
     # Create the measurement device
     measurement_device = db.query(models.MeasurementDeviceEntity).first()
@@ -89,23 +201,33 @@ def _import_to_db(db, data):
         measurement_device = models.MeasurementDeviceEntity(
             sample_rate_hz=10
         )
-        measurement_device = crud.create_measurement_device(db=db, measurement_device=measurement_device)
+        measurement_device = _add_and_flush(db, measurement_device)
 
     # Create a single measurement
     measurement = models.MeasurementEntity(
         workout_id=workout.id,
         measurement_device_id=measurement_device.id,
         current_repetition=1,
-        created_at=datetime.strptime(measurement_info.get("timestamp"),
-                                     "%Y-%m-%d %H:%M:%S") if measurement_info.get("timestamp") else func.now(),
+        created_at=_parse_timestamp(measurement_info),
         updated_at=func.now()
     )
-    measurement = crud.create_measurement(db=db, measurement=measurement)
-    # Create measured data associated with this measurement
-    for i, weight in enumerate(measurement_info.get("measDataKg", [])):
-        measured_data = models.MeasuredDataEntity(
-            measurement_id=measurement.id,
-            iteration=i + 1,
-            weight=weight
-        )
-        crud.create_measured_data(db=db, measured_data=measured_data)
\ No newline at end of file
+    return _add_and_flush(db, measurement)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import climbing session json files into the database")
+    parser.add_argument("directory", nargs="?", default=EXAMPLE_DATA_DIRECTORY)
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: number of CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--preprocess", action="store_true", help="fill the gaps and remove the spikes of the samples")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        result = import_directory(session, args.directory, workers=args.workers, chunk_size=args.chunk_size,
+                                  preprocess=args.preprocess)
+    finally:
+        session.close()
+    print(f"imported: {len(result['imported'])}, skipped: {len(result['skipped'])}, failed: {len(result['failed'])}")
+    for failed_filename in result["failed"]:
+        print(f"  not a valid json: {failed_filename}")
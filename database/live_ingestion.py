@@ -0,0 +1,162 @@
+'''
+Micro-batched persistence of live samples: each live measurement gets a buffer that is flushed to the database
+when it holds LIVE_FLUSH_SIZE samples or every LIVE_FLUSH_INTERVAL seconds. Database writes run in the thread pool
+so that concurrent sessions never block the event loop or each other. The samples of a failed write are kept and
+retried by the next flush, drain (at the end of the stream) raises if they still cannot be written.
+
+With LIVE_PREPROCESSING=1, the samples of each stream go through the default pipeline of compute.preprocessing
+(gap filling and spike removal) before being buffered; the few samples it holds back are written when the stream ends.
+'''
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
+
+from database import crud
+from database.database import SessionLocal
+from models.models import MeasuredDataEntity, MeasurementEntity
+
+LIVE_FLUSH_SIZE = int(os.getenv("LIVE_FLUSH_SIZE", "200"))
+LIVE_FLUSH_INTERVAL = float(os.getenv("LIVE_FLUSH_INTERVAL", "1.0"))
+LIVE_PREPROCESSING = os.getenv("LIVE_PREPROCESSING", "0") == "1"
+# Sample rate of the measurements without device, for the preprocessing windows
+DEFAULT_SAMPLE_RATE = 10
+
+# measurement_id -> LiveSampleBuffer of the sessions currently streaming in this process
+active_buffers = {}
+
+logger = logging.getLogger(__name__)
+
+
+class MeasurementAlreadyStreaming(Exception):
+    pass
+
+
+class LiveSampleBuffer:
+    def __init__(self, measurement_id: int, next_iteration: int, session_factory=SessionLocal,
+                 flush_size: int = LIVE_FLUSH_SIZE, flush_interval: float = LIVE_FLUSH_INTERVAL, preprocessing=None):
+        self.measurement_id = measurement_id
+        self.next_iteration = next_iteration
+        self.session_factory = session_factory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.preprocessing = preprocessing
+        self.stored = 0
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._flush_tasks = set()
+
+    async def add(self, weights):
+        # Flushes run in the background so the producer never waits for the database
+        if self.preprocessing is not None:
+            weights = self.preprocessing.feed(weights).tolist()
+        self._pending.extend(float(weight) for weight in weights)
+        if len(self._pending) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self._start_flush()
+
+    async def flush(self):
+        # Samples and iterations are taken under the lock, which keeps the writes of a measurement ordered: a failed
+        # write puts its samples back in front of the pending ones, they are retried by the next flush
+        self._last_flush = time.monotonic()
+        async with self._lock:
+            if not self._pending:
+                return
+            weights, self._pending = self._pending, []
+            first_iteration = self.next_iteration
+            self.next_iteration += len(weights)
+            try:
+                await run_in_threadpool(self._write, weights, first_iteration)
+            except Exception:
+                self._pending[:0] = weights
+                self.next_iteration = first_iteration
+                raise
+            self.stored += len(weights)
+
+    async def drain(self):
+        # Wait for the background flushes, then flush the remaining samples (and the ones of the failed flushes):
+        # raises if they still cannot be written
+        if self.preprocessing is not None:
+            self._pending.extend(self.preprocessing.flush().tolist())
+        await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+
+    async def flush_periodically(self):
+        # Time threshold for slow producers: run as a task next to the receive loop and cancel it when done,
+        # its flushes are background tasks so that cancelling it never interrupts a write
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._start_flush()
+
+    def _start_flush(self):
+        task = asyncio.create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Flush of the live samples of measurement %s failed, retrying", self.measurement_id,
+                           exc_info=task.exception())
+
+    def _write(self, weights, first_iteration):
+        db = self.session_factory()
+        try:
+            crud.bulk_create_measured_data(db=db, measurement_id=self.measurement_id, weights=weights,
+                                           first_iteration=first_iteration)
+            db.commit()
+        finally:
+            db.close()
+
+
+async def open_buffer(measurement_id: int, session_factory=SessionLocal, **kwargs):
+    """Register the buffer of a live measurement, samples are appended after the ones already stored"""
+    if measurement_id in active_buffers:
+        raise MeasurementAlreadyStreaming(measurement_id)
+    # Reserve the measurement before awaiting, so that a concurrent open of the same measurement fails
+    active_buffers[measurement_id] = None
+    try:
+        next_iteration = await run_in_threadpool(_next_iteration, session_factory, measurement_id)
+        if LIVE_PREPROCESSING and "preprocessing" not in kwargs:
+            from compute.preprocessing import createPipeline
+
+            sample_rate = await run_in_threadpool(_sample_rate, session_factory, measurement_id)
+            kwargs["preprocessing"] = createPipeline(sample_rate)
+    except Exception:
+        del active_buffers[measurement_id]
+        raise
+    buffer = LiveSampleBuffer(measurement_id, next_iteration, session_factory, **kwargs)
+    active_buffers[measurement_id] = buffer
+    return buffer
+
+
+async def close_buffer(buffer: LiveSampleBuffer):
+    try:
+        await buffer.drain()
+    finally:
+        active_buffers.pop(buffer.measurement_id, None)
+
+
+def _next_iteration(session_factory, measurement_id):
+    db = session_factory()
+    try:
+        last_iteration = db.query(func.max(MeasuredDataEntity.iteration)).filter(
+            MeasuredDataEntity.measurement_id == measurement_id).scalar()
+    finally:
+        db.close()
+    return (last_iteration or 0) + 1
+
+
+def _sample_rate(session_factory, measurement_id):
+    db = session_factory()
+    try:
+        measurement = db.get(MeasurementEntity, measurement_id)
+        if measurement is None or measurement.measurement_device is None:
+            return DEFAULT_SAMPLE_RATE
+        return measurement.measurement_device.sample_rate_hz
+    finally:
+        db.close()
@@ -0,0 +1,99 @@
+'''
+Materialized measurement results: critical force, W', max force and repetition means are computed once per
+measurement and algorithm version, stored in measurement_result and dropped automatically by crud.py whenever
+the samples of the measurement change.
+'''
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from compute.batch import computeWorkoutResultsBatch
+from database import crud, sample_arrays, sample_storage
+from database.database import dialect_insert
+from models.models import MeasurementResultEntity, MeasurementEntity, WorkoutEntity
+
+# Bump whenever compute/ changes the results, so that stale results are recomputed instead of being served
+ALGORITHM_VERSION = 1
+
+
+def get_or_compute_results(db: Session, measurement_ids, repetition_mean_for, repetition_duration, samples=None):
+    """Results of the measurements, computing and storing only the ones missing from the cache.
+
+    `repetition_mean_for(measurement_id, samples)` returns the repetition means of a measurement samples array.
+    `samples` optionally maps measurement ids to their already loaded samples, the others are read here.
+    Returns a dict measurement_id -> MeasurementResultEntity.
+    """
+    measurement_ids = list(measurement_ids)
+    results = {result.measurement_id: result
+               for result in crud.get_measurement_results(db, measurement_ids, ALGORITHM_VERSION)}
+    missing = [measurement_id for measurement_id in measurement_ids if measurement_id not in results]
+    if not missing:
+        return results
+
+    samples = samples or {}
+    repetition_means = [
+        repetition_mean_for(measurement_id, samples[measurement_id] if measurement_id in samples
+                            else sample_arrays.get_measured_data_array(db, measurement_id))
+        for measurement_id in missing
+    ]
+    critical_force, w_prime, max_force = computeWorkoutResultsBatch(repetition_means, repetition_duration)
+    computed_at = datetime.now()
+    rows = [
+        {
+            "measurement_id": measurement_id,
+            "algorithm_version": ALGORITHM_VERSION,
+            "critical_force": cf,
+            "w_prime": w,
+            "max_force": None if np.isnan(max_f) else max_f,
+            "repetition_means": sample_storage.pack_samples(repetition_mean, "float64"),
+            "computed_at": computed_at,
+        }
+        for measurement_id, repetition_mean, cf, w, max_f in zip(missing, repetition_means, critical_force.tolist(),
+                                                                 w_prime.tolist(), max_force.tolist())
+    ]
+    # Concurrent requests may compute the same results: the rows stored first are kept and read back
+    db.execute(dialect_insert(db, MeasurementResultEntity).on_conflict_do_nothing(
+        index_elements=[MeasurementResultEntity.measurement_id, MeasurementResultEntity.algorithm_version]), rows)
+    db.commit()
+    results.update((result.measurement_id, result)
+                   for result in crud.get_measurement_results(db, missing, ALGORITHM_VERSION))
+    return results
+
+
+
+def get_repetition_means(result: MeasurementResultEntity):
+    return np.frombuffer(result.repetition_means, dtype="<f8")
+
+
+def get_missing_result_workout_ids(db: Session, climber_id: int):
+    """Workouts of a climber whose first measurement has no cached result, in one query"""
+    first_measurement_ids = (
+        select(func.min(MeasurementEntity.id))
+        .join(WorkoutEntity, WorkoutEntity.id == MeasurementEntity.workout_id)
+        .where(WorkoutEntity.climber_id == climber_id)
+        .group_by(MeasurementEntity.workout_id)
+    )
+    cached_measurement_ids = select(MeasurementResultEntity.measurement_id).where(
+        MeasurementResultEntity.algorithm_version == ALGORITHM_VERSION)
+    return [
+        workout_id for (workout_id,) in db.query(MeasurementEntity.workout_id)
+        .filter(MeasurementEntity.id.in_(first_measurement_ids), MeasurementEntity.id.not_in(cached_measurement_ids))
+    ]
+
+
+def get_climber_result_history(db: Session, climber_id: int):
+    """Cached results of all the workouts of a climber in one query, ordered by date:
+    (workout_id, workout_name, created_at, measurement_id, critical_force, w_prime, max_force) rows."""
+    return (
+        db.query(WorkoutEntity.id.label("workout_id"), WorkoutEntity.workout_name, WorkoutEntity.created_at,
+                 MeasurementResultEntity.measurement_id, MeasurementResultEntity.critical_force,
+                 MeasurementResultEntity.w_prime, MeasurementResultEntity.max_force)
+        .join(MeasurementEntity, MeasurementEntity.workout_id == WorkoutEntity.id)
+        .join(MeasurementResultEntity, MeasurementResultEntity.measurement_id == MeasurementEntity.id)
+        .filter(WorkoutEntity.climber_id == climber_id,
+                MeasurementResultEntity.algorithm_version == ALGORITHM_VERSION)
+        .order_by(WorkoutEntity.created_at)
+        .all()
+    )
@@ -0,0 +1,122 @@
+'''
+Schema migrations of existing databases.
+
+`Base.metadata.create_all` creates the missing tables but never changes the existing ones, so every change of an
+existing table (new index, new column...) is added to MIGRATIONS and applied once by `upgrade`. The version of a
+database is stored in the schema_version table. Migrations must be idempotent, as new databases get the
+current schema from create_all before being stamped by `upgrade`.
+
+`migrate` (create_all then upgrade) is the one-time schema step of a deployment, run before starting the workers,
+which only check that the schema is up to date (see main.py).
+
+    python -m database.migrations
+'''
+from sqlalchemy import MetaData, Table, Column, Integer, select, text, inspect
+
+_metadata = MetaData()
+schema_version = Table("schema_version", _metadata, Column("version", Integer, nullable=False))
+
+
+def _add_query_indexes(connection):
+    # Workouts of a climber by date, measurements of a workout, climber lookup by name when importing
+    connection.execute(text("DROP INDEX IF EXISTS ix_workout_climber_id"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_workout_climber_id_created_at ON workout (climber_id, created_at)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_measurement_workout_id ON measurement (workout_id)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_climber_first_name_last_name ON climber (first_name, last_name)"))
+
+
+def _add_climber_updated_at(connection):
+    # Last modification of a climber, used by the ETags of the API
+    if "updated_at" not in {column["name"] for column in inspect(connection).get_columns("climber")}:
+        connection.execute(text("ALTER TABLE climber ADD COLUMN updated_at TIMESTAMP"))
+    connection.execute(text("UPDATE climber SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL"))
+
+
+def _queue_analytics_rollups(connection):
+    # Existing climbers get their analytics rollups at the first refresh (see database/analytics.py)
+    connection.execute(text("INSERT INTO analytics_stale_climber (climber_id) SELECT id FROM climber"))
+
+
+def _fill_known_workout_protocols(connection):
+    # Protocol of the critical force test (database/workout_protocols.py), imported workout types had none
+    for column, value in (("sets_number", 1), ("set_pause", 0), ("repetitions", 24), ("repetition_active", 7),
+                          ("repetition_pause", 3)):
+        connection.execute(text(f"UPDATE workout_type SET {column} = {value} "
+                                f"WHERE name = 'Critical Force Test' AND {column} IS NULL"))
+
+
+def _add_job_heartbeat(connection):
+    # Jobs are owned by a worker id and kept alive by its heartbeat (see jobs/queue.py), the pid column is left unused
+    columns = {column["name"] for column in inspect(connection).get_columns("job")}
+    for column, column_type in (("worker_id", "VARCHAR"), ("heartbeat_at", "TIMESTAMP")):
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE job ADD COLUMN {column} {column_type}"))
+
+
+def _deduplicate_analytics_stale_climbers(connection):
+    # A climber is queued once for the analytics refresh, its later changes bump change_count
+    columns = {column["name"] for column in inspect(connection).get_columns("analytics_stale_climber")}
+    if "change_count" not in columns:
+        connection.execute(text(
+            "ALTER TABLE analytics_stale_climber ADD COLUMN change_count INTEGER NOT NULL DEFAULT 1"))
+    connection.execute(text("DELETE FROM analytics_stale_climber WHERE id NOT IN "
+                            "(SELECT min(id) FROM analytics_stale_climber GROUP BY climber_id)"))
+    connection.execute(text("DROP INDEX IF EXISTS ix_analytics_stale_climber_climber_id"))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX ix_analytics_stale_climber_climber_id ON analytics_stale_climber (climber_id)"))
+
+
+# Applied in order, the schema version of a database is the number of applied migrations
+MIGRATIONS = [
+    _add_query_indexes,
+    _add_climber_updated_at,
+    _queue_analytics_rollups,
+    _fill_known_workout_protocols,
+    _add_job_heartbeat,
+    _deduplicate_analytics_stale_climbers,
+]
+
+
+def get_version(connection):
+    _metadata.create_all(connection)
+    return connection.execute(select(schema_version.c.version)).scalar() or 0
+
+
+def upgrade(engine):
+    """Apply the pending migrations in a single transaction, returns the number of applied migrations"""
+    with engine.begin() as connection:
+        version = get_version(connection)
+        for migration in MIGRATIONS[version:]:
+            migration(connection)
+        connection.execute(schema_version.delete())
+        connection.execute(schema_version.insert().values(version=len(MIGRATIONS)))
+    return len(MIGRATIONS) - version
+
+
+def migrate(engine):
+    """Create the missing tables and apply the pending migrations, returns the number of applied migrations"""
+    from database.database import Base
+    from models import models  # noqa: F401, registers the tables on Base.metadata
+
+    Base.metadata.create_all(bind=engine)
+    return upgrade(engine)
+
+
+def is_up_to_date(engine):
+    """Whether every table exists and every migration is applied, without writing anything"""
+    from database.database import Base
+    from models import models  # noqa: F401
+
+    with engine.connect() as connection:
+        tables = set(inspect(connection).get_table_names())
+        if schema_version.name not in tables or not set(Base.metadata.tables) <= tables:
+            return False
+        return (connection.execute(select(schema_version.c.version)).scalar() or 0) >= len(MIGRATIONS)
+
+
+if __name__ == "__main__":
+    from database.database import engine
+
+    print(f"{migrate(engine)} migrations applied")
@@ -0,0 +1,107 @@
+'''
+Measured samples as NumPy arrays, whichever storage mode holds them (rows or packed blobs, see
+database/sample_storage.py). async_sample_arrays.py mirrors it for the AsyncSession of the routes.
+
+These helpers live apart from crud.py so that NumPy is imported with this module, by the pages, exports and jobs
+working on samples, and not when the application starts.
+'''
+import numpy as np
+from sqlalchemy.orm import Session
+
+from database import crud, sample_storage
+from models.models import MeasuredDataEntity, MeasuredDataBlobEntity, MeasurementEntity, WorkoutEntity
+
+
+def empty_arrays():
+    """(iterations, weights) of a measurement without samples"""
+    return np.empty(0, dtype=np.int64), np.empty(0)
+
+
+def blob_arrays(measured_data_blob: MeasuredDataBlobEntity):
+    """(iterations, weights) of a packed blob, whose samples are numbered from 1"""
+    weights = sample_storage.unpack_samples(measured_data_blob)
+    return np.arange(1, len(weights) + 1), weights
+
+
+def iteration_weight_arrays(rows):
+    # (iteration, weight) rows -> (iterations, weights) arrays
+    if not rows:
+        return empty_arrays()
+    iterations, weights = zip(*rows)
+    return np.asarray(iterations, dtype=np.int64), np.asarray(weights, dtype=np.float64)
+
+
+def group_measured_data_rows(rows):
+    # (measurement_id, iteration, weight) rows ordered by measurement -> dict of (iterations, weights) arrays
+    if not rows:
+        return {}
+    measurement_ids, iterations, weights = (np.asarray(column) for column in zip(*rows))
+    boundaries = np.flatnonzero(np.diff(measurement_ids)) + 1
+    starts = np.concatenate(([0], boundaries))
+    return {
+        int(measurement_ids[start]): (iteration_chunk, weight_chunk.astype(np.float64))
+        for start, iteration_chunk, weight_chunk in zip(starts, np.split(iterations, boundaries),
+                                                        np.split(weights, boundaries))
+    }
+
+
+def get_climber_measured_data_arrays(db: Session, climber_id: int):
+    """measured_data rows of all the measurements of a climber in a single query,
+    as a dict measurement_id -> (iterations, weights) NumPy arrays ordered by iteration"""
+    rows = (
+        db.query(MeasuredDataEntity.measurement_id, MeasuredDataEntity.iteration, MeasuredDataEntity.weight)
+        .join(MeasurementEntity, MeasurementEntity.id == MeasuredDataEntity.measurement_id)
+        .join(WorkoutEntity, WorkoutEntity.id == MeasurementEntity.workout_id)
+        .filter(WorkoutEntity.climber_id == climber_id)
+        .order_by(MeasuredDataEntity.measurement_id, MeasuredDataEntity.iteration)
+        .all()
+    )
+    return group_measured_data_rows(rows)
+
+
+def get_measured_data_arrays(db: Session, measurement_ids):
+    """(iterations, weights) arrays of the measurements, from their blobs or else their measured_data rows, in two
+    queries whatever the number of measurements. Measurements without samples are missing from the dict."""
+    measurement_ids = list(measurement_ids)
+    if not measurement_ids:
+        return {}
+    measured_data_blobs = (
+        db.query(MeasuredDataBlobEntity)
+        .filter(MeasuredDataBlobEntity.measurement_id.in_(measurement_ids))
+        .all()
+    )
+    arrays = {measured_data_blob.measurement_id: blob_arrays(measured_data_blob)
+              for measured_data_blob in measured_data_blobs}
+    row_measurement_ids = [measurement_id for measurement_id in measurement_ids if measurement_id not in arrays]
+    rows = (
+        db.query(MeasuredDataEntity.measurement_id, MeasuredDataEntity.iteration, MeasuredDataEntity.weight)
+        .filter(MeasuredDataEntity.measurement_id.in_(row_measurement_ids))
+        .order_by(MeasuredDataEntity.measurement_id, MeasuredDataEntity.iteration)
+        .all()
+    )
+    arrays.update(group_measured_data_rows(rows))
+    return arrays
+
+
+def get_measured_data_array(db: Session, measurement_id: int):
+    """Samples of a measurement ordered by iteration as a NumPy array, whichever storage mode holds them"""
+    measured_data_blob = crud.get_measured_data_blob(db, measurement_id)
+    if measured_data_blob is not None:
+        return sample_storage.unpack_samples(measured_data_blob)
+    weights = (
+        db.query(MeasuredDataEntity.weight)
+        .filter(MeasuredDataEntity.measurement_id == measurement_id)
+        .order_by(MeasuredDataEntity.iteration)
+        .all()
+    )
+    return np.fromiter((weight for (weight,) in weights), dtype=np.float64, count=len(weights))
+
+
+def create_measured_data_blob(db: Session, measurement_id: int, weights, dtype: str = sample_storage.SAMPLE_DTYPE):
+    """Store all samples of a measurement as one packed array. Like crud.bulk_create_measured_data, does not commit."""
+    weights = np.asarray(weights)
+    measured_data_blob = MeasuredDataBlobEntity(measurement_id=measurement_id, dtype=dtype, sample_count=len(weights),
+                                                data=sample_storage.pack_samples(weights, dtype))
+    db.add(measured_data_blob)
+    db.flush()
+    return measured_data_blob
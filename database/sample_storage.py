@@ -0,0 +1,73 @@
+'''
+Compact storage of the measured samples: one packed float array per measurement in `measured_data_blob`
+instead of one `measured_data` row per sample.
+
+The storage mode used by the importers is selected with the SAMPLE_STORAGE_MODE environment variable
+("rows", the default, or "blob") and the packed precision with SAMPLE_DTYPE ("float32", the default, or "float64").
+Existing databases are converted with `python -m database.sample_storage [--delete-rows]`.
+'''
+import argparse
+import os
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from models.models import MeasuredDataEntity, MeasuredDataBlobEntity, MeasurementEntity
+
+STORAGE_ROWS = "rows"
+STORAGE_BLOB = "blob"
+SAMPLE_STORAGE_MODE = os.getenv("SAMPLE_STORAGE_MODE", STORAGE_ROWS)
+SAMPLE_DTYPE = os.getenv("SAMPLE_DTYPE", "float32")
+
+_DTYPES = {"float32": "<f4", "float64": "<f8"}
+
+
+def pack_samples(weights, dtype: str = SAMPLE_DTYPE):
+    if dtype not in _DTYPES:
+        raise ValueError(f"Unsupported sample dtype '{dtype}', expected one of {list(_DTYPES)}")
+    return np.ascontiguousarray(weights, dtype=_DTYPES[dtype]).tobytes()
+
+
+def unpack_samples(blob: MeasuredDataBlobEntity):
+    # Zero-copy, read-only view on the bytes returned by the database driver
+    return np.frombuffer(blob.data, dtype=_DTYPES[blob.dtype], count=blob.sample_count)
+
+
+def migrate_rows_to_blobs(db: Session, dtype: str = SAMPLE_DTYPE, delete_rows: bool = False, batch_size: int = 100):
+    """Pack the measured_data rows of every measurement that has no blob yet, committing every `batch_size`
+    measurements. Returns the number of migrated measurements."""
+    pending = (
+        db.query(MeasurementEntity.id)
+        .filter(~MeasurementEntity.measured_data_blob.has())
+        .filter(MeasurementEntity.measured_data.any())
+        .order_by(MeasurementEntity.id)
+    )
+    measurement_ids = [measurement_id for (measurement_id,) in pending]
+    for position, measurement_id in enumerate(measurement_ids, start=1):
+        weights = [weight for (weight,) in db.query(MeasuredDataEntity.weight)
+                   .filter(MeasuredDataEntity.measurement_id == measurement_id)
+                   .order_by(MeasuredDataEntity.iteration)]
+        db.add(MeasuredDataBlobEntity(measurement_id=measurement_id, dtype=dtype, sample_count=len(weights),
+                                      data=pack_samples(weights, dtype)))
+        if delete_rows:
+            db.query(MeasuredDataEntity).filter(MeasuredDataEntity.measurement_id == measurement_id).delete()
+        if position % batch_size == 0:
+            db.commit()
+    db.commit()
+    return len(measurement_ids)
+
+
+if __name__ == "__main__":
+    from database.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Convert measured_data rows to packed measured_data_blob arrays")
+    parser.add_argument("--dtype", choices=list(_DTYPES), default=SAMPLE_DTYPE)
+    parser.add_argument("--delete-rows", action="store_true", help="delete the measured_data rows once packed")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        migrated = migrate_rows_to_blobs(session, dtype=args.dtype, delete_rows=args.delete_rows)
+    finally:
+        session.close()
+    print(f"{migrated} measurements migrated")
@@ -0,0 +1,28 @@
+'''
+Request-scoped sessions of the FastAPI apps (webapi.api_v1 and temp_ui.ui): one session per request, closed before
+the response is sent, its lifetime observed in db_session_duration_seconds. Sessions needed after the response
+(streamed bodies, websockets) are opened with `async with AsyncSessionLocal()` in the code that outlives it.
+'''
+import time
+
+from database.database import SessionLocal, AsyncSessionLocal
+from monitoring import metrics
+
+
+def get_db():
+    db = SessionLocal()
+    opened_at = time.perf_counter()
+    try:
+        yield db
+    finally:
+        db.close()
+        metrics.db_session_duration.observe(time.perf_counter() - opened_at, ("sync",))
+
+
+async def get_async_db():
+    opened_at = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            yield db
+    finally:
+        metrics.db_session_duration.observe(time.perf_counter() - opened_at, ("async",))
@@ -0,0 +1,180 @@
+'''
+Workout protocols: lookup tables of the workout types for computeRepetitionMean, and the computation of the
+critical force results of the imported sessions.
+
+A workout type with all its protocol columns set (sets_number, set_pause, repetitions, repetition_active,
+repetition_pause) is compiled by compute.protocol.compileProtocol, memoized per protocol and sample rate, and
+aligned on the first pull of each recording. Workout types with an unknown protocol fall back to the repetitions
+detected in the force signal.
+
+    python -m database.workout_protocols [--climber ID]
+'''
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session, joinedload
+
+from compute.criticalForce import computeRepetitionMean
+from compute.protocol import compileProtocol, alignProtocol, detectRepetitions
+from database import measurement_results, sample_arrays
+from database.workout_results import store_workout_results
+from models.models import WorkoutEntity, WorkoutTypeEntity, MeasurementEntity
+
+DEFAULT_SAMPLE_RATE = 10
+# Workouts loaded per batch by iter_recordings, also bounds the ids of the IN clauses
+COMPUTE_BATCH_SIZE = 500
+
+PROTOCOL_COLUMNS = ("sets_number", "set_pause", "repetitions", "repetition_active", "repetition_pause")
+
+# Protocols of the workouts recorded by the measurement app. Max isometric strength pulls are done at the
+# climber's own pace, their repetitions are detected.
+KNOWN_PROTOCOLS = {
+    "Critical Force Test": {"sets_number": 1, "set_pause": 0, "repetitions": 24, "repetition_active": 7,
+                            "repetition_pause": 3},
+}
+
+
+def fill_known_protocol(workout_type: WorkoutTypeEntity):
+    """Set the protocol columns left empty of a known workout type"""
+    for column, value in KNOWN_PROTOCOLS.get(workout_type.name, {}).items():
+        if getattr(workout_type, column) is None:
+            setattr(workout_type, column, value)
+    return workout_type
+
+
+def get_protocol(workout_type: WorkoutTypeEntity):
+    """Protocol columns of a workout type as a tuple, None when one of them is unknown"""
+    if workout_type is None:
+        return None
+    protocol = tuple(getattr(workout_type, column) for column in PROTOCOL_COLUMNS)
+    return None if None in protocol else protocol
+
+
+def get_lookup_table(workout_type: WorkoutTypeEntity, samples, sample_rate: int):
+    """Per-sample lookup table of a recording, to use with computeRepetitionMean(samples, table, 1)"""
+    protocol = get_protocol(workout_type)
+    if protocol is None:
+        return detectRepetitions(samples, sample_rate)
+    active, _ = compileProtocol(*protocol, sample_rate)
+    return alignProtocol(active, samples, sample_rate)
+
+
+def get_repetition_duration(workout_type: WorkoutTypeEntity, lookup_table, sample_rate: int):
+    """Active seconds of a repetition: from the protocol, or the median length of the pulls of the lookup table"""
+    protocol = get_protocol(workout_type)
+    if protocol is not None:
+        return protocol[PROTOCOL_COLUMNS.index("repetition_active")]
+    edges = np.diff(np.concatenate(([0], lookup_table, [0])).astype(np.int8))
+    lengths = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    return round(float(np.median(lengths)) / sample_rate, 1) if len(lengths) else 0.0
+
+
+def repetition_mean_for(lookup_tables):
+    """`repetition_mean_for(measurement_id, samples)` callback of measurement_results.get_or_compute_results,
+    from a dict measurement_id -> lookup table"""
+    def repetition_mean(measurement_id, samples):
+        return computeRepetitionMean(samples, lookup_tables[measurement_id], 1)
+    return repetition_mean
+
+
+def get_first_measurements(db: Session, workout_ids):
+    """First measurement of each workout with its device, in one query: dict workout_id -> MeasurementEntity"""
+    first_ids = (
+        select(func.min(MeasurementEntity.id))
+        .where(MeasurementEntity.workout_id.in_(workout_ids))
+        .group_by(MeasurementEntity.workout_id)
+    )
+    measurements = (
+        db.query(MeasurementEntity)
+        .options(joinedload(MeasurementEntity.measurement_device))
+        .filter(MeasurementEntity.id.in_(first_ids))
+        .all()
+    )
+    return {measurement.workout_id: measurement for measurement in measurements}
+
+
+def iter_recordings(db: Session, workouts, batch_size: int = COMPUTE_BATCH_SIZE):
+    """(workout, recording) of each workout, recording being the (measurement_id, samples, lookup_table,
+    repetition_duration) of its first measurement, or None when it has no sample. Workouts are loaded by batches of
+    `batch_size` with a constant number of queries per batch."""
+    for start in range(0, len(workouts), batch_size):
+        batch = workouts[start:start + batch_size]
+        measurements = get_first_measurements(db, [workout.id for workout in batch])
+        arrays = sample_arrays.get_measured_data_arrays(db, [measurement.id for measurement in measurements.values()])
+        for workout in batch:
+            measurement = measurements.get(workout.id)
+            if measurement is None or measurement.id not in arrays:
+                yield workout, None
+                continue
+            sample_rate = DEFAULT_SAMPLE_RATE if measurement.measurement_device is None \
+                else measurement.measurement_device.sample_rate_hz
+            _, samples = arrays[measurement.id]
+            lookup_table = get_lookup_table(workout.workout_type, samples, sample_rate)
+            repetition_duration = get_repetition_duration(workout.workout_type, lookup_table, sample_rate)
+            yield workout, (measurement.id, samples, lookup_table, repetition_duration)
+
+
+def compute_workout_results(db: Session, climber_id: int = None, progress=None,
+                            batch_size: int = COMPUTE_BATCH_SIZE):
+    """Compute and store the results of every workout (of a climber) from the samples of its first measurement.
+
+    Workouts are grouped by repetition duration, each group is stored with one store_workout_results call.
+    `progress(done, total)` is called for each workout. Returns the number of workouts with a result.
+    """
+    query = db.query(WorkoutEntity).options(joinedload(WorkoutEntity.workout_type))
+    if climber_id is not None:
+        query = query.filter(WorkoutEntity.climber_id == climber_id)
+
+    groups = {}
+    workouts = query.order_by(WorkoutEntity.id).all()
+    for done, (workout, recording) in enumerate(iter_recordings(db, workouts, batch_size)):
+        if progress is not None:
+            progress(done, len(workouts))
+        if recording is None:
+            continue
+        _, samples, lookup_table, repetition_duration = recording
+        group = groups.setdefault(repetition_duration, ([], []))
+        group[0].append(workout)
+        group[1].append(computeRepetitionMean(samples, lookup_table, 1))
+
+    for repetition_duration, (group_workouts, repetition_means) in groups.items():
+        store_workout_results(db, group_workouts, repetition_means, repetition_duration)
+    return sum(len(group_workouts) for group_workouts, _ in groups.values())
+
+
+def get_climber_results(db: Session, climber_id: int):
+    """Result history of a climber (measurement_results.get_climber_result_history), computing first the results
+    missing from measurement_result. Once stored, the history is read with two indexed queries, until the samples
+    of a workout change."""
+    workout_ids = measurement_results.get_missing_result_workout_ids(db, climber_id)
+    if workout_ids:
+        workouts = (
+            db.query(WorkoutEntity)
+            .options(joinedload(WorkoutEntity.workout_type))
+            .filter(WorkoutEntity.id.in_(workout_ids))
+            .order_by(WorkoutEntity.id)
+            .all()
+        )
+        samples = {}
+        lookup_tables = {}
+        for _, recording in iter_recordings(db, workouts):
+            if recording is None:
+                continue
+            measurement_id, samples[measurement_id], lookup_table, repetition_duration = recording
+            lookup_tables.setdefault(repetition_duration, {})[measurement_id] = lookup_table
+        for repetition_duration, tables in lookup_tables.items():
+            measurement_results.get_or_compute_results(db, tables, repetition_mean_for(tables), repetition_duration,
+                                                       samples)
+    return measurement_results.get_climber_result_history(db, climber_id)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Compute the critical force results of the imported workouts")
+    parser.add_argument("--climber", type=int, default=None, help="only the workouts of this climber")
+    args = parser.parse_args()
+    with SessionLocal() as session:
+        computed = compute_workout_results(session, args.climber)
+    print(f"{computed} workouts computed")
@@ -0,0 +1,41 @@
+'''
+Persistence of the computed workout results (critical force, W' and max force) in the
+critical_force_workout and max_iso_strength_workout tables.
+'''
+import numpy as np
+from sqlalchemy.orm import Session
+
+from compute.batch import computeWorkoutResultsBatch
+from database import crud
+
+CRITICAL_FORCE_WORKOUT_NAME = "Critical Force Test"
+
+
+def store_workout_results(db: Session, workouts, repetition_means, repetition_duration, lengths=None):
+    """Compute the results of all `workouts` from their repetition means in one vectorized pass and store them in bulk.
+
+    `repetition_means` is a sequence of 1-D arrays or a padded 2-D matrix with `lengths`, in the order of `workouts`.
+    Critical force tests are stored in critical_force_workout, the other workouts in max_iso_strength_workout.
+    Workouts without any sample are skipped. Returns the (critical force, W', max force) arrays.
+    """
+    critical_force, w_prime, max_force = computeWorkoutResultsBatch(repetition_means, repetition_duration, lengths)
+
+    critical_force_rows = []
+    max_iso_strength_rows = []
+    for workout, cf, w, max_f in zip(workouts, critical_force.tolist(), w_prime.tolist(), max_force.tolist()):
+        if np.isnan(max_f):
+            continue
+        if workout.workout_name == CRITICAL_FORCE_WORKOUT_NAME:
+            critical_force_rows.append({"workout_id": workout.id, "critical_force": cf, "w_prime": w,
+                                        "max_force": max_f})
+        else:
+            max_iso_strength_rows.append({"workout_id": workout.id, "max_force": max_f})
+
+    try:
+        crud.bulk_replace_critical_force_workouts(db, critical_force_rows)
+        crud.bulk_replace_max_iso_strength_workouts(db, max_iso_strength_rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return critical_force, w_prime, max_force
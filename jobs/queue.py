@@ -0,0 +1,260 @@
+'''
+In-process background jobs: imports, recomputation of the results and exports run in a thread pool of each worker
+process, off the request path, while their state is persisted in the job table so that any worker can report it.
+
+    job = job_queue.submit(db, "import", {"directory": "./example_data"})
+    job_queue.cancel(db, job.id)
+
+A job goes queued -> running -> succeeded / failed / cancelled. Running jobs update their progress in their own
+short transactions, at most every JOB_PROGRESS_INTERVAL seconds, and stop at their next progress update once a
+cancel is requested (cancel_requested is read from the database, so any worker can cancel any job).
+
+Each process owns its jobs under a random WORKER_ID and refreshes their heartbeat_at every JOB_HEARTBEAT_INTERVAL
+seconds from a heartbeat thread (started by main.py). Jobs left queued or running by a worker process that is gone
+have a stale heartbeat: recover_interrupted_jobs fails them at startup and at every heartbeat of the other processes.
+
+JOB_WORKERS threads run the jobs of a process. NumPy releases the GIL in the compute functions and the imports
+parse the files in a process pool, so heavy jobs use several cores. The tasks (and the compute modules they use)
+are only imported by the first job of the process.
+'''
+import inspect
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from database.database import SessionLocal
+from models.models import JobEntity
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "0.5"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "10"))
+JOB_HEARTBEAT_TIMEOUT = float(os.getenv("JOB_HEARTBEAT_TIMEOUT", "60"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+logger = logging.getLogger(__name__)
+
+# Unlike a pid, unique across hosts, containers and restarts
+WORKER_ID = uuid.uuid4().hex
+
+
+def _new_worker_id():
+    # Workers forked from a preloaded application get their own id
+    global WORKER_ID
+    WORKER_ID = uuid.uuid4().hex
+
+
+os.register_at_fork(after_in_child=_new_worker_id)
+
+
+class InvalidJob(ValueError):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """What a task sees of its job: its id, a session for its work and the progress reporting"""
+
+    def __init__(self, session_factory, job_id: int, db: Session):
+        self.session_factory = session_factory
+        self.job_id = job_id
+        self.db = db
+        self._last_update = 0.0
+
+    def progress(self, done, total=None, message: str = None):
+        """Store the progress (done / total) of the job, raises JobCancelled if a cancel was requested"""
+        now = time.monotonic()
+        if now - self._last_update < JOB_PROGRESS_INTERVAL:
+            return
+        self._last_update = now
+        values = {"message": message} if message is not None else {}
+        if total:
+            values["progress"] = min(done / total, 1.0)
+        with self.session_factory() as db:
+            if values:
+                db.execute(update(JobEntity).where(JobEntity.id == self.job_id).values(**values))
+            cancel_requested = db.execute(select(JobEntity.cancel_requested)
+                                          .where(JobEntity.id == self.job_id)).scalar()
+            db.commit()
+        if cancel_requested:
+            raise JobCancelled()
+
+
+class JobQueue:
+    def __init__(self, session_factory=SessionLocal, workers: int = JOB_WORKERS, tasks=None, param_checks=None):
+        self.session_factory = session_factory
+        self.workers = workers
+        self._tasks = tasks
+        self._param_checks = param_checks
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._heartbeat = None
+
+    @property
+    def tasks(self):
+        if self._tasks is None:
+            from jobs.tasks import TASKS
+            self._tasks = TASKS
+        return self._tasks
+
+    @property
+    def param_checks(self):
+        if self._param_checks is None:
+            from jobs.tasks import PARAM_CHECKS
+            self._param_checks = PARAM_CHECKS
+        return self._param_checks
+
+    def submit(self, db: Session, kind: str, params: dict = None):
+        """Persist a queued job in `db` and schedule it, raises InvalidJob for unknown kinds or params"""
+        params = params or {}
+        task = self.tasks.get(kind)
+        if task is None:
+            raise InvalidJob(f"Unknown job kind '{kind}', expected one of {list(self.tasks)}")
+        try:
+            inspect.signature(task).bind(None, **params)
+            check_params = self.param_checks.get(kind)
+            if check_params is not None:
+                check_params(**params)
+        except (TypeError, ValueError) as error:
+            raise InvalidJob(f"Invalid params for the {kind} job: {error}")
+
+        now = datetime.now()
+        job = JobEntity(kind=kind, params=params, status=QUEUED, progress=0.0, cancel_requested=False,
+                        worker_id=WORKER_ID, heartbeat_at=now, created_at=now)
+        db.add(job)
+        db.commit()
+        self.start_heartbeat()
+        with self._lock:
+            if self._executor is None:
+                # Threads are only started by the first job of the process
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            self._futures[job.id] = self._executor.submit(self._run, job.id)
+        return job
+
+    def cancel(self, db: Session, job_id: int):
+        """Cancel a queued job, or request a running job to stop at its next progress update.
+        Returns the job, None if it does not exist."""
+        job = db.get(JobEntity, job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        job.cancel_requested = True
+        with self._lock:
+            future = self._futures.get(job_id)
+        if job.status == QUEUED and (future is None or future.cancel()):
+            # Not started yet, or queued by another worker process which skips it when its turn comes
+            job.status = CANCELLED
+            job.finished_at = datetime.now()
+        db.commit()
+        return job
+
+    def start_heartbeat(self):
+        """Start the thread refreshing the heartbeat of the jobs of this process, which also fails the jobs of the
+        processes that stopped"""
+        with self._lock:
+            if self._heartbeat is None:
+                # The heartbeat thread runs until its stop event is set by shutdown
+                self._heartbeat = threading.Event()
+                threading.Thread(target=self._beat, args=(self._heartbeat,), name="job-heartbeat", daemon=True).start()
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            heartbeat, self._heartbeat = self._heartbeat, None
+        if heartbeat is not None:
+            heartbeat.set()
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _beat(self, stopped: threading.Event):
+        while not stopped.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                with self.session_factory() as db:
+                    refresh_heartbeats(db)
+                    recover_interrupted_jobs(db)
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+    def _run(self, job_id: int):
+        try:
+            with self.session_factory() as db:
+                job = db.get(JobEntity, job_id)
+                if job is None or job.status != QUEUED:
+                    return
+                job.status = RUNNING
+                job.started_at = job.heartbeat_at = datetime.now()
+                db.commit()
+                kind, params = job.kind, job.params or {}
+
+            with self.session_factory() as db:
+                context = JobContext(self.session_factory, job_id, db)
+                try:
+                    values = {"status": SUCCEEDED, "progress": 1.0, "result": self.tasks[kind](context, **params)}
+                except JobCancelled:
+                    db.rollback()
+                    values = {"status": CANCELLED}
+                except Exception as error:
+                    logger.exception("Job %s (%s) failed", job_id, kind)
+                    db.rollback()
+                    values = {"status": FAILED, "error": f"{type(error).__name__}: {error}"}
+
+            with self.session_factory() as db:
+                db.execute(update(JobEntity).where(JobEntity.id == job_id)
+                           .values(finished_at=datetime.now(), **values))
+                db.commit()
+        finally:
+            with self._lock:
+                self._futures.pop(job_id, None)
+
+
+def get_job(db: Session, job_id: int):
+    return db.get(JobEntity, job_id)
+
+
+def get_jobs(db: Session, status: str = None, limit: int = 50):
+    """Latest jobs first"""
+    query = db.query(JobEntity)
+    if status is not None:
+        query = query.filter(JobEntity.status == status)
+    return query.order_by(JobEntity.id.desc()).limit(limit).all()
+
+
+def refresh_heartbeats(db: Session):
+    """Mark the queued and running jobs of this process as alive"""
+    db.execute(update(JobEntity)
+               .where(JobEntity.worker_id == WORKER_ID, JobEntity.status.in_((QUEUED, RUNNING)))
+               .values(heartbeat_at=datetime.now()))
+    db.commit()
+
+
+def recover_interrupted_jobs(db: Session):
+    """Fail the queued and running jobs whose heartbeat is older than JOB_HEARTBEAT_TIMEOUT, their worker process
+    stopped. Returns their number."""
+    stale = datetime.now() - timedelta(seconds=JOB_HEARTBEAT_TIMEOUT)
+    interrupted = db.execute(
+        update(JobEntity)
+        .where(JobEntity.status.in_((QUEUED, RUNNING)),
+               or_(JobEntity.heartbeat_at.is_(None), JobEntity.heartbeat_at < stale))
+        .values(status=FAILED, error="Interrupted: the worker process running the job stopped",
+                finished_at=datetime.now())
+    ).rowcount
+    db.commit()
+    return interrupted
+
+
+job_queue = JobQueue()
@@ -0,0 +1,116 @@
+'''
+Tasks of the background jobs (see jobs/queue.py), by job kind.
+
+A task is called with the JobContext of its job and the params of the job as keyword arguments. It works in
+context.db, reports its progress with context.progress(done, total, message), which raises JobCancelled once the
+job is cancelled, and returns a JSON serializable result.
+'''
+import multiprocessing
+import os
+
+from database import analytics, crud, import_tool, sample_arrays
+from database.database import DATABASE_DIRECTORY
+from database.workout_protocols import compute_workout_results
+from models.models import MeasurementEntity
+from webapi import sample_export, sample_formats
+
+EXPORT_DIRECTORY = os.getenv("JOB_EXPORT_DIRECTORY", os.path.join(DATABASE_DIRECTORY, "exports"))
+EXPORT_EXTENSIONS = {sample_formats.RAW: "bin", sample_formats.ARROW: "arrow", sample_formats.PARQUET: "parquet"}
+# Measurements read at once by the export jobs
+EXPORT_CHUNK_SIZE = 500
+# Import jobs only read these directories (and their subdirectories), separated by os.pathsep, and parse the files
+# with at most JOB_IMPORT_MAX_WORKERS processes
+IMPORT_DIRECTORIES = os.getenv("JOB_IMPORT_DIRECTORIES", import_tool.EXAMPLE_DATA_DIRECTORY).split(os.pathsep)
+IMPORT_MAX_WORKERS = int(os.getenv("JOB_IMPORT_MAX_WORKERS", "2"))
+
+
+def check_import_params(directory: str = import_tool.EXAMPLE_DATA_DIRECTORY, preprocess: bool = False,
+                        workers: int = 1):
+    """Raises ValueError unless the directory is in IMPORT_DIRECTORIES and workers is a number of processes"""
+    path = os.path.realpath(directory)
+    allowed = [os.path.realpath(allowed_directory) for allowed_directory in IMPORT_DIRECTORIES if allowed_directory]
+    if not any(os.path.commonpath((path, allowed_directory)) == allowed_directory for allowed_directory in allowed):
+        raise ValueError(f"Data directory '{directory}' is not one of JOB_IMPORT_DIRECTORIES")
+    if not isinstance(workers, int) or isinstance(workers, bool) or workers < 1:
+        raise ValueError("workers must be a positive number of processes")
+
+
+def import_files(context, directory: str = import_tool.EXAMPLE_DATA_DIRECTORY, preprocess: bool = False,
+                 workers: int = 1):
+    """Import the json files of a directory, then refresh the analytics rollups. Files are imported in their own
+    transaction, so a cancelled import keeps the files imported so far and a new import skips them."""
+    check_import_params(directory, preprocess, workers)
+    if not os.path.isdir(directory):
+        raise ValueError(f"Data directory '{directory}' not found")
+    total = import_tool.count_json_files(directory)
+    done = 0
+
+    def on_file(filename):
+        nonlocal done
+        done += 1
+        context.progress(done, total, filename)
+
+    # The parser processes are spawned: forking the threads of a web worker process is unsafe
+    report = import_tool.import_directory(context.db, directory, workers=min(workers, IMPORT_MAX_WORKERS),
+                                          preprocess=preprocess, on_file=on_file,
+                                          mp_context=multiprocessing.get_context("spawn"))
+    context.progress(total, total, "refreshing analytics rollups")
+    return {"imported": len(report["imported"]), "skipped": len(report["skipped"]), "failed": report["failed"],
+            "climbers_refreshed": analytics.refresh_rollups(context.db)}
+
+
+def recompute_results(context, climber_id: int = None):
+    """Recompute the critical force results of every workout (of a climber), then the analytics rollups"""
+    computed = compute_workout_results(context.db, climber_id, progress=context.progress)
+    context.progress(1, 1, "refreshing analytics rollups")
+    return {"workouts": computed, "climbers_refreshed": analytics.refresh_rollups(context.db)}
+
+
+def export_samples(context, measurement_ids: list = None, format: str = sample_formats.RAW):
+    """Write the samples of the measurements (all of them by default) to a file of EXPORT_DIRECTORY, in the raw,
+    arrow or parquet format of webapi/sample_formats.py"""
+    if format not in EXPORT_EXTENSIONS:
+        raise ValueError(f"Unsupported format '{format}', expected one of {list(EXPORT_EXTENSIONS)}")
+    sample_formats.check_available(format)
+    if measurement_ids is None:
+        measurement_ids = [measurement_id for (measurement_id,) in
+                           context.db.query(MeasurementEntity.id).order_by(MeasurementEntity.id)]
+
+    os.makedirs(EXPORT_DIRECTORY, exist_ok=True)
+    path = os.path.join(EXPORT_DIRECTORY, f"job-{context.job_id}.{EXPORT_EXTENSIONS[format]}")
+    writer = None if format == sample_formats.RAW else sample_export.TableWriter(format)
+    exported = 0
+    with open(path, "wb") as f:
+        for start in range(0, len(measurement_ids), EXPORT_CHUNK_SIZE):
+            context.progress(start, len(measurement_ids))
+            chunk = measurement_ids[start:start + EXPORT_CHUNK_SIZE]
+            measurements = crud.get_measurements_with_devices(context.db, chunk)
+            arrays = sample_arrays.get_measured_data_arrays(context.db, list(measurements))
+            for measurement_id in chunk:
+                measurement = measurements.get(measurement_id)
+                if measurement is None:
+                    continue
+                iterations, samples = arrays.get(measurement_id, sample_arrays.empty_arrays())
+                if writer is None:
+                    device = measurement.measurement_device
+                    f.write(sample_export.raw_frame(measurement_id, samples,
+                                                    device.sample_rate_hz if device else None))
+                else:
+                    f.write(writer.write(measurement_id, iterations, samples))
+                exported += 1
+            context.db.expunge_all()
+        if writer is not None:
+            f.write(writer.close())
+    return {"path": path, "format": format, "measurements": exported, "bytes": os.path.getsize(path)}
+
+
+TASKS = {
+    "import": import_files,
+    "recompute": recompute_results,
+    "export": export_samples,
+}
+
+# Called by JobQueue.submit with the params of a new job, a ValueError rejects the job
+PARAM_CHECKS = {
+    "import": check_import_params,
+}
@@ -1,19 +1,53 @@
 # main.py
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from starlette.staticfiles import StaticFiles
 
 from webapi import webapi
 from temp_ui import temp_ui
-from database.database import Base, engine
+from database.database import engine, async_engine, SessionLocal
+from database.migrations import migrate, is_up_to_date
+from jobs.queue import job_queue, recover_interrupted_jobs
+from monitoring.metrics import render_prometheus
+from monitoring.middleware import MetricsMiddleware
 
-app = FastAPI()
+# The schema is created and migrated once per deployment with `python -m database.migrations`, before the workers
+# start. DATABASE_AUTO_MIGRATE=1 does it at startup instead, for a single development process.
+DATABASE_AUTO_MIGRATE = os.getenv("DATABASE_AUTO_MIGRATE", "0") == "1"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DATABASE_AUTO_MIGRATE:
+        migrate(engine)
+    elif not is_up_to_date(engine):
+        raise RuntimeError("The database schema is not up to date, run `python -m database.migrations` first")
+    with SessionLocal() as session:
+        recover_interrupted_jobs(session)
+    job_queue.start_heartbeat()
+    yield
+    # Unfinished jobs stop being kept alive and are failed once their heartbeat is stale, pooled connections
+    # (and the aiosqlite threads) are released
+    job_queue.shutdown(wait=False)
+    engine.dispose()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    # Prometheus text exposition format, declared before the mounts so that "/" does not catch it
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
-Base.metadata.create_all(bind=engine)
 
 # Mount static files directory
 if os.path.exists("temp_ui/static"):
     app.mount("/static", StaticFiles(directory="temp_ui/static"), name="static")
 app.mount("/api/v1", webapi.api_v1)
-app.mount("/", temp_ui.ui)
\ No newline at end of file
+app.mount("/", temp_ui.ui)
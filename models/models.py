@@ -1,12 +1,17 @@
 # models.py - Fixed version
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, LargeBinary, Index, Boolean, JSON, func
 from sqlalchemy.orm import relationship, joinedload
 from database.database import Base
-from pydantic import BaseModel, ConfigDict
-from datetime import datetime
+from pydantic import BaseModel, ConfigDict, FiniteFloat
+from datetime import datetime, timezone
 from typing import Optional, List, Tuple
 
 
+def _utc_now():
+    # Clock of func.now() (CURRENT_TIMESTAMP is UTC in SQLite) with microseconds, so that quick edits still differ
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 # SQLAlchemy Models (Database)
 class ClimberEntity(Base):
     __tablename__ = "climber"
@@ -20,9 +25,12 @@ class ClimberEntity(Base):
     span = Column(Float)
     route_grade = Column(String)
     boulder_grade = Column(String)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
     workouts = relationship("WorkoutEntity", back_populates="climber")
 
+    __table_args__ = (Index("ix_climber_first_name_last_name", "first_name", "last_name"),)
+
 
 class MeasurementDeviceEntity(Base):
     __tablename__ = "measurement_device"
@@ -50,10 +58,10 @@ class WorkoutEntity(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     workout_name = Column(String, ForeignKey("workout_type.name"))
-    climber_id = Column(Integer, ForeignKey("climber.id"), index=True)
+    climber_id = Column(Integer, ForeignKey("climber.id"))
     body_weight = Column(Float)
     created_at = Column(DateTime)
-    updated_at = Column(DateTime)
+    updated_at = Column(DateTime, default=_utc_now, onupdate=_utc_now)
 
     climber = relationship("ClimberEntity", back_populates="workouts")
     workout_type = relationship("WorkoutTypeEntity", back_populates="workouts")
@@ -61,20 +69,23 @@ class WorkoutEntity(Base):
     critical_force_workouts = relationship("CriticalForceWorkoutEntity", back_populates="workout")
     max_iso_strength_workouts = relationship("MaxIsoStrengthWorkoutEntity", back_populates="workout")
 
+    __table_args__ = (Index("ix_workout_climber_id_created_at", "climber_id", "created_at"),)
+
 
 class MeasurementEntity(Base):
     __tablename__ = "measurement"
 
     id = Column(Integer, primary_key=True, index=True)
-    workout_id = Column(Integer, ForeignKey("workout.id"))
+    workout_id = Column(Integer, ForeignKey("workout.id"), index=True)
     measurement_device_id = Column(Integer, ForeignKey("measurement_device.id"))
     current_repetition = Column(Integer)
     created_at = Column(DateTime)
-    updated_at = Column(DateTime)
+    updated_at = Column(DateTime, default=_utc_now, onupdate=_utc_now)
 
     workout = relationship("WorkoutEntity", back_populates="measurements")
     measurement_device = relationship("MeasurementDeviceEntity", back_populates="measurements")
     measured_data = relationship("MeasuredDataEntity", back_populates="measurement")
+    measured_data_blob = relationship("MeasuredDataBlobEntity", back_populates="measurement", uselist=False)
 
 
 class MeasuredDataEntity(Base):
@@ -86,6 +97,17 @@ class MeasuredDataEntity(Base):
     measurement = relationship("MeasurementEntity", back_populates="measured_data")
 
 
+class MeasuredDataBlobEntity(Base):
+    __tablename__ = "measured_data_blob"
+
+    # All the samples of a measurement packed in a little-endian float array (see database/sample_storage.py)
+    measurement_id = Column(Integer, ForeignKey("measurement.id"), primary_key=True, index=True)
+    dtype = Column(String)
+    sample_count = Column(Integer)
+    data = Column(LargeBinary)
+    measurement = relationship("MeasurementEntity", back_populates="measured_data_blob")
+
+
 class CriticalForceWorkoutEntity(Base):
     __tablename__ = "critical_force_workout"
 
@@ -104,6 +126,90 @@ class MaxIsoStrengthWorkoutEntity(Base):
     workout = relationship("WorkoutEntity", back_populates="max_iso_strength_workouts")
 
 
+class MeasurementResultEntity(Base):
+    __tablename__ = "measurement_result"
+
+    # Results computed from the samples of a measurement, dropped whenever these samples change (see crud.py)
+    measurement_id = Column(Integer, ForeignKey("measurement.id"), primary_key=True, index=True)
+    algorithm_version = Column(Integer, primary_key=True)
+    critical_force = Column(Float)
+    w_prime = Column(Float)
+    max_force = Column(Float)
+    repetition_means = Column(LargeBinary)
+    computed_at = Column(DateTime)
+
+
+class ImportedFileEntity(Base):
+    __tablename__ = "imported_file"
+
+    content_hash = Column(String, primary_key=True, index=True)
+    filename = Column(String)
+    measurement_id = Column(Integer, ForeignKey("measurement.id"))
+    imported_at = Column(DateTime)
+
+
+class AnalyticsStaleClimberEntity(Base):
+    __tablename__ = "analytics_stale_climber"
+
+    # Climbers whose analytics rollups must be refreshed, queued once in the transaction that changes their data.
+    # change_count is bumped by the changes queued while the climber waits for a refresh.
+    id = Column(Integer, primary_key=True)
+    climber_id = Column(Integer, index=True, unique=True)
+    change_count = Column(Integer, nullable=False, default=1)
+
+
+class ClimberCriticalForceRollupEntity(Base):
+    __tablename__ = "climber_critical_force_rollup"
+
+    # Critical force / body weight ratios of a climber and its cohort values (see database/analytics.py)
+    climber_id = Column(Integer, ForeignKey("climber.id"), primary_key=True)
+    route_grade = Column(String, index=True)
+    boulder_grade = Column(String, index=True)
+    gender = Column(String, index=True)
+    age_band = Column(String, index=True)
+    workout_count = Column(Integer)
+    best_ratio = Column(Float)
+    mean_ratio = Column(Float)
+    last_workout_at = Column(DateTime)
+
+
+class CohortCriticalForceRollupEntity(Base):
+    __tablename__ = "cohort_critical_force_rollup"
+
+    dimension = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+    climber_count = Column(Integer)
+    workout_count = Column(Integer)
+    mean_ratio = Column(Float)
+    p25_ratio = Column(Float)
+    median_ratio = Column(Float)
+    p75_ratio = Column(Float)
+    p90_ratio = Column(Float)
+    max_ratio = Column(Float)
+    refreshed_at = Column(DateTime)
+
+
+class JobEntity(Base):
+    __tablename__ = "job"
+
+    # Background jobs of jobs/queue.py, status is one of queued, running, succeeded, failed, cancelled
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String)
+    params = Column(JSON)
+    status = Column(String, index=True)
+    progress = Column(Float, default=0.0)
+    message = Column(String)
+    result = Column(JSON)
+    error = Column(String)
+    cancel_requested = Column(Boolean, default=False)
+    # Worker process owning the job (jobs.queue.WORKER_ID), which refreshes heartbeat_at while the job is not finished
+    worker_id = Column(String)
+    heartbeat_at = Column(DateTime)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+
 # Pydantic Models (API)
 class MeasurementDeviceBase(BaseModel):
     sample_rate_hz: int
@@ -162,7 +268,7 @@ class WorkoutTypeCreate(WorkoutTypeBase):
 class MeasurementResponse(BaseModel):
     id: int
     workout_id: int
-    measurement_device_id: int
+    measurement_device_id: Optional[int] = None
     current_repetition: int
     created_at: datetime
     updated_at: datetime
@@ -174,7 +280,7 @@ class MeasurementResponse(BaseModel):
 
 class MeasurementCreate(BaseModel):
     workout_id: int
-    measurement_device_id: int
+    measurement_device_id: Optional[int] = None
     current_repetition: int
     created_at: datetime
     updated_at: datetime
@@ -183,7 +289,7 @@ class MeasurementCreate(BaseModel):
 class WorkoutBase(BaseModel):
     workout_name: str
     climber_id: int
-    body_weight: float
+    body_weight: Optional[float] = None
     created_at: datetime
     updated_at: datetime
     id: Optional[int] = None
@@ -206,6 +312,21 @@ class MeasuredDataCreate(MeasuredDataBase):
     pass
 
 
+class LiveMeasurementCreate(BaseModel):
+    climber_id: int
+    workout_name: str
+    body_weight: Optional[float] = None
+    measurement_device_id: Optional[int] = None
+
+
+# Message of the live measurement WebSocket, strict so that strings or booleans are not taken for weights
+class LiveSamplesMessage(BaseModel):
+    weights: List[FiniteFloat] = []
+    end: bool = False
+
+    model_config = ConfigDict(strict=True)
+
+
 class CriticalForceWorkoutBase(BaseModel):
     critical_force: float
     w_prime: float
@@ -227,4 +348,76 @@ class MaxIsoStrengthWorkoutBase(BaseModel):
 
 
 class MaxIsoStrengthWorkoutCreate(MaxIsoStrengthWorkoutBase):
-    pass
\ No newline at end of file
+    pass
+
+
+class CohortCriticalForceStats(BaseModel):
+    dimension: str
+    value: str
+    climber_count: int
+    workout_count: int
+    mean_ratio: float
+    p25_ratio: float
+    median_ratio: float
+    p75_ratio: float
+    p90_ratio: float
+    max_ratio: float
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ClimberCriticalForceRank(BaseModel):
+    climber_id: int
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    workout_count: int
+    best_ratio: float
+    mean_ratio: float
+    last_workout_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class CriticalForceTrendPoint(BaseModel):
+    workout_id: int
+    created_at: Optional[datetime] = None
+    body_weight: float
+    critical_force: float
+    ratio: float
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class MeasurementResultHistoryPoint(BaseModel):
+    workout_id: int
+    workout_name: Optional[str] = None
+    created_at: Optional[datetime] = None
+    measurement_id: int
+    critical_force: Optional[float] = None
+    w_prime: Optional[float] = None
+    max_force: Optional[float] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class JobCreate(BaseModel):
+    kind: str
+    params: dict = {}
+
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    params: Optional[dict] = None
+    status: str
+    progress: float
+    message: Optional[str] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    cancel_requested: bool
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,171 @@
+'''
+Process-wide metrics rendered in the Prometheus text exposition format by the /metrics endpoint of main.py.
+
+- HTTP latency histograms and status counters per route, recorded by monitoring.middleware,
+- SQL statement count and duration, recorded for every engine through SQLAlchemy cursor events,
+- checked-out connections, session lifetimes and connection leaks (see monitoring/sessions.py),
+- compute function calls and time, collected by compute.timing.
+
+Every gunicorn worker has its own registry: scrape the workers separately or run a single worker per port.
+'''
+import contextvars
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from compute.timing import computeTimes
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _format_labels(labelnames, labels, extra=()):
+    pairs = [*zip(labelnames, labels), *extra]
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, labels=(), amount: float = 1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, labels=(), amount: float = 1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount: float = 1):
+        self.inc(labels, -amount)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count of each bucket, sum, count]
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value: float, labels=()):
+        with _lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+            counts[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (bucket_counts, total, count) in sorted(self._values.items()):
+            cumulated = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulated += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', bound)])} {cumulated}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+http_requests = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = Histogram("http_request_duration_seconds", "HTTP request latency until the last body chunk",
+                                  ("method", "route"))
+http_request_statements = Histogram("http_request_sql_statements", "SQL statements executed by a request",
+                                    ("method", "route"), STATEMENT_COUNT_BUCKETS)
+sql_statements = Counter("sql_statements_total", "SQL statements executed")
+sql_statement_duration = Histogram("sql_statement_duration_seconds", "SQL statement execution time")
+db_connections_checked_out = Gauge("db_connections_checked_out", "Connections currently checked out of the pools")
+db_connection_hold_duration = Histogram("db_connection_hold_duration_seconds",
+                                        "Time between the checkout and the checkin of a connection")
+db_session_duration = Histogram("db_session_duration_seconds", "Lifetime of the request sessions", ("mode",))
+db_connection_leaks = Counter("db_connection_leaks_total", "Connections still checked out after their request",
+                              ("route",))
+
+
+def render_prometheus():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    lines.append("# HELP compute_calls_total Calls of the compute functions")
+    lines.append("# TYPE compute_calls_total counter")
+    lines.extend(f'compute_calls_total{{function="{name}"}} {calls}' for name, (calls, _) in sorted(computeTimes.items()))
+    lines.append("# HELP compute_seconds_total Time spent in the compute functions")
+    lines.append("# TYPE compute_seconds_total counter")
+    lines.extend(f'compute_seconds_total{{function="{name}"}} {seconds}'
+                 for name, (_, seconds) in sorted(computeTimes.items()))
+    return "\n".join(lines) + "\n"
+
+
+class RequestStatements:
+    """SQL statements of the current request, shared with the threadpool through the copied context"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+current_statements = contextvars.ContextVar("current_statements", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("statement_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["statement_start"].pop()
+    sql_statements.inc()
+    sql_statement_duration.observe(elapsed)
+    request_statements = current_statements.get()
+    if request_statements is not None:
+        request_statements.count += 1
+        request_statements.seconds += elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def _fail_statement(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("statement_start"):
+        connection.info["statement_start"].pop()
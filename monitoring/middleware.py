@@ -0,0 +1,126 @@
+'''
+ASGI middleware recording the metrics of every HTTP request (see monitoring/metrics.py).
+
+With REQUEST_PROFILING=1, `?profile=1` added to any URL runs that request under cProfile and replaces its response
+by a plain text summary: the functions taking the most cumulative time, and the SQL statements of the request.
+cProfile only sees the event loop thread, so the sync routes run in the threadpool show as a single await.
+
+Connections still checked out after a request are reported by monitoring/sessions.py. With SESSION_LEAK_DEBUG=1
+responses are held back until they are complete and replaced by a 500 when a connection leaked.
+'''
+import cProfile
+import io
+import os
+import pstats
+import time
+from urllib.parse import parse_qs
+
+from monitoring import metrics, sessions
+
+REQUEST_PROFILING = os.getenv("REQUEST_PROFILING", "0") == "1"
+PROFILE_LINES = 40
+
+
+def route_label(scope):
+    # Route template (/api/v1/climber/{climber_id}) rather than the path, to keep the label set bounded
+    route = scope.get("route")
+    if route is None or not hasattr(route, "path"):
+        return "unmatched"
+    return scope.get("root_path", "") + route.path
+
+
+def _leak_response(error):
+    # 500 replacing the response of a request whose sessions kept their connection, with their checkout stacks
+    body = str(error).encode()
+    return [{"type": "http.response.start", "status": 500,
+             "headers": [(b"content-type", b"text/plain; charset=utf-8"),
+                         (b"content-length", str(len(body)).encode())]},
+            {"type": "http.response.body", "body": body}]
+
+
+class MetricsMiddleware:
+    def __init__(self, app, profiling: bool = REQUEST_PROFILING):
+        self.app = app
+        self.profiling = profiling
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        if self.profiling and parse_qs(scope.get("query_string", b"").decode()).get("profile") == ["1"]:
+            return await self._profile(scope, receive, send)
+
+        statements = metrics.RequestStatements()
+        token = metrics.current_statements.set(statements)
+        connections = sessions.RequestConnections()
+        connections_token = sessions.current_connections.set(connections)
+        status = 500
+        start = time.perf_counter()
+        # With SESSION_LEAK_DEBUG the response is held back until its last body message, so that a leak replaces
+        # it by a 500 instead of only reaching the log
+        held = [] if sessions.SESSION_LEAK_DEBUG else None
+
+        async def send_and_record(message):
+            nonlocal status, held
+            if held is not None and message["type"] in ("http.response.start", "http.response.body"):
+                held.append(message)
+                if message["type"] == "http.response.start" or message.get("more_body", False):
+                    return
+                messages, held = held, None
+                try:
+                    sessions.check_request_connections(connections, f"{scope['method']} {route_label(scope)}")
+                except sessions.SessionLeakError as error:
+                    messages = _leak_response(error)
+                for held_message in messages:
+                    await send_and_record(held_message)
+                return
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            metrics.current_statements.reset(token)
+            sessions.current_connections.reset(connections_token)
+            labels = (scope["method"], route_label(scope))
+            metrics.http_request_duration.observe(time.perf_counter() - start, labels)
+            metrics.http_request_statements.observe(statements.count, labels)
+            metrics.http_requests.inc((*labels, str(status)))
+        if held is None and sessions.SESSION_LEAK_DEBUG:
+            return
+        # Once the whole response is sent, every session of the request must have returned its connection
+        sessions.check_request_connections(connections, " ".join(labels))
+
+    async def _profile(self, scope, receive, send):
+        statements = metrics.RequestStatements()
+        token = metrics.current_statements.set(statements)
+        status = 500
+        body_size = 0
+
+        async def discard(message):
+            nonlocal status, body_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                body_size += len(message.get("body", b""))
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            profiler.disable()
+            metrics.current_statements.reset(token)
+        elapsed = time.perf_counter() - start
+
+        report = io.StringIO()
+        report.write(f"{scope['method']} {route_label(scope)} -> {status}, {body_size} bytes in {elapsed * 1000:.1f} ms\n")
+        report.write(f"{statements.count} SQL statements, {statements.seconds * 1000:.1f} ms\n\n")
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        body = report.getvalue().encode()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/plain; charset=utf-8"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
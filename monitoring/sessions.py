@@ -0,0 +1,77 @@
+'''
+Connection tracking of the database sessions, to find the sessions that outlive their request.
+
+Every checkout of a pool (sync and async engines) is counted in db_connections_checked_out and its hold time is
+observed at checkin. MetricsMiddleware attributes the connections checked out while a request is handled to that
+request: a connection still checked out once the response is sent belongs to a session that was never closed
+(a SessionLocal() without close, a session kept by a task that outlives the request...). It is logged and counted
+in db_connection_leaks_total, and with SESSION_LEAK_DEBUG=1 the request fails with SessionLeakError, reporting
+where the connection was checked out (MetricsMiddleware holds the response back and answers a 500 instead).
+
+Routes get their session from the request-scoped dependencies of database/sessions.py, which close it before the
+response is sent.
+'''
+import contextvars
+import logging
+import os
+import time
+import traceback
+
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+from monitoring import metrics
+
+SESSION_LEAK_DEBUG = os.getenv("SESSION_LEAK_DEBUG", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
+
+class SessionLeakError(RuntimeError):
+    pass
+
+
+class RequestConnections:
+    """Connections checked out by the current request, shared with the threadpool through the copied context"""
+
+    def __init__(self):
+        # connection record -> stack of its checkout (SESSION_LEAK_DEBUG only)
+        self.checked_out = {}
+
+
+current_connections = contextvars.ContextVar("current_connections", default=None)
+
+
+@event.listens_for(Pool, "checkout")
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info["checked_out_at"] = time.perf_counter()
+    metrics.db_connections_checked_out.inc()
+    request_connections = current_connections.get()
+    if request_connections is not None:
+        stack = "".join(traceback.format_stack(limit=16)) if SESSION_LEAK_DEBUG else None
+        request_connections.checked_out[connection_record] = stack
+        connection_record.info["request_connections"] = request_connections
+
+
+@event.listens_for(Pool, "checkin")
+def _checkin(dbapi_connection, connection_record):
+    checked_out_at = connection_record.info.pop("checked_out_at", None)
+    if checked_out_at is None:
+        return
+    metrics.db_connections_checked_out.dec()
+    metrics.db_connection_hold_duration.observe(time.perf_counter() - checked_out_at)
+    request_connections = connection_record.info.pop("request_connections", None)
+    if request_connections is not None:
+        request_connections.checked_out.pop(connection_record, None)
+
+
+def check_request_connections(request_connections: RequestConnections, route: str):
+    """Report the connections of a finished request that were not returned to their pool"""
+    leaked = list(request_connections.checked_out.values())
+    if not leaked:
+        return
+    metrics.db_connection_leaks.inc((route,), len(leaked))
+    message = f"{len(leaked)} database connection(s) still checked out after {route}, a session outlived its request"
+    if SESSION_LEAK_DEBUG:
+        raise SessionLeakError("\n".join([message, *(f"Checked out at:\n{stack}" for stack in leaked)]))
+    logger.warning(message)
@@ -0,0 +1,138 @@
+'''
+Live weight streams of the bluetooth simulation.
+
+Each started stream has its own id, its own producer task and generator state. The producer runs once per stream
+and broadcasts its samples to every subscriber queue, so any number of viewers (coach screens) can follow a
+climber's live feed without duplicating the producer work.
+
+A stream started for a workout with a known protocol feeds its samples to an OnlineCriticalForce
+(compute/onlineCriticalForce.py): the sample ending a repetition carries its mean and the running critical force
+and W'.
+'''
+import asyncio
+import json
+import time
+import uuid
+
+# Samples kept for a viewer that does not read fast enough, older ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+SIMULATION_PERIOD = 0.1
+SIMULATION_SAMPLE_RATE = round(1 / SIMULATION_PERIOD)
+
+_END_OF_STREAM = None
+
+
+class LiveStream:
+    def __init__(self, climber_id=None, critical_force=None):
+        self.stream_id = uuid.uuid4().hex
+        self.climber_id = climber_id
+        self.critical_force = critical_force
+        self.weight = 0.0
+        self.subscribers = set()
+        self.task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, message):
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def cancel(self):
+        # Cancellation handle: stops the producer, subscribers then receive the end of the stream
+        if self.task is not None:
+            self.task.cancel()
+
+    def repetition_results(self, weight):
+        # Results of the repetition finished by this sample, nothing more once the protocol is over
+        tracker = self.critical_force
+        if tracker.position >= len(tracker.lookupRsmpl):
+            return {}
+        finished = tracker.feed([weight])
+        if not finished:
+            return {}
+        return {"repetition": finished[-1]["repetition"], "repetition_mean": float(finished[-1]["mean"]),
+                "critical_force": float(finished[-1]["criticalForce"]), "w_prime": float(finished[-1]["wPrime"])}
+
+    async def run_simulation(self):
+        try:
+            while True:
+                self.weight += (0.5 - (time.time() % 1)) / 2
+                self.weight = min(max(self.weight, 0.0), 100)
+                message = {"weight": self.weight}
+                if self.critical_force is not None:
+                    message.update(self.repetition_results(self.weight))
+                self.publish(message)
+                await asyncio.sleep(SIMULATION_PERIOD)
+        except asyncio.CancelledError:
+            print(f"Bluetooth simulation {self.stream_id} cancelled")
+        finally:
+            self.publish(_END_OF_STREAM)
+            print(f"Bluetooth simulation {self.stream_id} ended")
+
+
+class StreamRegistry:
+    def __init__(self):
+        self.streams = {}
+        self.climber_streams = {}
+
+    def start(self, climber_id=None, critical_force=None):
+        stream = LiveStream(climber_id, critical_force)
+        stream.task = asyncio.create_task(stream.run_simulation())
+        self.streams[stream.stream_id] = stream
+        if climber_id is not None:
+            self.climber_streams[climber_id] = stream.stream_id
+        return stream
+
+    def get(self, stream_id):
+        return self.streams.get(stream_id)
+
+    def get_for_climber(self, climber_id):
+        return self.streams.get(self.climber_streams.get(climber_id))
+
+    def stop(self, stream_id):
+        stream = self.streams.pop(stream_id, None)
+        if stream is None:
+            return False
+        if self.climber_streams.get(stream.climber_id) == stream_id:
+            del self.climber_streams[stream.climber_id]
+        stream.cancel()
+        return True
+
+
+def critical_force_tracker(workout_name: str, sample_rate: int = SIMULATION_SAMPLE_RATE):
+    """OnlineCriticalForce following the known protocol of a workout type (database/workout_protocols.py),
+    None when its protocol is not known. NumPy and the compute modules are only imported here."""
+    from compute.onlineCriticalForce import OnlineCriticalForce
+    from compute.protocol import compileLookupTable
+    from database.workout_protocols import KNOWN_PROTOCOLS, PROTOCOL_COLUMNS
+
+    protocol = KNOWN_PROTOCOLS.get(workout_name)
+    if protocol is None:
+        return None
+    lookup_table = compileLookupTable(*(protocol[column] for column in PROTOCOL_COLUMNS))
+    return OnlineCriticalForce(lookup_table, sample_rate, protocol["repetition_active"])
+
+
+async def ndjson_feed(stream: LiveStream, queue, first_message=None):
+    """Newline-delimited json lines of a subscriber queue, until the stream ends or the client disconnects"""
+    try:
+        if first_message is not None:
+            yield json.dumps(first_message) + "\n"
+        while True:
+            message = await queue.get()
+            if message is _END_OF_STREAM:
+                break
+            yield json.dumps(message) + "\n"
+    finally:
+        stream.unsubscribe(queue)
+
+
+registry = StreamRegistry()
@@ -1,23 +1,23 @@
 # temp_ui/temp_ui.py
-from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi import FastAPI, Request, HTTPException, Response, Query, Depends
 from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from database.database import SessionLocal
+from cache.response_cache import response_cache, climber_prefix, CLIMBER_LIST_PREFIX
+from compute.downsamplingMethods import LTTB, METHODS as DOWNSAMPLING_METHODS
+from database import async_crud
+from database.sessions import get_async_db
 from models import models
-from typing import List, Tuple
-from sqlalchemy.orm import joinedload
-import asyncio
-import json
-import time
+from sqlalchemy.ext.asyncio import AsyncSession
+from temp_ui import live_streams
+from typing import List, Optional, Tuple
 
 ui = FastAPI()
 
 # Configure Jinja2 templates
 templates = Jinja2Templates(directory="temp_ui/templates")
 
-# Bluetooth simulation variables
-python_connection_active = False
-python_weight_data = 0.0
+# Default maximum number of points per measurement graph
+DEFAULT_GRAPH_MAX_POINTS = 1000
 
 
 # Web routes (using Jinja2)
@@ -27,30 +27,64 @@ async def read_index(request: Request):
 
 
 @ui.get("/climbers", response_class=HTMLResponse)
-async def list_climbers(request: Request):
-    db = SessionLocal()
-    climbers: List[models.ClimberEntity] = db.query(models.ClimberEntity).all()
+async def list_climbers(request: Request, db: AsyncSession = Depends(get_async_db)):
+    count, updated_at = await async_crud.get_climbers_version(db)
+    cache_key = f"{CLIMBER_LIST_PREFIX}page:{count}:{updated_at}"
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return HTMLResponse(cached)
+    climbers: List[models.ClimberEntity] = await async_crud.get_climbers(db)
     climber_models: List[models.ClimberBase] = [
         models.ClimberBase.model_validate(climber) for climber in climbers
     ]
 
-    return templates.TemplateResponse("climbers.html", {"request": request, "climbers": climber_models})
+    page = templates.TemplateResponse("climbers.html", {"request": request, "climbers": climber_models})
+    response_cache.set(cache_key, page.body)
+    return page
 
 
 @ui.get("/climber/{climber_id}/workouts", response_class=HTMLResponse)
-async def climber_workouts(request: Request, climber_id: int):
-    db = SessionLocal()
+async def climber_workouts(request: Request, climber_id: int,
+                           max_points: int = Query(DEFAULT_GRAPH_MAX_POINTS, ge=0,
+                                                   description="Maximum points per graph, 0 for all samples"),
+                           method: str = Query(LTTB, alias="downsampling",
+                                               pattern=f"^({'|'.join(DOWNSAMPLING_METHODS)})$"),
+                           db: AsyncSession = Depends(get_async_db)):
+    updated_at = await async_crud.get_climber_version(db, climber_id)
+    cache_key = f"{climber_prefix(climber_id)}workouts:{updated_at}:{max_points}:{method}"
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return HTMLResponse(cached)
+    loaded = await load_climber_workouts(db, climber_id, max_points=max_points, method=method)
+    if loaded is None:
+        raise HTTPException(status_code=404, detail="Climber not found")
+    climber_model, workout_models = loaded
+
+    page = templates.TemplateResponse(
+        "climber_workouts.html",
+        {"request": request, "climber": climber_model, "workouts": workout_models},
+    )
+    response_cache.set(cache_key, page.body)
+    return page
 
-    # Get climber with a simple query
-    climber = db.query(models.ClimberEntity).filter(models.ClimberEntity.id == climber_id).first()
+
+async def load_climber_workouts(db, climber_id: int, max_points: int = 0, method: str = LTTB):
+    """Climber and workout models of the climber workouts page, built with a constant number of queries
+    whatever the number of workouts and measurements. Graphs are downsampled to `max_points` (0 keeps all samples).
+    Returns None if the climber does not exist."""
+    # NumPy comes with these modules, only imported once a page is built
+    from compute import downsampling
+    from database import async_sample_arrays, sample_arrays
+
+    climber = await async_crud.get_climber(db=db, climber_id=climber_id)
     if not climber:
-        raise HTTPException(status_code=404, detail="Climber not found")
+        return None
 
     # Create Pydantic model from the climber entity
     climber_model = models.ClimberBase.model_validate(climber)
 
-    # Get workouts with a separate query
-    workouts = db.query(models.WorkoutEntity).filter(models.WorkoutEntity.climber_id == climber_id).all()
+    workouts = await async_crud.get_climber_workouts_with_measurements(db=db, climber_id=climber_id)
+    measured_data_arrays = await async_sample_arrays.get_climber_measured_data_arrays(db=db, climber_id=climber_id)
 
     workout_models = []
     for workout in workouts:
@@ -67,14 +101,7 @@ async def climber_workouts(request: Request, climber_id: int):
 
         workout_model = models.WorkoutRead.model_validate(workout_dict)
 
-        # Now process measurements separately to avoid recursive issues
-        measurements_query = (
-            db.query(models.MeasurementEntity)
-            .options(joinedload(models.MeasurementEntity.measurement_device))
-            .filter(models.MeasurementEntity.workout_id == workout.id)
-        )
-
-        for measurement in measurements_query:
+        for measurement in workout.measurements:
             # Create a simple measurement response object
             measurement_dict = {
                 "id": measurement.id,
@@ -87,37 +114,28 @@ async def climber_workouts(request: Request, climber_id: int):
                     "id": measurement.measurement_device.id,
                     "sample_rate_hz": measurement.measurement_device.sample_rate_hz
                 } if measurement.measurement_device else None,
-                "measured_data_for_graph": [],  # Add this line
+                "measured_data_for_graph": [],
             }
 
             measurement_model = models.MeasurementResponse.model_validate(measurement_dict)
 
-            # Get measured data with a separate query to avoid recursive issues
             if measurement.measurement_device:
-                sample_rate_hz = measurement.measurement_device.sample_rate_hz
+                if measurement.measured_data_blob is not None:
+                    iterations, weights = sample_arrays.blob_arrays(measurement.measured_data_blob)
+                else:
+                    iterations, weights = measured_data_arrays.get(measurement.id, sample_arrays.empty_arrays())
 
-                # Get measured data directly with a simple query
-                measured_data = db.query(models.MeasuredDataEntity).filter(
-                    models.MeasuredDataEntity.measurement_id == measurement.id
-                ).all()
-
-                for data in measured_data:
-                    time = (data.iteration / sample_rate_hz)
-                    weight = data.weight
-                    measurement_model.measured_data_for_graph.append((time, weight))
+                # Vectorized time axis, assigned without re-validating every (time, weight) tuple
+                times = iterations / measurement.measurement_device.sample_rate_hz
+                times, weights = downsampling.downsample(times, weights, max_points, method)
+                measurement_model.measured_data_for_graph = list(zip(times.tolist(), weights.tolist()))
 
             # Add to workout measurements
             workout_model.measurements.append(measurement_model)
 
         workout_models.append(workout_model)
 
-    # Close the session
-    db.close()
-
-    return templates.TemplateResponse(
-        "climber_workouts.html",
-        {"request": request, "climber": climber_model, "workouts": workout_models},
-    )
+    return climber_model, workout_models
 
 
 @ui.get("/bluetooth_test", response_class=HTMLResponse)
@@ -125,40 +143,42 @@ async def bluetooth_test_page(request: Request):
     return templates.TemplateResponse("bluetooth_test.html", {"request": request})
 
 
-async def bluetooth_simulation_data_stream():
-    global python_connection_active
-    global python_weight_data
-    try:
-        while python_connection_active:
-            python_weight_data += (0.5 - (time.time() % 1)) / 2
-            if python_weight_data < 0:
-                python_weight_data = 0.0
-            if python_weight_data > 100:
-                python_weight_data = 100
-            data = {"weight": python_weight_data}
-            yield json.dumps(data) + "\n"
-            await asyncio.sleep(0.1)
-    except asyncio.CancelledError:
-        print("Bluetooth simulation cancelled")
-        python_connection_active = False
-    print("Bluetooth simulation ended")
-
-
 @ui.get("/start_bluetooth_python")
-async def start_bluetooth_python():
-    global python_connection_active
-    if not python_connection_active:
-        python_connection_active = True
-        return StreamingResponse(bluetooth_simulation_data_stream(), media_type="text/event-stream")
-    else:
-        raise HTTPException(status_code=409, detail="Bluetooth connection already active")
+async def start_bluetooth_python(climber_id: Optional[int] = None, workout: Optional[str] = None):
+    # Every connection gets its own stream, the first line carries its id for /stop_bluetooth_python.
+    # With a workout of known protocol, the lines ending a repetition also carry the running critical force.
+    critical_force = None
+    if workout is not None:
+        critical_force = live_streams.critical_force_tracker(workout)
+        if critical_force is None:
+            raise HTTPException(status_code=404, detail="No known protocol for this workout")
+    stream = live_streams.registry.start(climber_id, critical_force)
+    queue = stream.subscribe()
+
+    async def owner_feed():
+        try:
+            async for line in live_streams.ndjson_feed(stream, queue, {"stream_id": stream.stream_id}):
+                yield line
+        finally:
+            # The stream lives as long as the connection which started it
+            live_streams.registry.stop(stream.stream_id)
+
+    return StreamingResponse(owner_feed(), media_type="text/event-stream",
+                             headers={"X-Stream-Id": stream.stream_id})
+
+
+@ui.get("/climber/{climber_id}/live")
+async def watch_climber_live(climber_id: int):
+    # Viewers share the producer of the climber's stream
+    stream = live_streams.registry.get_for_climber(climber_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="No live stream for this climber")
+    return StreamingResponse(live_streams.ndjson_feed(stream, stream.subscribe()), media_type="text/event-stream")
 
 
 @ui.post("/stop_bluetooth_python")
-async def stop_bluetooth_python():
-    global python_connection_active
-    if python_connection_active:
-        python_connection_active = False
+async def stop_bluetooth_python(stream_id: str):
+    if live_streams.registry.stop(stream_id):
         return Response(status_code=200)
     else:
         raise HTTPException(status_code=409, detail="Bluetooth connection not active")
@@ -0,0 +1,70 @@
+'''
+Encoders of the binary export formats of the measured samples (see webapi/sample_formats.py), imported on first
+export with NumPy.
+'''
+import io
+import struct
+
+import numpy as np
+
+from webapi.sample_formats import ARROW, import_pyarrow
+
+RAW_HEADER = struct.Struct("<4sIIf")
+RAW_MAGIC = b"CGS1"
+
+
+def raw_frame(measurement_id: int, samples, sample_rate_hz):
+    samples = np.asarray(samples, dtype="<f4")
+    return RAW_HEADER.pack(RAW_MAGIC, measurement_id, len(samples), sample_rate_hz or 0) + samples.tobytes()
+
+
+def npy_file(samples):
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(samples), allow_pickle=False)
+    return buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    # File-like object collecting what the arrow writers write, drained after each measurement
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+class TableWriter:
+    """Arrow stream or parquet file written measurement by measurement: `write` and `close` return the bytes
+    produced so far, so that bulk exports are streamed"""
+
+    def __init__(self, format_name: str):
+        pa = import_pyarrow()
+        self._pa = pa
+        self._schema = pa.schema([("measurement_id", pa.int32()), ("iteration", pa.int32()),
+                                  ("weight", pa.float32())])
+        self._sink = _ChunkSink()
+        if format_name == ARROW:
+            self._writer = pa.ipc.new_stream(self._sink, self._schema)
+        else:
+            self._writer = pa.parquet.ParquetWriter(self._sink, self._schema)
+
+    def write(self, measurement_id: int, iterations, weights):
+        """Rows of a measurement, with its stored iterations (see database/sample_arrays.py)"""
+        self._writer.write_table(self._pa.table({
+            "measurement_id": np.full(len(weights), measurement_id, dtype=np.int32),
+            "iteration": np.asarray(iterations, dtype=np.int32),
+            "weight": np.asarray(weights, dtype=np.float32),
+        }, schema=self._schema))
+        return self._sink.drain()
+
+    def close(self):
+        self._writer.close()
+        return self._sink.drain()
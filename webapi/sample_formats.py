@@ -0,0 +1,59 @@
+'''
+Binary export formats of the measured samples, negotiated from the Accept header or forced with ?format=
+
+- raw (application/octet-stream): for each measurement a 16 bytes little-endian header
+  (magic b"CGS1", uint32 measurement id, uint32 sample count, float32 sample rate in Hz) followed by the samples
+  as little-endian float32. Bulk exports are the concatenation of these frames.
+- npy (application/x-npy): NumPy .npy file of a single measurement.
+- arrow (application/vnd.apache.arrow.stream) and parquet (application/vnd.apache.parquet): table of
+  (measurement_id, iteration, weight) columns, one record batch / row group per measurement. The iterations are
+  the stored ones (packed blobs are numbered from 1).
+  These two need the optional pyarrow package.
+
+The encoders, which need NumPy, are in webapi/sample_export.py.
+'''
+RAW = "raw"
+NPY = "npy"
+ARROW = "arrow"
+PARQUET = "parquet"
+
+MEDIA_TYPES = {
+    RAW: "application/octet-stream",
+    NPY: "application/x-npy",
+    ARROW: "application/vnd.apache.arrow.stream",
+    PARQUET: "application/vnd.apache.parquet",
+}
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+def negotiate(accept: str, format_name: str = None, formats=tuple(MEDIA_TYPES)):
+    """Export format from ?format= or else from the Accept header, raw when anything is accepted"""
+    if format_name is not None:
+        if format_name not in formats:
+            raise UnsupportedFormat(f"Unsupported format '{format_name}', expected one of {list(formats)}")
+        return format_name
+    for media_range in (accept or "*/*").split(","):
+        media_type = media_range.split(";")[0].strip()
+        if media_type in ("*/*", "application/*"):
+            return RAW
+        for name in formats:
+            if MEDIA_TYPES[name] == media_type:
+                return name
+    raise UnsupportedFormat(f"None of the accepted media types is available: {[MEDIA_TYPES[f] for f in formats]}")
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise UnsupportedFormat("The arrow and parquet formats need the pyarrow package")
+    return pyarrow
+
+
+def check_available(format_name: str):
+    if format_name in (ARROW, PARQUET):
+        import_pyarrow()
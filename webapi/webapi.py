@@ -1,44 +1,250 @@
 '''
 WebAPI endpoints that will be of future usage for frontend migration to a proper Javascript frontend framework
 '''
-from fastapi import FastAPI, HTTPException, Depends
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect, Request, Response, Query
+from fastapi.responses import StreamingResponse, FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from pydantic import TypeAdapter, ValidationError
+from typing import List, Optional
 
-from database import crud
-from database.database import SessionLocal
-from database.import_tool import extract_example_data_to_db
+from cache.response_cache import response_cache, CLIMBER_LIST_PREFIX
+from database import analytics, async_crud, crud, live_ingestion
+from database.database import AsyncSessionLocal
+from database.sessions import get_db, get_async_db
+from jobs.queue import job_queue, get_job, get_jobs, InvalidJob, SUCCEEDED
 from models import models
+from webapi import sample_formats
 
 api_v1 = FastAPI(title="Climb Grip Back API v1")
 
+logger = logging.getLogger(__name__)
+
+_climber_list_adapter = TypeAdapter(List[models.ClimberBase])
+
+# Bulk sample exports: at most SAMPLE_EXPORT_MAX_IDS measurements per request, loaded SAMPLE_EXPORT_CHUNK_SIZE at once
+SAMPLE_EXPORT_MAX_IDS = int(os.getenv("SAMPLE_EXPORT_MAX_IDS", "10000"))
+SAMPLE_EXPORT_CHUNK_SIZE = 500
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
 @api_v1.get("/climber/{climber_id}", response_model=models.ClimberBase)
-def get_climber(climber_id: int, db: Session = Depends(get_db)):
-    climber = crud.get_climber(db=db, climber_id=climber_id)
+async def get_climber(climber_id: int, db: AsyncSession = Depends(get_async_db)):
+    climber = await async_crud.get_climber(db=db, climber_id=climber_id)
     if climber is None:
         raise HTTPException(status_code=404, detail="Climber not found")
     return models.ClimberBase.model_validate(climber)
 
 
 @api_v1.get("/climber", response_model=List[models.ClimberBase])
-def get_all_climbers(db: Session = Depends(get_db)):
-    climbers = db.query(models.ClimberEntity).all()
+async def get_all_climbers(db: AsyncSession = Depends(get_async_db)):
+    count, updated_at = await async_crud.get_climbers_version(db)
+    cache_key = f"{CLIMBER_LIST_PREFIX}api:{count}:{updated_at}"
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return Response(cached, media_type="application/json")
+    climbers = await async_crud.get_climbers(db)
     if climbers is None:
         raise HTTPException(status_code=404, detail="Climbers not found")
-    return [models.ClimberBase.model_validate(climber) for climber in climbers]
+    body = _climber_list_adapter.dump_json([models.ClimberBase.model_validate(climber) for climber in climbers])
+    response_cache.set(cache_key, body)
+    return Response(body, media_type="application/json")
+
+
+_DIMENSION_PATTERN = f"^({'|'.join(analytics.DIMENSIONS)})$"
+
+
+@api_v1.get("/analytics/critical-force/cohorts", response_model=List[models.CohortCriticalForceStats])
+async def get_critical_force_cohorts(by: str = Query(..., pattern=_DIMENSION_PATTERN),
+                                     db: AsyncSession = Depends(get_async_db)):
+    """Count, mean, percentiles and max of the climbers' best critical force / body weight ratio per cohort"""
+    cohorts = await db.run_sync(analytics.get_cohort_stats, by)
+    return [models.CohortCriticalForceStats.model_validate(cohort) for cohort in cohorts]
+
+
+@api_v1.get("/analytics/critical-force/leaderboard", response_model=List[models.ClimberCriticalForceRank])
+async def get_critical_force_leaderboard(by: Optional[str] = Query(None, pattern=_DIMENSION_PATTERN),
+                                         value: Optional[str] = None, limit: int = Query(20, ge=1, le=500),
+                                         db: AsyncSession = Depends(get_async_db)):
+    """Climbers ranked by best critical force / body weight ratio, within the cohort `value` of `by` if given"""
+    if by is not None and value is None:
+        raise HTTPException(status_code=400, detail="value is required with by")
+    ranks = await db.run_sync(analytics.get_leaderboard, by, value, limit)
+    return [models.ClimberCriticalForceRank.model_validate(rank) for rank in ranks]
+
+
+@api_v1.get("/analytics/climber/{climber_id}/critical-force", response_model=List[models.CriticalForceTrendPoint])
+async def get_climber_critical_force_trend(climber_id: int, db: AsyncSession = Depends(get_async_db)):
+    if await async_crud.get_climber(db=db, climber_id=climber_id) is None:
+        raise HTTPException(status_code=404, detail="Climber not found")
+    points = await db.run_sync(analytics.get_climber_trend, climber_id)
+    return [models.CriticalForceTrendPoint.model_validate(point) for point in points]
+
+
+@api_v1.get("/climber/{climber_id}/results", response_model=List[models.MeasurementResultHistoryPoint])
+def get_climber_results(climber_id: int, db: Session = Depends(get_db)):
+    """Critical force, W' and max force of every workout of a climber, ordered by date. Results are computed on
+    the first request and then read from the measurement_result table."""
+    from database import workout_protocols
+
+    if crud.get_climber(db, climber_id) is None:
+        raise HTTPException(status_code=404, detail="Climber not found")
+    return [models.MeasurementResultHistoryPoint.model_validate(row._asdict())
+            for row in workout_protocols.get_climber_results(db, climber_id)]
+
+
+@api_v1.get("/cache/stats")
+async def get_cache_stats():
+    """Hit, miss and invalidation counters of the response cache"""
+    return response_cache.stats()
+
+
+@api_v1.get("/climbers")
+async def list_climbers(request: Request, response: Response, after: int = 0, limit: int = Query(50, ge=1, le=500),
+                        fields: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    """Keyset-paginated climbers, pass the returned `next_after` as `after` to get the next page"""
+    return await _paginated(request, response, db, models.ClimberEntity, fields, [], after, limit)
+
+
+@api_v1.get("/workouts")
+async def list_workouts(request: Request, response: Response, climber_id: Optional[int] = None, after: int = 0,
+                        limit: int = Query(50, ge=1, le=500), fields: Optional[str] = None,
+                        db: AsyncSession = Depends(get_async_db)):
+    filters = [] if climber_id is None else [models.WorkoutEntity.climber_id == climber_id]
+    return await _paginated(request, response, db, models.WorkoutEntity, fields, filters, after, limit)
+
+
+@api_v1.get("/measurements")
+async def list_measurements(request: Request, response: Response, workout_id: Optional[int] = None, after: int = 0,
+                            limit: int = Query(50, ge=1, le=500), fields: Optional[str] = None,
+                            db: AsyncSession = Depends(get_async_db)):
+    filters = [] if workout_id is None else [models.MeasurementEntity.workout_id == workout_id]
+    return await _paginated(request, response, db, models.MeasurementEntity, fields, filters, after, limit)
+
+
+async def _paginated(request: Request, response: Response, db: AsyncSession, entity, fields, filters, after, limit):
+    # ?fields= selects only the requested columns (the id is always returned, it is the pagination key)
+    table_columns = entity.__table__.columns
+    requested = [name.strip() for name in fields.split(",") if name.strip()] if fields else table_columns.keys()
+    names = ["id"] + [name for name in requested if name != "id"]
+    unknown = [name for name in names if name not in table_columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    # The ETag is computed from an aggregate of the page, unchanged pages are answered without loading the rows
+    count, last_id, last_update = await async_crud.get_page_version(db, entity, filters, after, limit)
+    version = f"{entity.__tablename__}:{','.join(names)}:{after}:{limit}:{count}:{last_id}:{last_update}"
+    etag = f'W/"{hashlib.sha1(version.encode()).hexdigest()}"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    rows = await async_crud.get_page(db, entity, [getattr(entity, name) for name in names], filters, after, limit)
+    return {
+        "items": [row._asdict() for row in rows],
+        "next_after": rows[-1].id if len(rows) == limit else None,
+    }
+
+
+def _etag_matches(if_none_match, etag):
+    # Weak comparison of the If-None-Match entries: W/ prefixes are ignored, * matches any existing page
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+@api_v1.get("/measurement/{measurement_id}/samples")
+async def get_measurement_samples(request: Request, measurement_id: int, format: Optional[str] = None,
+                                  db: AsyncSession = Depends(get_async_db)):
+    """Samples of a measurement as raw float32, .npy, arrow or parquet (see webapi/sample_formats.py)"""
+    from database import async_sample_arrays
+    from webapi import sample_export
+
+    format_name = _negotiate_export(request, format, tuple(sample_formats.MEDIA_TYPES))
+    measurement = await async_crud.get_measurement(db=db, measurement_id=measurement_id)
+    if measurement is None:
+        raise HTTPException(status_code=404, detail="Measurement not found")
+    iterations, samples = await async_sample_arrays.get_measurement_arrays(db=db, measurement_id=measurement_id)
+
+    if format_name == sample_formats.RAW:
+        sample_rate_hz = await _sample_rate_hz(db, measurement)
+        content = sample_export.raw_frame(measurement_id, samples, sample_rate_hz)
+    elif format_name == sample_formats.NPY:
+        content = sample_export.npy_file(samples)
+    else:
+        writer = sample_export.TableWriter(format_name)
+        content = writer.write(measurement_id, iterations, samples) + writer.close()
+    return Response(content=content, media_type=sample_formats.MEDIA_TYPES[format_name])
+
+
+@api_v1.get("/measurements/samples")
+async def get_bulk_measurement_samples(request: Request, ids: str, format: Optional[str] = None):
+    """Samples of many measurements (?ids=1,2,3) streamed one measurement at a time, as raw float32 frames
+    or as an arrow stream / parquet file. Unknown measurements are skipped. Each chunk of SAMPLE_EXPORT_CHUNK_SIZE
+    measurements is read in three queries: the measurements with their devices, the blobs and the rows."""
+    from database import async_sample_arrays, sample_arrays
+    from webapi import sample_export
+
+    format_name = _negotiate_export(request, format, (sample_formats.RAW, sample_formats.ARROW,
+                                                      sample_formats.PARQUET))
+    try:
+        measurement_ids = [int(measurement_id) for measurement_id in ids.split(",") if measurement_id]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of measurement ids")
+    if len(measurement_ids) > SAMPLE_EXPORT_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {SAMPLE_EXPORT_MAX_IDS} measurement ids per request")
+
+    async def stream():
+        writer = None if format_name == sample_formats.RAW else sample_export.TableWriter(format_name)
+        # The session lives as long as the streamed response, not as long as the request handler
+        async with AsyncSessionLocal() as db:
+            for start in range(0, len(measurement_ids), SAMPLE_EXPORT_CHUNK_SIZE):
+                chunk = measurement_ids[start:start + SAMPLE_EXPORT_CHUNK_SIZE]
+                measurements = await async_crud.get_measurements_with_devices(db, chunk)
+                arrays = await async_sample_arrays.get_measured_data_arrays(db, list(measurements))
+                for measurement_id in chunk:
+                    measurement = measurements.get(measurement_id)
+                    if measurement is None:
+                        continue
+                    iterations, samples = arrays.get(measurement_id, sample_arrays.empty_arrays())
+                    if writer is None:
+                        device = measurement.measurement_device
+                        yield sample_export.raw_frame(measurement_id, samples,
+                                                      device.sample_rate_hz if device else None)
+                    else:
+                        yield writer.write(measurement_id, iterations, samples)
+                # Only the current chunk stays in the identity map of the session
+                db.expunge_all()
+        if writer is not None:
+            yield writer.close()
+
+    return StreamingResponse(stream(), media_type=sample_formats.MEDIA_TYPES[format_name])
+
+
+def _negotiate_export(request: Request, format_name, formats):
+    try:
+        format_name = sample_formats.negotiate(request.headers.get("accept"), format_name, formats)
+        sample_formats.check_available(format_name)
+    except sample_formats.UnsupportedFormat as error:
+        raise HTTPException(status_code=406, detail=str(error))
+    return format_name
+
+
+async def _sample_rate_hz(db: AsyncSession, measurement):
+    if measurement.measurement_device_id is None:
+        return None
+    device = await async_crud.get_measurement_device(db=db, measurement_device_id=measurement.measurement_device_id)
+    return device.sample_rate_hz if device else None
 
 
 @api_v1.get("/test/climber/create-test")
-def create_test_climber(db: Session = Depends(get_db)):
+async def create_test_climber(db: AsyncSession = Depends(get_async_db)):
     climber = models.ClimberEntity(
         first_name="Test",
         last_name="Climber",
@@ -49,12 +255,140 @@ def create_test_climber(db: Session = Depends(get_db)):
         route_grade="7a",
         boulder_grade="7a",
     )
-    crud.create_climber(db=db, climber=climber)
+    await async_crud.create_climber(db=db, climber=climber)
 
     return {"message": "Test climber created"}
 
 
-@api_v1.get("/test/load-exemple-example_data")
+@api_v1.get("/test/load-exemple-example_data", status_code=202)
 def load_example_data(db: Session = Depends(get_db)):
-    extract_example_data_to_db()
-    return {"message": "exemple example_data loaded"}
\ No newline at end of file
+    """Start the import of the example files, follow it with GET /jobs/{job_id}"""
+    from database.import_tool import EXAMPLE_DATA_DIRECTORY
+
+    if not os.path.exists(EXAMPLE_DATA_DIRECTORY):
+        raise HTTPException(status_code=404, detail=f"Data directory '{EXAMPLE_DATA_DIRECTORY}' not found")
+    job = job_queue.submit(db, "import", {"directory": EXAMPLE_DATA_DIRECTORY, "workers": 1})
+    return {"message": "exemple example_data import started", "job_id": job.id}
+
+
+@api_v1.post("/jobs", response_model=models.JobResponse, status_code=202)
+def submit_job(job: models.JobCreate, db: Session = Depends(get_db)):
+    """Run an import, recompute or export job in the background (see jobs/tasks.py for their params)"""
+    try:
+        return job_queue.submit(db, job.kind, job.params)
+    except InvalidJob as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+@api_v1.get("/jobs", response_model=List[models.JobResponse])
+def list_jobs(status: Optional[str] = None, limit: int = Query(50, ge=1, le=500), db: Session = Depends(get_db)):
+    return get_jobs(db, status, limit)
+
+
+@api_v1.get("/jobs/{job_id}", response_model=models.JobResponse)
+def get_job_status(job_id: int, db: Session = Depends(get_db)):
+    job = get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@api_v1.post("/jobs/{job_id}/cancel", response_model=models.JobResponse)
+def cancel_job(job_id: int, db: Session = Depends(get_db)):
+    job = job_queue.cancel(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@api_v1.get("/jobs/{job_id}/file")
+def get_job_file(job_id: int, db: Session = Depends(get_db)):
+    """File written by a finished export job"""
+    job = get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.kind != "export" or job.status != SUCCEEDED or not os.path.exists(job.result["path"]):
+        raise HTTPException(status_code=409, detail="No file: the job is not a finished export")
+    return FileResponse(job.result["path"], media_type=sample_formats.MEDIA_TYPES[job.result["format"]],
+                        filename=os.path.basename(job.result["path"]))
+
+
+@api_v1.post("/live/measurement")
+async def create_live_measurement(live_measurement: models.LiveMeasurementCreate,
+                                  db: AsyncSession = Depends(get_async_db)):
+    if await async_crud.get_climber(db=db, climber_id=live_measurement.climber_id) is None:
+        raise HTTPException(status_code=404, detail="Climber not found")
+    now = datetime.now()
+    workout = await async_crud.create_workout(db=db, workout=models.WorkoutEntity(
+        workout_name=live_measurement.workout_name,
+        climber_id=live_measurement.climber_id,
+        body_weight=live_measurement.body_weight,
+        created_at=now,
+    ))
+    measurement = await async_crud.create_measurement(db=db, measurement=models.MeasurementEntity(
+        workout_id=workout.id,
+        measurement_device_id=live_measurement.measurement_device_id,
+        current_repetition=1,
+        created_at=now,
+    ))
+    return {"workout_id": workout.id, "measurement_id": measurement.id}
+
+
+@api_v1.websocket("/live/measurement/{measurement_id}")
+async def stream_live_measurement(websocket: WebSocket, measurement_id: int):
+    """Live samples of a measurement: the client sends {"weights": [...]} messages and {"end": true} when done,
+    the server answers {"stored": <number of stored samples>} before closing. An invalid message closes the
+    connection with the code 4400, samples that cannot be stored with 1011."""
+    await websocket.accept()
+    async with AsyncSessionLocal() as db:
+        measurement = await async_crud.get_measurement(db=db, measurement_id=measurement_id)
+    if measurement is None:
+        await websocket.close(code=4404, reason="Measurement not found")
+        return
+    try:
+        buffer = await live_ingestion.open_buffer(measurement_id)
+    except live_ingestion.MeasurementAlreadyStreaming:
+        await websocket.close(code=4409, reason="Measurement already streaming")
+        return
+
+    periodic_flush = asyncio.create_task(buffer.flush_periodically())
+    invalid_message = False
+    stored = True
+    try:
+        while True:
+            message = await _receive_live_message(websocket)
+            if message is None:
+                invalid_message = True
+                break
+            if message.weights:
+                await buffer.add(message.weights)
+            if message.end:
+                break
+    except WebSocketDisconnect:
+        return
+    finally:
+        periodic_flush.cancel()
+        try:
+            await live_ingestion.close_buffer(buffer)
+        except Exception:
+            logger.exception("Live samples of measurement %s could not be stored", measurement_id)
+            stored = False
+    if not stored:
+        await websocket.close(code=1011, reason="Samples could not be stored")
+    elif invalid_message:
+        await websocket.close(code=4400, reason='Invalid message, expected {"weights": [numbers], "end": true}')
+    else:
+        await websocket.send_json({"stored": buffer.stored})
+        await websocket.close()
+
+
+async def _receive_live_message(websocket: WebSocket):
+    # Validated LiveSamplesMessage, None when the message is not one
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    data = message.get("text") if message.get("text") is not None else message.get("bytes")
+    try:
+        return models.LiveSamplesMessage.model_validate_json(data or "")
+    except ValidationError:
+        return None